@@ -1,6 +1,11 @@
 import SimulateTrade
-from utils import ensure_dir_exist, archive_dir_folders
-import pandas as pd
+import chain_cache
+import iv_ranking
+import manifest
+import schema
+import day_files
+from utils import ensure_dir_exist, ArchiveWriter
+import concurrent.futures
 import time
 import os
 import zipfile
@@ -8,55 +13,137 @@ import datetime
 import sys
 
 DEST_DIR = ".\\FilteredCSVs"
+SOURCE_DIR = ".\\Source"
+MANIFEST_FILENAME = 'FilterManifest.sqlite'
+
+
+def filter_source_dir(src_dir, dest_dir, snp_symbols, archive_results=False, compression='deflate',
+                      compresslevel=None, day_format='csv'):
+    # Every day is read and filtered here while the day before it is written on a writer thread. With
+    # archive_results the days of a source zip are written straight into a zip of the same name in dest_dir, with the
+    # given compression (see utils.COMPRESSION_METHODS). Days filtered by an earlier run to the same kind of output
+    # are skipped while their source files are unchanged and their outputs are still there. day_format is one of day_files.DAY_FORMATS, the Arrow days are memory mapped by the
+    # simulator and are only written to a folder
+    if day_format != 'csv' and archive_results:
+        raise Exception(f'The {day_format} day files can not be archived, they are read from the destination folder.')
+    ensure_dir_exist(dest_dir)
+    conversion_manifest = manifest.ConversionManifest(os.path.join(dest_dir, MANIFEST_FILENAME))
+    output_kind = 'zip' if archive_results else day_format
+    pending_write = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        for curr_file in SimulateTrade.get_zip_files_in_folder(src_dir):
+            zip_file = os.path.join(src_dir, curr_file)
+            print(f'Filtering {zip_file}')
+            files_by_date = SimulateTrade.get_files_from_zip_by_date(zip_file)
+            output_path = os.path.join(dest_dir, os.path.basename(zip_file)) if archive_results else dest_dir
+            with zipfile.ZipFile(zip_file) as zip_file_obj:
+                for curr_date in files_by_date:
+                    date_info = files_by_date[curr_date]
+                    unit_key = manifest.get_unit_key(zip_file, date_info['year'], date_info['month'],
+                                                     date_info['day']) + f':{output_kind}'
+                    sources = manifest.get_member_hashes(zip_file_obj,
+                                                         [date_info['stockquotes'], date_info['options']])
+                    if conversion_manifest.get_state(unit_key, sources) == manifest.CURRENT and \
+                            manifest.are_outputs_written(conversion_manifest.get_outputs(unit_key)):
+                        print(f'Skipping {unit_key}, it was filtered before')
+                        continue
+
+                    filtered_files = filter_day(zip_file_obj, date_info, snp_symbols, executor,
+                                                day_files.DAY_FORMAT_EXTENSIONS[day_format])
+                    complete_write(pending_write, conversion_manifest)
+                    pending_write = (unit_key, sources, executor.submit(write_day, filtered_files, output_path,
+                                                                       compression, compresslevel))
+        complete_write(pending_write, conversion_manifest)
+    conversion_manifest.close()
+
+
+def complete_write(pending_write, conversion_manifest):
+    if pending_write is None:
+        return
+    (unit_key, sources, write) = pending_write
+    conversion_manifest.record(unit_key, sources, write.result())
+
+
+def filter_day(zip_file_obj, date_info, snp_symbols, executor, extension='.csv'):
+    # The output file name -> data of a day, the stock quotes are filtered on the executor while the options are
+    file_time = time.time()
+    day = date_info['day']
+    month = date_info['month']
+    year = date_info['year']
+    stocks_filter = executor.submit(filter_stock_quotes, zip_file_obj, date_info['stockquotes'], snp_symbols)
+
+    # The manifest skips the days filtered before, a cached chain would never be read again
+    snp_options = chain_cache.read_options(date_info['options'], snp_symbols, zip_file_obj, cache_dir=None)
+    zip_date = datetime.datetime(year=year, month=month, day=day)
+    snp_options = SimulateTrade.filter_tradable_options(snp_options, zip_date, 0, 8, 4)
+    # The simulator reads the IV ranking of its default window instead of calculating it
+    (min_days, max_days, maximum_iv) = iv_ranking.RANKING_WINDOW
+    ranking = iv_ranking.rank_options_by_iv(
+        SimulateTrade.filter_tradable_options(snp_options, zip_date, min_days, max_days, maximum_iv))
+
+    filtered_files = {f'stockquotes_{year}{month:02}{day:02}{extension}': stocks_filter.result(),
+                      f'options_{year}{month:02}{day:02}{extension}': snp_options,
+                      iv_ranking.get_ranking_path('', year, month, day, extension): ranking.reset_index()}
+    print(f'Filtering {year}{month:02}{day:02} took {time.time() - file_time} seconds')
+    return filtered_files
+
+
+def filter_stock_quotes(zip_file_obj, stock_quotes_file, snp_symbols):
+    stock_quotes_data = schema.read_stock_quotes(zip_file_obj.open(stock_quotes_file), symbols=snp_symbols)
+    return SimulateTrade.filter_equity_snp_symbols(stock_quotes_data, snp_symbols)
+
+
+def write_day(filtered_files, output_path, compression='deflate', compresslevel=None):
+    # output_path is a folder, or a zip the files are added to. Returns the files written
+    if not output_path.endswith('.zip'):
+        for (filename, data) in filtered_files.items():
+            if day_files.is_arrow_file(filename):
+                day_files.write_frame(data, os.path.join(output_path, filename))
+            else:
+                data.to_csv(os.path.join(output_path, filename), index=False)
+        return [os.path.join(output_path, filename) for filename in filtered_files]
+
+    # A new day is appended to the zip. A day filtered again is written with the members of the other days into a
+    # zip under a temporary name that replaces the old one, appending would leave both copies of its members
+    replace_day = False
+    kept_members = []
+    if os.path.exists(output_path):
+        with zipfile.ZipFile(output_path) as zip_file_obj:
+            member_names = zip_file_obj.namelist()
+            replace_day = any(filename in member_names for filename in filtered_files)
+            if replace_day:
+                kept_members = [(member_name, zip_file_obj.read(member_name)) for member_name in member_names
+                                if member_name not in filtered_files]
+    write_path = f'{output_path}.tmp' if replace_day else output_path
+    with ArchiveWriter(write_path, 'w' if replace_day else 'a', compression, compresslevel) as archive_writer:
+        for (member_name, member_data) in kept_members:
+            archive_writer.write_text(member_name, member_data)
+        for (filename, data) in filtered_files.items():
+            archive_writer.write_frame(filename, data)
+    if replace_day:
+        os.replace(write_path, output_path)
+    return [f'{output_path}:{filename}' for filename in filtered_files]
+
 
 if __name__ == '__main__':
-    src_dir = SimulateTrade.SOURCE_DIR
+    src_dir = SOURCE_DIR
     archive_results = False
+    compression = 'deflate'
+    compresslevel = None
+    day_format = 'csv'
     if len(sys.argv) > 1:
         src_dir = sys.argv[1]
     if len(sys.argv) > 2:
         archive_results = bool(sys.argv[2].lower())
+    if len(sys.argv) > 3:
+        compression = sys.argv[3]
+    if len(sys.argv) > 4:
+        compresslevel = int(sys.argv[4])
+    if len(sys.argv) > 5:
+        day_format = sys.argv[5]
 
     start_time = time.time()
     snp_500_symbols = SimulateTrade.get_snp_symbols(SimulateTrade.SNP_SYMBOLS_FILE_PATH)
-    zip_files = SimulateTrade.get_zip_files_in_folder(src_dir)
-    for curr_file in zip_files:
-        files_by_zip = {}
-        file_path = os.path.join(src_dir, curr_file)
-        files_by_zip[file_path] = SimulateTrade.get_files_from_zip_by_date(file_path)
-        for zip_file in files_by_zip:
-            print(f'Filtering {zip_file}')
-            dir_path = DEST_DIR if not archive_results else os.path.join(DEST_DIR, os.path.basename(os.path.splitext(zip_file)[0]))
-            ensure_dir_exist(dir_path)
-            zip_file_obj = zipfile.ZipFile(zip_file)
-            for curr_date in files_by_zip[zip_file]:
-                file_time = time.time()
-                date_info = files_by_zip[zip_file][curr_date]
-                day = date_info['day']
-                month = date_info['month']
-                year = date_info['year']
-                
-                stock_quotes_file = date_info['stockquotes']
-                stock_quotes_data = pd.read_csv(zip_file_obj.open(stock_quotes_file))
-                snp_quotes = SimulateTrade.filter_equity_snp_symbols(stock_quotes_data, snp_500_symbols)
-                snp_quotes.to_csv(os.path.join(dir_path, f'stockquotes_{year}{month:02}{day:02}.csv'),
-                                   index=False)
-                print(f'Filtering {zip_file}\\{stock_quotes_file} took {time.time() - file_time} seconds')
-
-                options_file = date_info['options']
-                options_data = pd.read_csv(zip_file_obj.open(options_file))
-                snp_options = SimulateTrade.filter_snp_symbols(options_data, snp_500_symbols)
-                snp_options['Expiration'] = pd.to_datetime(snp_options['Expiration'], format='%m/%d/%Y')
-                zip_date = datetime.datetime(year=year, month=month, day=day)
-                snp_options = SimulateTrade.filter_tradable_options(snp_options, zip_date, 0, 8, 4)
-                snp_options.to_csv(os.path.join(dir_path, f'options_{year}{month:02}{day:02}.csv'),
-                                   index=False)
-                print(f'Filtering {zip_file}\\{options_file} took {time.time() - file_time} seconds')
-
-   
-    if archive_results:
-        print('archiving output...')
-        archive_dir_folders(DEST_DIR)
-
+    filter_source_dir(src_dir, DEST_DIR, snp_500_symbols, archive_results, compression, compresslevel, day_format)
     end_time = time.time()
-    print("Processing took", end_time - start_time, "seconds")
\ No newline at end of file
+    print("Processing took", end_time - start_time, "seconds")
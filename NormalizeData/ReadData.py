@@ -29,38 +29,68 @@ import os
 from datetime import datetime
 import time
 import uuid
+import io
+import sys
+import functools
+import concurrent.futures
+import ingest
+import bar_synthesis
+import schema
+import daily_archive
+from utils import ArchiveWriter
 
 DEST_DIR = ".\\Destination"
 SOURCE_DIR = '.\\Source'
 SNP_SYMBOLS_FILE_PATH = ".\\snp500.txt"
 DAILY_TRADE_MINUTE_TIMESTAMP = 57480000
+MANIFEST_FILENAME = 'IngestManifest_minute.sqlite'
+OPTION_FILE_TYPES = ['openinterest', 'quote', 'trade']
+# The compression of the output zips, see utils.COMPRESSION_METHODS
+ZIP_COMPRESSION = 'deflate'
+ZIP_COMPRESSLEVEL = None
 
+# Output folders already created by this process
+created_dirs = set()
 
-def process_source_dir(source_dir, dest_dir, snp_symbols):
-    files_by_zip = {}
-    zip_files = get_files_in_folder(source_dir)
-    for curr_file in zip_files:
-        file_path = os.path.join(source_dir, curr_file)
-        files_by_zip[file_path] = get_files_from_zip_by_date(file_path)
-
-    for zip_file in files_by_zip:
-        zip_file_obj = zipfile.ZipFile(zip_file)
-        for curr_date in files_by_zip[zip_file]:
-            date_info = files_by_zip[zip_file][curr_date]
-            stock_quotes_file = date_info['stockquotes']
-            stock_quotes_data = pandas.read_csv(zip_file_obj.open(stock_quotes_file))
-            stocks_start = time.time()
-            process_stocks_file(stock_quotes_data, date_info['year'], date_info['month'], date_info['day'],
-                                dest_dir, snp_symbols)
-            stocks_end = time.time()
-            print(f'Processing stocks took {stocks_end - stocks_start} seconds')
-            options_file = date_info['options']
-            options_data = pandas.read_csv(zip_file_obj.open(options_file))
-            process_options_file(options_data, date_info['year'], date_info['month'], date_info['day'],
-                                dest_dir, snp_symbols)
-            print(f'Processing options took {time.time() - stocks_end} seconds')
-            break
-        break
+
+def process_source_dir(source_dir, dest_dir, snp_symbols, workers=1, bar_mode='single', resolution='minute'):
+    # Every date of every zip is converted on its own, by up to workers processes. With a bar_mode other than single
+    # the stocks get a bar for every minute (or hour) of the session and a daily file next to it
+    if bar_mode == 'single':
+        ingest.run(source_dir, dest_dir, snp_symbols, get_files_from_zip_by_date, convert_date, workers=workers,
+                   manifest_path=os.path.join(dest_dir, MANIFEST_FILENAME))
+        return
+
+    # The daily (and hour) rows are merged into one zip per symbol like ReadDataDaily does
+    symbol_archives = daily_archive.DailyArchive(ZIP_COMPRESSION, ZIP_COMPRESSLEVEL)
+    ingest.run(source_dir, dest_dir, snp_symbols, get_files_from_zip_by_date,
+               functools.partial(convert_date, bar_mode=bar_mode, resolution=resolution), symbol_archives.add_rows,
+               workers, os.path.join(dest_dir, f'IngestManifest_{resolution}_{bar_mode}.sqlite'),
+               flush_results=functools.partial(symbol_archives.write, workers))
+
+
+def convert_date(zip_path, date_info, dest_dir, snp_symbols, bar_mode='single', resolution='minute'):
+    # Returns the files written and the rows to append to the daily (and hour) files of the stocks
+    zip_file_obj = zipfile.ZipFile(zip_path)
+    stock_quotes_file = date_info['stockquotes']
+    stock_quotes_data = schema.read_stock_quotes(zip_file_obj.open(stock_quotes_file), symbols=snp_symbols)
+    options_file = date_info['options']
+    options_data = schema.read_options(zip_file_obj.open(options_file), symbols=snp_symbols)
+    zip_file_obj.close()
+    rows = dict()
+    stocks_start = time.time()
+    if bar_mode == 'single':
+        outputs = process_stocks_file(stock_quotes_data, date_info['year'], date_info['month'], date_info['day'],
+                                      dest_dir, snp_symbols)
+    else:
+        (outputs, rows) = process_stocks_bars(stock_quotes_data, date_info['year'], date_info['month'],
+                                              date_info['day'], dest_dir, snp_symbols, bar_mode, resolution)
+    stocks_end = time.time()
+    print(f'Processing stocks took {stocks_end - stocks_start} seconds')
+    outputs.extend(process_options_file(options_data, date_info['year'], date_info['month'], date_info['day'],
+                                        dest_dir, snp_symbols))
+    print(f'Processing options took {time.time() - stocks_end} seconds')
+    return {'outputs': outputs, 'rows': rows}
 
 
 def get_snp_symbols(snp_500_filename):
@@ -106,109 +136,171 @@ def get_files_from_zip_by_date(zip_path):
 
 def process_stocks_file(stocks_data, year, month, day, dest_folder, snp_symbols):
     print(f'Handling stocks for {day}/{month}/{year}')
-    for index, row in stocks_data.iterrows():
-        symbol = row['symbol']
-        if symbol in snp_symbols:
-            print(f'Handling the stock {symbol} at {day}/{month}/{year}')
-            open_price = row['open'] * 10000
-            high_price = row['high'] * 10000
-            low_price = row['low'] * 10000
-            close_price = row['close'] * 10000
-            volume = row['volume']
+    # The last row of a symbol is the one written, as when every row rewrote the symbol zip
+    stocks_data = stocks_data[stocks_data['symbol'].isin(snp_symbols)].drop_duplicates('symbol', keep='last')
+    symbols = stocks_data['symbol'].tolist()
+    open_prices = (stocks_data['open'] * 10000).tolist()
+    high_prices = (stocks_data['high'] * 10000).tolist()
+    low_prices = (stocks_data['low'] * 10000).tolist()
+    close_prices = (stocks_data['close'] * 10000).tolist()
+    volumes = stocks_data['volume'].tolist()
+
+    file_prefix = f'{year}{month:02}{day:02}'
+    write_plan = []
+    for (symbol, open_price, high_price, low_price, close_price, volume) in zip(symbols, open_prices, high_prices,
+                                                                                low_prices, close_prices, volumes):
+        zip_dir = os.path.join(dest_folder, 'equity', 'usa', 'minute', symbol.lower())
+        write_plan.append((zip_dir, os.path.join(zip_dir, f'{file_prefix}_trade.zip'),
+                           f'{file_prefix}_{symbol.lower()}_minute_trade.csv',
+                           f'{DAILY_TRADE_MINUTE_TIMESTAMP},{open_price},{high_price},{low_price},{close_price},'
+                           f'{volume}'))
+
+    outputs = []
+    for (zip_dir, zip_path, stockquote_filename, stockquote_row) in write_plan:
+        if ensure_output_dir(zip_dir):
+            write_zip(zip_path, [(stockquote_filename, stockquote_row)])
+            outputs.append(zip_path)
+    print(f'Wrote {len(write_plan)} stocks for {day}/{month}/{year}')
+    return outputs
+
+
+def process_stocks_bars(stocks_data, year, month, day, dest_folder, snp_symbols, bar_mode, resolution):
+    # Writes the synthesized minute bars of every stock and returns the files written, the hour bars and the daily bar
+    # are returned as rows to append to the per symbol files
+    print(f'Handling stock bars for {day}/{month}/{year}')
+    stocks_data = stocks_data[stocks_data['symbol'].isin(snp_symbols)].drop_duplicates('symbol', keep='last')
+    symbols = stocks_data['symbol'].tolist()
+    open_prices = (stocks_data['open'] * 10000).values
+    high_prices = (stocks_data['high'] * 10000).values
+    low_prices = (stocks_data['low'] * 10000).values
+    close_prices = (stocks_data['close'] * 10000).values
+    volumes = stocks_data['volume'].values
+
+    file_prefix = f'{year}{month:02}{day:02}'
+    bar_times = bar_synthesis.get_bar_times(resolution)
+    if resolution == 'hour':
+        bar_labels = [bar_synthesis.format_bar_time(file_prefix, bar_time) for bar_time in bar_times.tolist()]
+    else:
+        bar_labels = bar_times.tolist()
+    bars = bar_synthesis.synthesize_bars(open_prices, high_prices, low_prices, close_prices, volumes,
+                                         len(bar_times), bar_mode)
+
+    outputs = []
+    rows = dict()
+    for (index, symbol) in enumerate(symbols):
+        bar_rows = [f'{bar_label},{open_price},{high_price},{low_price},{close_price},{volume}\n'
+                    for (bar_label, open_price, high_price, low_price, close_price, volume) in
+                    zip(bar_labels, bars['open'][index].tolist(), bars['high'][index].tolist(),
+                        bars['low'][index].tolist(), bars['close'][index].tolist(), bars['volume'][index].tolist())]
+        if resolution == 'hour':
+            rows[os.path.join(dest_folder, 'equity', 'usa', 'hour', f'{symbol.lower()}.csv')] = bar_rows
+        else:
             zip_dir = os.path.join(dest_folder, 'equity', 'usa', 'minute', symbol.lower())
-            dir_created = True
-            try:
-                if not os.path.exists(zip_dir):
-                    os.makedirs(zip_dir)
-            except Exception as e:
-                print("directory exception:", e)
-                dir_created = False
-            if dir_created:
-                zip_path = os.path.join(zip_dir, f'{year}{month:02}{day:02}_trade.zip')
-                zip_file_handle = zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED)
-                stockquote_filename = f'{year}{month:02}{day:02}_{symbol.lower()}_minute_trade.csv'
-                zip_file_handle.writestr(stockquote_filename,
-                                         f'{DAILY_TRADE_MINUTE_TIMESTAMP},{open_price},{high_price},{low_price},'
-                                         f'{close_price},{volume}')
-                zip_file_handle.close()
+            if ensure_output_dir(zip_dir):
+                zip_path = os.path.join(zip_dir, f'{file_prefix}_trade.zip')
+                write_zip(zip_path, [(f'{file_prefix}_{symbol.lower()}_minute_trade.csv', ''.join(bar_rows))])
+                outputs.append(zip_path)
+        rows[os.path.join(dest_folder, 'equity', 'usa', 'daily', f'{symbol.lower()}.csv')] = [
+            f'{file_prefix} 00:00,{open_prices[index]},{high_prices[index]},{low_prices[index]},'
+            f'{close_prices[index]},{volumes[index]}\n']
+    print(f'Wrote {len(symbols)} stock bars for {day}/{month}/{year}')
+    return outputs, rows
+
+
+def ensure_output_dir(dir_path):
+    # The symbol folders are created once per process
+    if dir_path in created_dirs:
+        return True
+    try:
+        if not os.path.exists(dir_path):
+            # Other workers may create it at the same time
+            os.makedirs(dir_path, exist_ok=True)
+    except Exception as e:
+        print("directory exception:", e)
+        return False
+    created_dirs.add(dir_path)
+    return True
 
 
 def process_options_file(options_data, year, month, day, dest_folder, snp_symbols):
+    # The whole chain is written underlying after underlying, the three zips of an underlying are compressed at the
+    # same time and only one underlying is kept formatted in memory. Returns the files written
     print(f'Handling options for {day}/{month}/{year}')
+    outputs = []
     file_prefix = f'{year}{month:02}{day:02}'
-    format_str = "{}"
-    zip_format_string = f'{file_prefix}_{format_str}_american.zip'
-    curr_stock_symbol = ''
-    open_interest_zip_handle = None
-    quote_zip_handle = None
-    trade_zip_handle = None
-    option_index = 0
-    for index, row in options_data.iterrows():
-        if option_index > 50:
-            break
-        stock_symbol = row['UnderlyingSymbol']
-        if stock_symbol in snp_symbols:
-            if stock_symbol != curr_stock_symbol:
-                print(f'Handling the options for {stock_symbol} on {day}/{month}/{year}')
-                if open_interest_zip_handle:
-                    open_interest_zip_handle.close()
-                if quote_zip_handle:
-                    quote_zip_handle.close()
-                if trade_zip_handle:
-                    trade_zip_handle.close()
-                output_path = os.path.join(dest_folder, 'option', 'usa', 'minute', stock_symbol.lower())
-                dir_created = True
-                try:
-                    if not os.path.exists(output_path):
-                        os.makedirs(output_path)
-                except Exception as e:
-                    print("directory exception:", e)
-                    dir_created = False
-                if dir_created:
-                    option_index += 1
-                    curr_stock_symbol = stock_symbol
-                    open_interest_zip_path = os.path.join(output_path, zip_format_string.format("openinterest"))
-                    open_interest_zip_handle = zipfile.ZipFile(open_interest_zip_path, 'w', zipfile.ZIP_DEFLATED)
-                    quote_zip_path = os.path.join(output_path, zip_format_string.format("quote"))
-                    quote_zip_handle = zipfile.ZipFile(quote_zip_path, 'w', zipfile.ZIP_DEFLATED)
-                    trade_zip_path = os.path.join(output_path, zip_format_string.format("trade"))
-                    trade_zip_handle = zipfile.ZipFile(trade_zip_path, 'w', zipfile.ZIP_DEFLATED)
-            if open_interest_zip_handle and quote_zip_handle and trade_zip_handle:
-                expiration_date = datetime.strptime(row['Expiration'], "%m/%d/%Y")
-                csv_file_template = f'{file_prefix}_{stock_symbol.lower()}_minute_{format_str}_american_' \
-                                    f'{row["Type"]}_{int(float(row["Strike"]) * 10000)}_{expiration_date.year}' \
-                                    f'{expiration_date.month:02}{expiration_date.day:02}.csv'
-                open_interest_row = f'{DAILY_TRADE_MINUTE_TIMESTAMP},{row["OpenInterest"]}'
-                open_interest_csv = csv_file_template.format("openinterest")
-                open_interest_zip_handle.writestr(open_interest_csv, open_interest_row)
-
-                option_quote_bid = row['Bid'] * 10000
-                option_quote_ask = row['Ask'] * 10000
-                option_quote_half_volume = int(row['Volume'] / 2)
-                iv = row['IV']
-                quote_row = f'{DAILY_TRADE_MINUTE_TIMESTAMP},{option_quote_bid},{option_quote_bid},{option_quote_bid}' \
-                            f',{option_quote_bid},{option_quote_half_volume},{option_quote_ask},{option_quote_ask},' \
-                            f'{option_quote_ask},{option_quote_ask},{option_quote_half_volume},{iv}'
-                quote_csv = csv_file_template.format("quote")
-                quote_zip_handle.writestr(quote_csv, quote_row)
-
-                option_trade_last = row['Last'] * 10000
-                trade_row = f'{DAILY_TRADE_MINUTE_TIMESTAMP},{option_trade_last},{option_trade_last},' \
-                            f'{option_trade_last},{option_trade_last},{row["Volume"]}'
-                trade_csv = csv_file_template.format("trade")
-                trade_zip_handle.writestr(trade_csv, trade_row)
-
-    if open_interest_zip_handle:
-        open_interest_zip_handle.close()
-    if quote_zip_handle:
-        quote_zip_handle.close()
-    if trade_zip_handle:
-        trade_zip_handle.close()
+    options_data = options_data[options_data['UnderlyingSymbol'].isin(snp_symbols)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(OPTION_FILE_TYPES)) as executor:
+        for (stock_symbol, symbol_options) in options_data.groupby('UnderlyingSymbol', sort=False, observed=True):
+            output_path = os.path.join(dest_folder, 'option', 'usa', 'minute', stock_symbol.lower())
+            if not ensure_output_dir(output_path):
+                continue
+            print(f'Handling the options for {stock_symbol} on {day}/{month}/{year}')
+            option_files = get_option_files(symbol_options, file_prefix, stock_symbol)
+            zip_paths = [os.path.join(output_path, f'{file_prefix}_{file_type}_american.zip')
+                         for file_type in OPTION_FILE_TYPES]
+            writes = [executor.submit(write_zip, zip_path, option_files[file_type])
+                      for (zip_path, file_type) in zip(zip_paths, OPTION_FILE_TYPES)]
+            for write in writes:
+                write.result()
+            outputs.extend(zip_paths)
+    return outputs
+
+
+def get_option_files(symbol_options, file_prefix, stock_symbol):
+    # The (csv name, row) of every option of the underlying, per file type
+    expirations = pandas.to_datetime(symbol_options['Expiration'],
+                                     format=schema.EXPIRATION_FORMAT).dt.strftime('%Y%m%d').tolist()
+    strikes = (symbol_options['Strike'].astype(float) * 10000).astype(int).tolist()
+    option_types = symbol_options['Type'].tolist()
+    open_interests = symbol_options['OpenInterest'].tolist()
+    bids = (symbol_options['Bid'] * 10000).tolist()
+    asks = (symbol_options['Ask'] * 10000).tolist()
+    volumes = symbol_options['Volume'].tolist()
+    half_volumes = (symbol_options['Volume'] / 2).astype(int).tolist()
+    ivs = symbol_options['IV'].tolist()
+    lasts = (symbol_options['Last'] * 10000).tolist()
+
+    csv_prefix = f'{file_prefix}_{stock_symbol.lower()}_minute'
+    csv_suffixes = [f'american_{option_type}_{strike}_{expiration}.csv'
+                    for (option_type, strike, expiration) in zip(option_types, strikes, expirations)]
+    return {'openinterest': [(f'{csv_prefix}_openinterest_{csv_suffix}',
+                              f'{DAILY_TRADE_MINUTE_TIMESTAMP},{open_interest}')
+                             for (csv_suffix, open_interest) in zip(csv_suffixes, open_interests)],
+            'quote': [(f'{csv_prefix}_quote_{csv_suffix}',
+                       f'{DAILY_TRADE_MINUTE_TIMESTAMP},{bid},{bid},{bid},{bid},{half_volume},{ask},{ask},{ask},{ask},'
+                       f'{half_volume},{iv}')
+                      for (csv_suffix, bid, ask, half_volume, iv) in zip(csv_suffixes, bids, asks, half_volumes, ivs)],
+            'trade': [(f'{csv_prefix}_trade_{csv_suffix}',
+                       f'{DAILY_TRADE_MINUTE_TIMESTAMP},{last},{last},{last},{last},{volume}')
+                      for (csv_suffix, last, volume) in zip(csv_suffixes, lasts, volumes)]}
+
+
+def write_zip(zip_path, csv_files):
+    # The members are compressed in memory, only writing the finished zip to disk waits for the other workers
+    zip_buffer = io.BytesIO()
+    with ArchiveWriter(zip_buffer, compression=ZIP_COMPRESSION, compresslevel=ZIP_COMPRESSLEVEL) as archive_writer:
+        for (csv_name, csv_row) in csv_files:
+            archive_writer.write_text(csv_name, csv_row)
+    with ingest.output_writes():
+        with open(zip_path, 'wb') as zip_file:
+            zip_file.write(zip_buffer.getvalue())
 
 
 if __name__ == '__main__':
     start_time = time.time()
     snp_500_symbols = get_snp_symbols(SNP_SYMBOLS_FILE_PATH)
-    process_source_dir(SOURCE_DIR, DEST_DIR, snp_500_symbols)
+    src_dir = SOURCE_DIR
+    workers = 1
+    bar_mode = 'single'
+    resolution = 'minute'
+    if len(sys.argv) > 1:
+        src_dir = sys.argv[1]
+    if len(sys.argv) > 2:
+        workers = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        bar_mode = sys.argv[3]
+    if len(sys.argv) > 4:
+        resolution = sys.argv[4]
+    process_source_dir(src_dir, DEST_DIR, snp_500_symbols, workers, bar_mode, resolution)
     end_time = time.time()
     print("Processing took", end_time - start_time, "seconds")
@@ -29,44 +29,46 @@ import os
 from datetime import datetime
 import time
 import uuid
-from utils import ensure_dir_exist, archive_dir_folders, archive_dir_files
 import sys
+import functools
+import ingest
+import schema
+import daily_archive
 
 DEST_DIR = ".\\Destination"
 SOURCE_DIR = '.\\Source'
 SNP_SYMBOLS_FILE_PATH = ".\\snp500.txt"
+MANIFEST_FILENAME = 'IngestManifest_daily.sqlite'
+
+
+def process_source_dir(source_dir, dest_dir, snp_symbols, workers=1):
+    # Every date of every zip is converted to rows by up to workers processes. The rows of the dates are merged into
+    # one zip per symbol (and one per underlying and option file type) in batches of days, with the rows of the
+    # earlier runs, so a new or changed day only replaces its own rows
+    symbol_archives = daily_archive.DailyArchive()
+    ingest.run(source_dir, dest_dir, snp_symbols, get_files_from_zip_by_date, convert_date, symbol_archives.add_rows,
+               workers, os.path.join(dest_dir, MANIFEST_FILENAME),
+               flush_results=functools.partial(symbol_archives.write, workers))
+
+
+def convert_date(zip_path, date_info, dest_dir, snp_symbols):
+    zip_file_obj = zipfile.ZipFile(zip_path)
+    stock_quotes_file = date_info['stockquotes']
+    stock_quotes_data = schema.read_stock_quotes(zip_file_obj.open(stock_quotes_file), symbols=snp_symbols)
+    stocks_start = time.time()
+    rows = get_stocks_rows(stock_quotes_data, date_info['year'], date_info['month'], date_info['day'], dest_dir,
+                           snp_symbols)
+    stocks_end = time.time()
+    print(f'Processing stocks took {stocks_end - stocks_start} seconds')
+    options_file = date_info['options']
+    options_data = schema.read_options(zip_file_obj.open(options_file), symbols=snp_symbols)
+    zip_file_obj.close()
+    rows.update(get_options_rows(options_data, date_info['year'], date_info['month'], date_info['day'], dest_dir,
+                                 snp_symbols))
+    print(f'Processing options took {time.time() - stocks_end} seconds')
+    return {'rows': rows}
 
 
-def process_source_dir(source_dir, dest_dir, snp_symbols):
-    files_by_zip = {}
-    zip_files = get_files_in_folder(source_dir)
-    for curr_file in zip_files:
-        file_path = os.path.join(source_dir, curr_file)
-        files_by_zip[file_path] = get_files_from_zip_by_date(file_path)
-
-    for zip_file in files_by_zip:
-        zip_file_obj = zipfile.ZipFile(zip_file)
-        for curr_date in files_by_zip[zip_file]:
-            date_info = files_by_zip[zip_file][curr_date]
-            stock_quotes_file = date_info['stockquotes']
-            stock_quotes_data = pandas.read_csv(zip_file_obj.open(stock_quotes_file))
-            stocks_start = time.time()
-            process_stocks_file(stock_quotes_data, date_info['year'], date_info['month'], date_info['day'],
-                                dest_dir, snp_symbols)
-            stocks_end = time.time()
-            print(f'Processing stocks took {stocks_end - stocks_start} seconds')
-            options_file = date_info['options']
-            options_data = pandas.read_csv(zip_file_obj.open(options_file))
-            process_options_file(options_data, date_info['year'], date_info['month'], date_info['day'],
-                                dest_dir, snp_symbols)
-            print(f'Processing options took {time.time() - stocks_end} seconds')
-    
-    print('archiving output...')
-    equity_out_dir = os.path.join(dest_dir, 'equity', 'usa', 'daily')
-    archive_dir_files(equity_out_dir)
-    options_out_dir = os.path.join(dest_dir, 'option', 'usa', 'daily')
-    archive_dir_folders(options_out_dir)
-
 def get_snp_symbols(snp_500_filename):
     snp_set = set()
     with open(snp_500_filename) as snp_file:
@@ -107,10 +109,10 @@ def get_files_from_zip_by_date(zip_path):
     return files_in_date
 
 
-def process_stocks_file(stocks_data, year, month, day, dest_folder, snp_symbols):
+def get_stocks_rows(stocks_data, year, month, day, dest_folder, snp_symbols):
     print(f'Handling stocks for {day}/{month}/{year}')
     out_dir = os.path.join(dest_folder, 'equity', 'usa', 'daily')
-    ensure_dir_exist(out_dir)
+    rows = dict()
 
     for index, row in stocks_data.iterrows():
         symbol = row['symbol']
@@ -124,17 +126,17 @@ def process_stocks_file(stocks_data, year, month, day, dest_folder, snp_symbols)
             stockquote_filename = os.path.join(out_dir, f'{symbol.lower()}.csv')
             cur_date = f'{year}{month:02}{day:02} 00:00'
             stock_row = f'{cur_date},{open_price},{high_price},{low_price},{close_price},{volume}\n'
-            with open(stockquote_filename, "a") as stock_csv_file:
-                stock_csv_file.write(stock_row)
+            rows.setdefault(stockquote_filename, []).append(stock_row)
+    return rows
 
 
-def process_options_file(options_data, year, month, day, dest_folder, snp_symbols):
+def get_options_rows(options_data, year, month, day, dest_folder, snp_symbols):
     print(f'Handling options for {day}/{month}/{year}')
     cur_date = f'{year}{month:02}{day:02} 00:00'
     format_str = "{}"
     curr_stock_symbol = ''
     output_path = os.path.join(dest_folder, 'option', 'usa', 'daily')
-    ensure_dir_exist(output_path)
+    rows = dict()
 
     for index, row in options_data.iterrows():
         stock_symbol = row['UnderlyingSymbol']
@@ -145,19 +147,15 @@ def process_options_file(options_data, year, month, day, dest_folder, snp_symbol
                 open_interest_dir = os.path.join(output_path, dir_format_path.format("openinterest"))
                 quote_dir = os.path.join(output_path, dir_format_path.format("quote"))
                 trade_dir = os.path.join(output_path, dir_format_path.format("trade"))
-                ensure_dir_exist(open_interest_dir)
-                ensure_dir_exist(quote_dir)
-                ensure_dir_exist(trade_dir)
                 curr_stock_symbol = stock_symbol
 
-            expiration_date = datetime.strptime(row['Expiration'], "%Y-%m-%d")
+            expiration_date = datetime.strptime(row['Expiration'], schema.DAILY_EXPIRATION_FORMAT)
             csv_file_template = f'{stock_symbol.lower()}_{format_str}_american_' \
                                 f'{row["Type"]}_{int(float(row["Strike"]) * 10000)}_{expiration_date.year}' \
                                 f'{expiration_date.month:02}{expiration_date.day:02}.csv'
             open_interest_row = f'{cur_date},{row["OpenInterest"]}\n'
             open_interest_csv = os.path.join(open_interest_dir, csv_file_template.format("openinterest"))
-            with open(open_interest_csv, "a") as open_interest_csv_file:
-                open_interest_csv_file.write(open_interest_row)
+            rows.setdefault(open_interest_csv, []).append(open_interest_row)
 
             option_quote_bid = row['Bid'] * 10000
             option_quote_ask = row['Ask'] * 10000
@@ -168,23 +166,25 @@ def process_options_file(options_data, year, month, day, dest_folder, snp_symbol
                         f'{option_quote_ask},{option_quote_ask},{option_quote_half_volume},' \
                         f'{iv}\n'
             quote_csv =  os.path.join(quote_dir, csv_file_template.format("quote"))
-            with open(quote_csv, "a") as quote_csv_file:
-                quote_csv_file.write(quote_row)
+            rows.setdefault(quote_csv, []).append(quote_row)
 
             option_trade_last = row['Last'] * 10000
             trade_row = f'{cur_date},{option_trade_last},{option_trade_last},' \
                         f'{option_trade_last},{option_trade_last},{row["Volume"]}\n'
             trade_csv = os.path.join(trade_dir, csv_file_template.format("trade"))
-            with open(trade_csv, "a") as trade_csv_file:
-                trade_csv_file.write(trade_row)
+            rows.setdefault(trade_csv, []).append(trade_row)
+    return rows
                 
 
 if __name__ == '__main__':
     start_time = time.time()
     snp_500_symbols = get_snp_symbols(SNP_SYMBOLS_FILE_PATH)
     src_dir = SOURCE_DIR
+    workers = 1
     if len(sys.argv) > 1:
         src_dir = sys.argv[1]
-    process_source_dir(src_dir, DEST_DIR, snp_500_symbols)
+    if len(sys.argv) > 2:
+        workers = int(sys.argv[2])
+    process_source_dir(src_dir, DEST_DIR, snp_500_symbols, workers)
     end_time = time.time()
     print("Processing took", end_time - start_time, "seconds")
@@ -8,22 +8,33 @@ for s&p 500 weekly options on every day:
         sell best call and best put in bid price
 """
 import pandas as pd
+import numpy as np
 import zipfile
 import re
 import os
 import math
+import concurrent.futures
 import time
 import datetime
 import json
-import matplotlib.pylab as plt
+import pickle
 import logging
 from datetime import date
-from utils import parse_date
+from utils import parse_date, get_day_number, format_day_number, parse_day_key
+import chain_cache
+import chain_index
+import stock_quotes
+import position_book
+import metrics
+import iv_ranking
+import results_plot
+import day_files
 import sys
 
-global log
+log = logging.getLogger('SimulateTrade')
 
 STOCK_FILES_DIR = '.\\2013'
+STOCK_QUOTES_BINARY_DIR = None
 SNP_SYMBOLS_FILE_PATH = ".\\snp500.txt"
 DAILY_TRADE_OPTIONS = 5
 PRICE_FACTOR = 1
@@ -36,133 +47,88 @@ MAX_TRADE_BATCH = 1
 MAX_SYMBOLS_TO_CHECK = 300
 ASSUME_SPLIT_RATIO = 0.55
 WRITE_OPTIONS_FEE = 1.01
+CHECKPOINT_INTERVAL_DAYS = 20
+# Since version 3 a checkpoint holds only the state that carries over to the next days, the daily results of a run
+# with checkpoints are streamed
+CHECKPOINT_VERSION = 3
+CHECKPOINT_STATE_KEYS = ['open_positions', 'total_profit']
 
 
-def process_source_dir(source_dir, snp_symbols, is_compressed, results_dir, start_date, end_date):
+def process_source_dir(source_dir, snp_symbols, is_compressed, results_dir, start_date, end_date, workers=1,
+                       stream_results=False, resume=False, strategies=None, results_format='png'):
     start_time = datetime.datetime.now()
-    input_files = []
-    total_profit = dict()
 
     # collect files form source folder by the given start_date/end_date
-    if not is_compressed:
-        input_files = get_csv_files_in_folder(source_dir, start_date, end_date)
+    input_files = get_input_files(source_dir, is_compressed, start_date, end_date)
+
+    # The checkpoints are saved only while the daily results are streamed
+    checkpoint_path = get_checkpoint_path(results_dir if stream_results else None)
+    if strategies is not None:
+        # The strategies share every loaded day in one pass, each one writes its results to a folder of its name
+        strategy_dirs = dict()
+        stream_paths = dict()
+        for strategy in strategies:
+            strategy_dirs[strategy.name] = os.path.join(results_dir, strategy.name)
+            os.makedirs(strategy_dirs[strategy.name], exist_ok=True)
+            stream_paths[strategy.name] = get_stream_path(strategy_dirs[strategy.name] if stream_results else None)
+        all_results = simulate_strategies(source_dir, input_files, snp_symbols, is_compressed, strategies,
+                                          stream_paths=stream_paths, checkpoint_path=checkpoint_path, resume=resume,
+                                          metrics_path=metrics.get_metrics_path(results_dir))
+        for strategy in strategies:
+            write_results(strategy_dirs[strategy.name], all_results[strategy.name], strategy.ratio_params,
+                          strategy.bid_ratios, start_time, stream_results, workers, results_format,
+                          strategy.get_trade_batches())
+        print_metrics_summary(results_dir)
+        return
+
+    # When streaming, the daily results are appended to Daily*.jsonl in the results folder instead of being kept in
+    # memory until the end of the run
+    stream_dir = results_dir if stream_results else None
+    if workers > 1:
+        results = run_parameter_sweep(source_dir, input_files, snp_symbols, is_compressed, EXPECTED_STOCK_CHANGE_RATIO,
+                                      BID_RATIO, workers, stream_dir=stream_dir, checkpoint_dir=stream_dir,
+                                      resume=resume, metrics_dir=results_dir)
     else:
-        zip_files = get_zip_files_in_folder(source_dir, start_date, end_date)
-        for curr_file in zip_files:
-            file_path = os.path.join(source_dir, curr_file)
-            files_in_curr_zip = get_files_from_zip_by_date(file_path)
-            for curr_zipped_file in files_in_curr_zip:
-                input_files.append({'zip': curr_file, 'data': files_in_curr_zip[curr_zipped_file]})
-
-    day_index = 0
-    open_positions = dict()
-    daily_status = dict()
-    missing_options = dict()
-    split_symbols = dict()
-
-    # initialize all simulation parameters data structures
-    for curr_stock_ratio in EXPECTED_STOCK_CHANGE_RATIO:
-        open_positions[curr_stock_ratio] = dict()
-        total_profit[curr_stock_ratio] = dict()
-        for curr_bid_ratio in BID_RATIO:
-            open_positions[curr_stock_ratio][curr_bid_ratio] = dict()
-            total_profit[curr_stock_ratio][curr_bid_ratio] = dict()
-            for batch_index in range(MAX_TRADE_BATCH):
-                total_profit[curr_stock_ratio][curr_bid_ratio][batch_index] = 0
-                open_positions[curr_stock_ratio][curr_bid_ratio][batch_index] = dict()
-
-    prev_zip = ''
-    zip_file_obj = None
-    all_trades = {}
-
-    # 
-    for input_file in input_files:
-        day_index += 1
-        options_start = time.time()
-        if day_index > DAYS_TO_PROCESS:
-            break
-        if not is_compressed:
-            log.info(f'Processing {input_file}')
-            _, year, month, day = parse_filename(input_file)
-            options_data = pd.read_csv(os.path.join(source_dir, input_file))
-        else:
-            if input_file['zip'] != prev_zip:
-                prev_zip = input_file['zip']
-                zip_file_obj = zipfile.ZipFile(os.path.join(source_dir, prev_zip))
-            date_info = input_file['data']
-            options_file = date_info['options']
-            options_data = pd.read_csv(zip_file_obj.open(options_file))
-            day = date_info['day']
-            month = date_info['month']
-            year = date_info['year']
-        (today_income, today_expenses, curr_trade) = process_options_file(options_data, year, month, day,
-                                                                          snp_symbols, open_positions,
-                                                                          EXPECTED_STOCK_CHANGE_RATIO, BID_RATIO,
-                                                                          MAX_TRADE_BATCH, missing_options,
-                                                                          split_symbols, open_positions)
-        day_key = datetime.datetime(year=year, month=month, day=day)
-        day_key_str = f'{day:02}/{month:02}/{year}'
-        all_trades[f'{day:02}/{month:02}/{year}'] = curr_trade
-        daily_status[day_key_str] = dict()
-        for curr_stock_ratio in EXPECTED_STOCK_CHANGE_RATIO:
-            daily_status[day_key_str][curr_stock_ratio] = dict()
-            for curr_bid_ratio in BID_RATIO:
-                for batch_index in range(MAX_TRADE_BATCH):
-                    for expiration_date in curr_trade[curr_stock_ratio][curr_bid_ratio][batch_index]:
-                        if expiration_date not in open_positions[curr_stock_ratio][curr_bid_ratio][batch_index]:
-                            open_positions[curr_stock_ratio][curr_bid_ratio][batch_index][expiration_date] = \
-                                curr_trade[curr_stock_ratio][curr_bid_ratio][batch_index][expiration_date].copy()
-                        else:
-                            open_positions[curr_stock_ratio][curr_bid_ratio][batch_index][expiration_date] += \
-                                curr_trade[curr_stock_ratio][curr_bid_ratio][batch_index][expiration_date]
-                    income = today_income[curr_stock_ratio][curr_bid_ratio][batch_index]
-                    expenses = today_expenses[curr_stock_ratio][curr_bid_ratio][batch_index]
-                    total_profit[curr_stock_ratio][curr_bid_ratio][batch_index] += \
-                        (income - expenses)
-
-                    # Going over all of the batches including all open positions that may have existed from before
-                    daily_status[day_key_str][curr_stock_ratio][curr_bid_ratio] = dict()
-                    for batch_index in range(MAX_TRADE_BATCH):
-                        # Calculating again because maybe there are more batches because of the open positions
-                        income = today_income[curr_stock_ratio][curr_bid_ratio][batch_index]
-                        expenses = today_expenses[curr_stock_ratio][curr_bid_ratio][batch_index]
-                        open_positions_cost = 0
-                        if batch_index in open_positions[curr_stock_ratio][curr_bid_ratio]:
-                            open_positions_cost = calc_positions_cost(
-                                open_positions[curr_stock_ratio][curr_bid_ratio][batch_index])
-                        profit = 0
-                        if batch_index in total_profit[curr_stock_ratio][curr_bid_ratio]:
-                            profit = total_profit[curr_stock_ratio][curr_bid_ratio][batch_index]
-                        current_status = profit - open_positions_cost
-                        log.info(f'{curr_stock_ratio},{curr_bid_ratio},{batch_index}: profit for {day}/{month}/{year}'
-                              f' is {income - expenses}, '
-                              f'total profit after {day_index} '
-                              f'days is {current_status}')
-                        daily_status[day_key_str][curr_stock_ratio][curr_bid_ratio][batch_index] = current_status
-        log.info(f'Processing options for {day}/{month}/{year} took {time.time() - options_start} seconds')
-
-    # Reduce remaining open positions
-    for curr_stock_ratio in EXPECTED_STOCK_CHANGE_RATIO:
-        for curr_bid_ratio in BID_RATIO:
-            for batch_index in total_profit[curr_stock_ratio][curr_bid_ratio]:
-                total_profit[curr_stock_ratio][curr_bid_ratio][batch_index] -= \
-                    calc_positions_cost(open_positions[curr_stock_ratio][curr_bid_ratio][batch_index])
-                log.info(f'{curr_stock_ratio},{curr_bid_ratio},{batch_index} Total profit: '
-                      f'{total_profit[curr_stock_ratio][curr_bid_ratio][batch_index]}')
-
-
-    log.info("Daily statuses %s", daily_status)
-    plot_results(daily_status, EXPECTED_STOCK_CHANGE_RATIO, BID_RATIO, MAX_TRADE_BATCH, start_time, results_dir)
+        results = simulate(source_dir, input_files, snp_symbols, is_compressed, EXPECTED_STOCK_CHANGE_RATIO, BID_RATIO,
+                           stream_path=get_stream_path(stream_dir), checkpoint_path=checkpoint_path, resume=resume,
+                           metrics_path=metrics.get_metrics_path(results_dir))
+    write_results(results_dir, results, EXPECTED_STOCK_CHANGE_RATIO, BID_RATIO, start_time, stream_results, workers,
+                  results_format)
+    print_metrics_summary(results_dir)
+
+
+def print_metrics_summary(results_dir):
+    # The phases of all of the days, including the days of the sweep workers
+    summary = metrics.summarize(metrics.read_metrics(results_dir))
+    log.info('Phases summary:\n%s', summary)
+    print(summary)
+
+
+def write_results(results_dir, results, ratio_params, bid_ratios, start_time, stream_results=False, workers=1,
+                  results_format='png', trade_batches=MAX_TRADE_BATCH):
+    # The charts are rendered by up to workers processes, see results_plot.RESULTS_FORMATS for results_format.
+    # trade_batches is the one of the strategy of the results
+    (total_profit, daily_status, all_trades, missing_options, split_symbols) = results
+    if stream_results:
+        daily_status = read_daily_statuses(results_dir)
+        plot_results(daily_status, ratio_params, bid_ratios, trade_batches, results_dir, workers, results_format)
+        with open(f'{os.path.join(results_dir, "TotalProfit.json")}', 'w') as outfile:
+            json.dump(total_profit, outfile)
+        print("Total profit", json.dumps(total_profit, default=json_date_encoder))
+        return
+
+    plot_results(daily_status, ratio_params, bid_ratios, trade_batches, results_dir, workers, results_format)
     all_trades_separate_dates = dict()
-    for curr_stock_ratio in EXPECTED_STOCK_CHANGE_RATIO:
+    for curr_stock_ratio in ratio_params:
         all_trades_separate_dates[curr_stock_ratio] = dict()
-        for curr_bid_ratio in BID_RATIO:
+        for curr_bid_ratio in bid_ratios:
             all_trades_separate_dates[curr_stock_ratio][curr_bid_ratio] = dict()
     
     for curr_date in all_trades:
         for curr_stock_ratio in all_trades[curr_date]:
             for curr_bid_ratio in all_trades[curr_date][curr_stock_ratio]:
-                all_trades_separate_dates[curr_stock_ratio][curr_bid_ratio][curr_date] = []
+                day_key = format_day_number(curr_date)
+                all_trades_separate_dates[curr_stock_ratio][curr_bid_ratio][day_key] = []
                 for batch_index in all_trades[curr_date][curr_stock_ratio][curr_bid_ratio]:
                     if batch_index == 0:
                         for curr_trade_date in list(
@@ -175,12 +141,12 @@ def process_source_dir(source_dir, snp_symbols, is_compressed, results_dir, star
                                 expiration = curr_option['expiration']
                                 curr_option['expiration'] = f'{expiration.day:02}/{expiration.month:02}/{expiration.year}'
                                 all_trades_separate_dates[curr_stock_ratio][
-                                    curr_bid_ratio][curr_date].append(curr_option)
+                                    curr_bid_ratio][day_key].append(curr_option)
 
     with open(f'{os.path.join(results_dir, "MissingOptions.json")}', 'w') as outfile:
-        json.dump(missing_options, outfile, default=json_date_encoder)
+        json.dump(format_missing_days(missing_options), outfile, default=json_date_encoder)
     with open(f'{os.path.join(results_dir, "SplitSymbols.json")}', 'w') as outfile:
-        json.dump(split_symbols, outfile, default=json_date_encoder)
+        json.dump(format_missing_days(split_symbols), outfile, default=json_date_encoder)
     with open(f'{os.path.join(results_dir, "Trades.json")}', 'w') as outfile:
         json.dump(all_trades_separate_dates, outfile)
     with open(f'{os.path.join(results_dir, "TotalProfit.json")}', 'w') as outfile:
@@ -188,6 +154,382 @@ def process_source_dir(source_dir, snp_symbols, is_compressed, results_dir, star
     print("Total profit", json.dumps(total_profit, default=json_date_encoder))
 
 
+def simulate(source_dir, input_files, snp_symbols, is_compressed, ratio_params, bid_ratios,
+             cache_dir=chain_cache.CHAIN_CACHE_DIR, stream_path=None, checkpoint_path=None, resume=False,
+             metrics_path=None):
+    strategy = BreakEvenStrategy('default', ratio_params, bid_ratios)
+    results = simulate_strategies(source_dir, input_files, snp_symbols, is_compressed, [strategy], cache_dir,
+                                  {strategy.name: stream_path}, checkpoint_path, resume, metrics_path)
+    return results[strategy.name]
+
+
+def simulate_strategies(source_dir, input_files, snp_symbols, is_compressed, strategies,
+                        cache_dir=chain_cache.CHAIN_CACHE_DIR, stream_paths=None, checkpoint_path=None, resume=False,
+                        metrics_path=None):
+    # Every day is loaded once and handed to all of the strategies, the result of every strategy is
+    # (total_profit, daily_status, all_trades, missing_options, split_symbols) under its name.
+    # The time of every phase of a day is appended to metrics_path
+    if stream_paths is None:
+        stream_paths = dict()
+    if checkpoint_path is not None and any(stream_paths.get(strategy.name) is None for strategy in strategies):
+        raise Exception('The daily results of every strategy must be streamed to save checkpoints.')
+    timer = metrics.PhaseTimer(metrics_path)
+    # Files that get a line per day, a resumed run cuts them back to the checkpoint
+    appended_paths = [path for path in list(stream_paths.values()) + [metrics_path] if path is not None]
+    day_index = 0
+    states = dict()
+    for strategy in strategies:
+        states[strategy.name] = init_strategy_state(strategy)
+
+    prev_zip = ''
+    zip_file_obj = None
+    stock_quote_store = stock_quotes.StockQuoteStore(STOCK_FILES_DIR, binary_dir=STOCK_QUOTES_BINARY_DIR)
+
+    if resume and checkpoint_path is not None and os.path.exists(checkpoint_path):
+        (day_index, saved_states) = load_checkpoint(checkpoint_path, input_files, is_compressed, strategies,
+                                                   appended_paths)
+        for strategy in strategies:
+            states[strategy.name].update(saved_states[strategy.name])
+
+    for input_file in input_files[day_index:]:
+        day_index += 1
+        options_start = time.time()
+        if day_index > DAYS_TO_PROCESS:
+            break
+        with timer.phase('load'):
+            if not is_compressed:
+                log.info(f'Processing {input_file}')
+                _, year, month, day = parse_filename(input_file)
+                options_data = chain_cache.read_options(os.path.join(source_dir, input_file), snp_symbols,
+                                                        cache_dir=cache_dir)
+                ranking = None
+                ranking_path = iv_ranking.get_ranking_path(source_dir, year, month, day,
+                                                           os.path.splitext(input_file)[1])
+                if os.path.exists(ranking_path):
+                    ranking = iv_ranking.read_ranking(ranking_path, snp_symbols)
+            else:
+                if input_file['zip'] != prev_zip:
+                    prev_zip = input_file['zip']
+                    zip_file_obj = zipfile.ZipFile(os.path.join(source_dir, prev_zip))
+                date_info = input_file['data']
+                options_file = date_info['options']
+                options_data = chain_cache.read_options(options_file, snp_symbols, zip_file_obj, cache_dir)
+                ranking = None
+                if 'ivranking' in date_info:
+                    ranking = iv_ranking.read_ranking(zip_file_obj.open(date_info['ivranking']), snp_symbols)
+                day = date_info['day']
+                month = date_info['month']
+                year = date_info['year']
+        timer.count('options', len(options_data))
+        trading_day = TradingDay(options_data, year, month, day, snp_symbols, stock_quote_store, timer, ranking)
+        for strategy in strategies:
+            state = states[strategy.name]
+            (today_income, today_expenses, curr_trade) = strategy.process_day(trading_day, state['open_positions'],
+                                                                              state['missing_options'],
+                                                                              state['split_symbols'],
+                                                                              state['open_positions'])
+            with timer.phase('bookkeeping'):
+                update_strategy_state(strategy, state, trading_day, day_index, today_income, today_expenses,
+                                      curr_trade)
+                stream_path = stream_paths.get(strategy.name)
+                if stream_path is not None:
+                    # Only the open positions and the total profit are kept for the next days
+                    write_daily_results(stream_path, trading_day.day_number,
+                                        state['daily_status'].pop(trading_day.day_number),
+                                        state['all_trades'].pop(trading_day.day_number), state['missing_options'],
+                                        state['split_symbols'])
+                    state['missing_options'].clear()
+                    state['split_symbols'].clear()
+        timer.end_day(trading_day.zip_key)
+        if checkpoint_path is not None and day_index % CHECKPOINT_INTERVAL_DAYS == 0:
+            save_checkpoint(checkpoint_path, (year, month, day), day_index, strategies, states, appended_paths)
+        log.info(f'Processing options for {day}/{month}/{year} took {time.time() - options_start} seconds')
+
+    # The loop counts the day it stopped at when DAYS_TO_PROCESS is reached
+    processed_days = min(day_index, DAYS_TO_PROCESS)
+    if checkpoint_path is not None and processed_days > 0:
+        save_checkpoint(checkpoint_path, get_input_file_date(input_files[processed_days - 1], is_compressed),
+                        processed_days, strategies, states, appended_paths)
+
+    results = dict()
+    for strategy in strategies:
+        state = states[strategy.name]
+        total_profit = state['total_profit']
+
+        # Reduce remaining open positions
+        for curr_stock_ratio in strategy.ratio_params:
+            for curr_bid_ratio in strategy.bid_ratios:
+                for batch_index in total_profit[curr_stock_ratio][curr_bid_ratio]:
+                    total_profit[curr_stock_ratio][curr_bid_ratio][batch_index] -= \
+                        calc_positions_cost(state['open_positions'][curr_stock_ratio][curr_bid_ratio][batch_index])
+                    log.info(f'{strategy.name} {curr_stock_ratio},{curr_bid_ratio},{batch_index} Total profit: '
+                          f'{total_profit[curr_stock_ratio][curr_bid_ratio][batch_index]}')
+        results[strategy.name] = (total_profit, state['daily_status'], state['all_trades'], state['missing_options'],
+                                  state['split_symbols'])
+
+    return results
+
+
+def init_strategy_state(strategy):
+    # initialize all simulation parameters data structures
+    state = {'open_positions': dict(), 'total_profit': dict(), 'daily_status': dict(), 'all_trades': dict(),
+             'missing_options': dict(), 'split_symbols': dict()}
+    for curr_stock_ratio in strategy.ratio_params:
+        state['open_positions'][curr_stock_ratio] = dict()
+        state['total_profit'][curr_stock_ratio] = dict()
+        for curr_bid_ratio in strategy.bid_ratios:
+            state['open_positions'][curr_stock_ratio][curr_bid_ratio] = dict()
+            state['total_profit'][curr_stock_ratio][curr_bid_ratio] = dict()
+            for batch_index in range(strategy.get_trade_batches()):
+                state['total_profit'][curr_stock_ratio][curr_bid_ratio][batch_index] = 0
+                state['open_positions'][curr_stock_ratio][curr_bid_ratio][batch_index] = \
+                    position_book.PositionBook()
+    return state
+
+
+def update_strategy_state(strategy, state, trading_day, day_index, today_income, today_expenses, curr_trade):
+    open_positions = state['open_positions']
+    total_profit = state['total_profit']
+    day_number = trading_day.day_number
+    state['all_trades'][day_number] = curr_trade
+    state['daily_status'][day_number] = dict()
+    for curr_stock_ratio in strategy.ratio_params:
+        state['daily_status'][day_number][curr_stock_ratio] = dict()
+        for curr_bid_ratio in strategy.bid_ratios:
+            for batch_index in range(strategy.get_trade_batches()):
+                for expiration_date in curr_trade[curr_stock_ratio][curr_bid_ratio][batch_index]:
+                    open_positions[curr_stock_ratio][curr_bid_ratio][batch_index].add(
+                        expiration_date, curr_trade[curr_stock_ratio][curr_bid_ratio][batch_index][expiration_date])
+                income = today_income[curr_stock_ratio][curr_bid_ratio][batch_index]
+                expenses = today_expenses[curr_stock_ratio][curr_bid_ratio][batch_index]
+                total_profit[curr_stock_ratio][curr_bid_ratio][batch_index] += \
+                    (income - expenses)
+
+                # Going over all of the batches including all open positions that may have existed from before
+                state['daily_status'][day_number][curr_stock_ratio][curr_bid_ratio] = dict()
+                for batch_index in range(strategy.get_trade_batches()):
+                    # Calculating again because maybe there are more batches because of the open positions
+                    income = today_income[curr_stock_ratio][curr_bid_ratio][batch_index]
+                    expenses = today_expenses[curr_stock_ratio][curr_bid_ratio][batch_index]
+                    open_positions_cost = 0
+                    if batch_index in open_positions[curr_stock_ratio][curr_bid_ratio]:
+                        open_positions_cost = calc_positions_cost(
+                            open_positions[curr_stock_ratio][curr_bid_ratio][batch_index])
+                    profit = 0
+                    if batch_index in total_profit[curr_stock_ratio][curr_bid_ratio]:
+                        profit = total_profit[curr_stock_ratio][curr_bid_ratio][batch_index]
+                    current_status = profit - open_positions_cost
+                    log.debug('%s,%s,%s: profit for %s is %s, total profit after %s days is %s', curr_stock_ratio,
+                              curr_bid_ratio, batch_index, trading_day.zip_key, income - expenses, day_index,
+                              current_status)
+                    state['daily_status'][day_number][curr_stock_ratio][curr_bid_ratio][batch_index] = \
+                        current_status
+
+
+def get_input_files(source_dir, is_compressed, start_date, end_date):
+    input_files = []
+    if not is_compressed:
+        input_files = get_csv_files_in_folder(source_dir, start_date, end_date)
+    else:
+        zip_files = get_zip_files_in_folder(source_dir, start_date, end_date)
+        for curr_file in zip_files:
+            file_path = os.path.join(source_dir, curr_file)
+            files_in_curr_zip = get_files_from_zip_by_date(file_path)
+            for curr_zipped_file in files_in_curr_zip:
+                input_files.append({'zip': curr_file, 'data': files_in_curr_zip[curr_zipped_file]})
+    return input_files
+
+
+def run_parameter_sweep(source_dir, input_files, snp_symbols, is_compressed, ratio_params, bid_ratios, workers,
+                        cache_dir=chain_cache.CHAIN_CACHE_DIR, stream_dir=None, checkpoint_dir=None, resume=False,
+                        metrics_dir=None):
+    # Every bid ratio is simulated by its own worker with all of the stock change ratios. The stock change ratios of
+    # a day share one symbols scan, so they can't be split, while a bid ratio only changes the prices of the same
+    # trades. Every worker needs all of the days for the open positions, the days are read through the chain cache
+    total_profit = dict()
+    daily_status = dict()
+    all_trades = dict()
+    missing_options = dict()
+    split_symbols = dict()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(simulate, source_dir, input_files, snp_symbols, is_compressed, ratio_params,
+                                   [curr_bid_ratio], cache_dir, get_stream_path(stream_dir, curr_bid_ratio),
+                                   get_checkpoint_path(checkpoint_dir, curr_bid_ratio), resume,
+                                   metrics.get_metrics_path(metrics_dir, curr_bid_ratio))
+                   for curr_bid_ratio in bid_ratios]
+        for future in futures:
+            (bid_profit, bid_daily_status, bid_trades, bid_missing, bid_splits) = future.result()
+            merge_bid_results(total_profit, bid_profit)
+            merge_bid_results(missing_options, bid_missing)
+            merge_bid_results(split_symbols, bid_splits)
+            for curr_date in bid_daily_status:
+                merge_bid_results(daily_status.setdefault(curr_date, dict()), bid_daily_status[curr_date])
+            for curr_date in bid_trades:
+                merge_bid_results(all_trades.setdefault(curr_date, dict()), bid_trades[curr_date])
+
+    return total_profit, daily_status, all_trades, missing_options, split_symbols
+
+
+def merge_bid_results(results, bid_results):
+    # The results of a sweep worker are keyed [stock ratio][bid ratio]
+    for (curr_stock_ratio, ratio_results) in bid_results.items():
+        results.setdefault(curr_stock_ratio, dict()).update(ratio_results)
+
+
+def get_checkpoint_path(checkpoint_dir, bid_ratio=None):
+    if checkpoint_dir is None:
+        return None
+    if bid_ratio is None:
+        return os.path.join(checkpoint_dir, 'Checkpoint.pkl')
+    return os.path.join(checkpoint_dir, f'Checkpoint_bid_{bid_ratio}.pkl')
+
+
+def save_checkpoint(checkpoint_path, last_date, day_index, strategies, states, appended_paths):
+    # The open positions and the total profit of all of the strategies are pickled together with the day they
+    # reached, the daily results up to that day are in the streamed files
+    file_sizes = dict()
+    for appended_path in appended_paths:
+        if os.path.exists(appended_path):
+            file_sizes[appended_path] = os.path.getsize(appended_path)
+    saved_states = dict()
+    for (name, state) in states.items():
+        saved_states[name] = {key: state[key] for key in CHECKPOINT_STATE_KEYS}
+    checkpoint = {'version': CHECKPOINT_VERSION, 'last_date': last_date, 'day_index': day_index,
+                  'strategies': get_strategies_params(strategies), 'states': saved_states, 'file_sizes': file_sizes}
+    temp_path = f'{checkpoint_path}.tmp'
+    with open(temp_path, 'wb') as checkpoint_file:
+        pickle.dump(checkpoint, checkpoint_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, checkpoint_path)
+    log.info(f'Saved checkpoint after {day_index} days to {checkpoint_path}')
+
+
+def load_checkpoint(checkpoint_path, input_files, is_compressed, strategies, appended_paths):
+    with open(checkpoint_path, 'rb') as checkpoint_file:
+        checkpoint = pickle.load(checkpoint_file)
+    if checkpoint.get('version') != CHECKPOINT_VERSION:
+        raise Exception(f'The checkpoint {checkpoint_path} was saved by an older version of the simulation.')
+    day_index = checkpoint['day_index']
+    if checkpoint['strategies'] != get_strategies_params(strategies):
+        raise Exception(f'The checkpoint {checkpoint_path} was saved with other simulation parameters.')
+    if day_index > len(input_files) or \
+            get_input_file_date(input_files[day_index - 1], is_compressed) != checkpoint['last_date']:
+        raise Exception(f'The checkpoint {checkpoint_path} does not match the input files.')
+
+    # Daily results and metrics written after the checkpoint are written again
+    for appended_path in appended_paths:
+        if os.path.exists(appended_path):
+            with open(appended_path, 'r+') as appended_file:
+                appended_file.truncate(checkpoint['file_sizes'].get(appended_path, 0))
+    log.info(f'Resuming from {checkpoint_path} after {day_index} days')
+    return day_index, checkpoint['states']
+
+
+def get_strategies_params(strategies):
+    return [(type(strategy).__name__, strategy.name, strategy.ratio_params, strategy.bid_ratios)
+            for strategy in strategies]
+
+
+def get_input_file_date(input_file, is_compressed):
+    if not is_compressed:
+        _, year, month, day = parse_filename(input_file)
+        return year, month, day
+    return input_file['data']['year'], input_file['data']['month'], input_file['data']['day']
+
+
+def get_latest_checkpoint_dir(parent_dir):
+    latest_dir = None
+    latest_time = None
+    for dir_name in os.listdir(parent_dir):
+        dir_path = os.path.join(parent_dir, dir_name)
+        if not dir_name.startswith('Results_') or not os.path.isdir(dir_path):
+            continue
+        for filename in os.listdir(dir_path):
+            if re.fullmatch('Checkpoint(_.+)?\\.pkl', filename):
+                checkpoint_time = os.path.getmtime(os.path.join(dir_path, filename))
+                if latest_time is None or checkpoint_time > latest_time:
+                    latest_dir = dir_path
+                    latest_time = checkpoint_time
+    if latest_dir is None:
+        raise Exception('No checkpoint to resume from.')
+    return latest_dir
+
+
+def get_stream_path(stream_dir, bid_ratio=None):
+    if stream_dir is None:
+        return None
+    if bid_ratio is None:
+        return os.path.join(stream_dir, 'Daily.jsonl')
+    return os.path.join(stream_dir, f'Daily_bid_{bid_ratio}.jsonl')
+
+
+def write_daily_results(stream_path, day_number, day_status, day_trades, missing_options, split_symbols):
+    # One json line per day with the status of every parameters combination, the trades of the first batch and the
+    # missing / split symbols of the day. The day and the dates of the written options are formatted like in
+    # Trades.json
+    trades = dict()
+    for curr_stock_ratio in day_trades:
+        trades[curr_stock_ratio] = dict()
+        for curr_bid_ratio in day_trades[curr_stock_ratio]:
+            trades[curr_stock_ratio][curr_bid_ratio] = []
+            for curr_expiration in day_trades[curr_stock_ratio][curr_bid_ratio].get(0, dict()):
+                for curr_option in day_trades[curr_stock_ratio][curr_bid_ratio][0][curr_expiration]:
+                    trades[curr_stock_ratio][curr_bid_ratio].append(format_option_dates(curr_option))
+    record = {'date': format_day_number(day_number), 'status': day_status, 'trades': trades,
+              'missing': format_missing_days(missing_options), 'splits': format_missing_days(split_symbols)}
+    with open(stream_path, 'a') as outfile:
+        outfile.write(json.dumps(record, default=json_date_encoder))
+        outfile.write('\n')
+
+
+def format_option_dates(value):
+    if isinstance(value, dict):
+        formatted = dict()
+        for key in value:
+            if key == 'expiration':
+                formatted[key] = f'{value[key].day:02}/{value[key].month:02}/{value[key].year}'
+            else:
+                formatted[key] = format_option_dates(value[key])
+        return formatted
+    if isinstance(value, list):
+        return [format_option_dates(item) for item in value]
+    return value
+
+
+def format_missing_days(missing_dict):
+    # The missing / split symbols of store_missing with their days formatted like the keys of Trades.json
+    formatted = dict()
+    for (curr_stock_ratio, ratio_missing) in missing_dict.items():
+        formatted[curr_stock_ratio] = dict()
+        for (curr_bid_ratio, bid_missing) in ratio_missing.items():
+            formatted[curr_stock_ratio][curr_bid_ratio] = dict()
+            for (batch_index, batch_missing) in bid_missing.items():
+                formatted[curr_stock_ratio][curr_bid_ratio][batch_index] = \
+                    {format_day_number(day_number): format_option_dates(day_missing)
+                     for (day_number, day_missing) in batch_missing.items()}
+    return formatted
+
+
+def read_daily_statuses(stream_dir):
+    # The daily statuses of all of the Daily*.jsonl files in stream_dir, keyed by day number like the daily_status of
+    # simulate
+    daily_status = dict()
+    for filename in sorted(os.listdir(stream_dir)):
+        if not re.fullmatch('Daily(_.+)?\\.jsonl', filename):
+            continue
+        with open(os.path.join(stream_dir, filename)) as stream_file:
+            for line in stream_file:
+                record = json.loads(line)
+                day_status = daily_status.setdefault(parse_day_key(record['date']), dict())
+                for curr_stock_ratio in record['status']:
+                    # The files of the sweep workers hold a bid ratio each
+                    day_status.setdefault(float(curr_stock_ratio), dict())
+                    for curr_bid_ratio in record['status'][curr_stock_ratio]:
+                        day_status[float(curr_stock_ratio)][float(curr_bid_ratio)] = \
+                            {int(batch_index): batch_status for (batch_index, batch_status) in
+                             record['status'][curr_stock_ratio][curr_bid_ratio].items()}
+    return daily_status
+
+
 def json_date_encoder(o):
     if isinstance(o, datetime.datetime):
         return o.__str__()
@@ -195,12 +537,7 @@ def json_date_encoder(o):
 
 
 def calc_positions_cost(positions):
-    total_cost = 0
-    for curr_date in positions:
-        for curr_position in positions[curr_date]:
-            total_cost += curr_position['price'] * curr_position['size']
-
-    return  total_cost
+    return positions.cost()
 
 
 def get_snp_symbols(snp_500_filename):
@@ -220,7 +557,7 @@ def get_zip_files(zip_path):
     return result
 
 
-def get_zip_files_in_folder(folder_path,, start_date=None, end_date=None):
+def get_zip_files_in_folder(folder_path, start_date=None, end_date=None):
     result = []
     for filename in os.listdir(folder_path):
         if '.zip' in filename:
@@ -238,18 +575,20 @@ def get_zip_files_in_folder(folder_path,, start_date=None, end_date=None):
 
 
 def get_csv_files_in_folder(folder_path, start_date, end_date):
-    result = []
+    # A day written both as csv and as Arrow (see day_files) is read from the Arrow file
+    files_by_date = dict()
     for filename in os.listdir(folder_path):
-        if '.csv' in filename and 'option' in filename:
-            m = re.search('(.+)_(.+)\.csv', filename)
+        m = re.search('(.+)_(.+)\.(csv|arrow)$', filename)
+        if m is not None and 'option' in filename:
             date_part = m.group(2)
             year = int(date_part[0:4])
             month = int(date_part[4:6])
             day = int(date_part[6:8])
             file_date = date(year, month, day)
-            if file_date >= start_date and file_date <= end_date:
-                result.append(filename)
-    result = sorted(result)
+            if file_date >= start_date and file_date <= end_date and \
+                    (file_date not in files_by_date or day_files.is_arrow_file(filename)):
+                files_by_date[file_date] = filename
+    result = sorted(files_by_date.values())
     return result
 
 
@@ -266,7 +605,7 @@ def get_files_from_zip_by_date(zip_path):
     for curr_csv in csv_files_from_zip:
         file_type, year, month, day = parse_filename(curr_csv)
         date_key = f'{year}_{month}_{day}'
-        if file_type in ['stockquotes', 'options']:
+        if file_type in ['stockquotes', 'options', 'ivranking']:
             if date_key not in files_in_date:
                 files_in_date[date_key] = {'year': year, 'month': month, 'day': day}
             files_in_date[date_key][file_type] = curr_csv
@@ -283,235 +622,382 @@ def parse_filename(filename):
 
 
 def get_options_by_iv(options_data):
-    options_data['OptionPriceDifference'] = options_data.apply(lambda row: abs(row['UnderlyingPrice'] -
-                                                                               row['Strike']), axis=1)
-    symbol_grouped_options = options_data.groupby('UnderlyingSymbol')
+    return iv_ranking.rank_options_by_iv(options_data)
 
-    # Filter options with strike closest to stock price
-    min_option_difference_index = \
-        symbol_grouped_options['OptionPriceDifference'].transform(min) >= options_data['OptionPriceDifference']
-    closest_to_strike_options = options_data[min_option_difference_index].copy()
 
-    # Calculate IV as average between call and put of closest to strike for each expiration
-    average_iv_expiration_grouped_closest_to_strike_options = closest_to_strike_options.groupby(
-        ['UnderlyingSymbol', 'Expiration'])['IV'].mean()
-    average_iv_expiration_grouped_closest_to_strike_options.sort_values(inplace=True, ascending=False)
-    return average_iv_expiration_grouped_closest_to_strike_options
+def get_chain_columns(snp_options):
+    # Columnar view of the day's chain, all of the selection and trading work is done on these arrays
+    return {column: np.asarray(snp_options[column]) for column in
+            ['UnderlyingSymbol', 'OptionSymbol', 'Type', 'Expiration', 'Strike', 'Bid', 'Ask', 'Volume',
+             'UnderlyingPrice']}
 
 
-def process_options_file(options_data, year, month, day, snp_symbols, current_options, ratio_params, bid_ratios,
-                         trade_batches, missing_options, split_symbols, open_positions):
-    log.info(f'Handling options for {day}/{month}/{year}')
-    zip_date = datetime.datetime(year=year, month=month, day=day)
-    zip_key = f'{day:02}/{month:02}/{year}'
-    snp_options = filter_snp_symbols(options_data, snp_symbols)  # options_data[options_data.UnderlyingSymbol.isin(snp_symbols)].copy()
-    try:
-        snp_options['Expiration'] = pd.to_datetime(snp_options['Expiration'], format='%m/%d/%Y')
-    except Exception as e:
-        snp_options['Expiration'] = pd.to_datetime(snp_options['Expiration'], format='%Y/%m/%d')
-
-    # Only options that expire a week from today
-    snp_options = filter_tradable_options(snp_options, zip_date, 1, 8, 4)
-    average_iv_expiration_grouped_closest_to_strike_options = get_options_by_iv(snp_options)
-
-    trade_index = 0
-    all_today_trade = dict()
-    today_income = dict()
+def select_daily_trades(chain, ranked_options, zip_date, ratio_params, open_positions, trade_batches,
+                        reference_bid_ratio):
+    # Up to trade_batches batches of options per ratio. The options held are looked up in the positions of
+    # reference_bid_ratio, all of the bid ratios trade the same symbols
     daily_trades_num = dict()
     trade_options_per_ratio = dict()
-    ratio_trade_indexes = dict()
     for curr_stock_ratio in ratio_params:
-        today_income[curr_stock_ratio] = dict()
-        all_today_trade[curr_stock_ratio] = dict()
         daily_trades_num[curr_stock_ratio] = 0
         trade_options_per_ratio[curr_stock_ratio] = []
-        ratio_trade_indexes[curr_stock_ratio] = 0
-        for curr_bid_ratio in bid_ratios:
-            today_income[curr_stock_ratio][curr_bid_ratio] = dict()
-            all_today_trade[curr_stock_ratio][curr_bid_ratio] = dict()
-            for batch_index in range(trade_batches):
-                today_income[curr_stock_ratio][curr_bid_ratio][batch_index] = 0
-                all_today_trade[curr_stock_ratio][curr_bid_ratio][batch_index] = dict()
+
+    (call_choices, put_choices) = get_break_even_options(chain, zip_date, ratio_params)
+    max_trades_per_ratio = trade_batches * DAILY_TRADE_OPTIONS
     symbol_index = 0
-    for (trade_group, curr_iv) in average_iv_expiration_grouped_closest_to_strike_options.iteritems():
+    for (trade_group, curr_iv) in ranked_options.items():
         symbol_index += 1
         if symbol_index > MAX_SYMBOLS_TO_CHECK:
             break
         min_trade_in_ratio = min(daily_trades_num.values())
         min_batches = int(min_trade_in_ratio / DAILY_TRADE_OPTIONS)
-        if min_batches >= MAX_TRADE_BATCH:
+        if min_batches >= trade_batches:
             break
         trade_symbol = trade_group[0]
-        symbol_option_chain = snp_options[snp_options.UnderlyingSymbol == trade_symbol]
-
-        # Filtering only out of market options that are actually traded and cost more then MINIMUN_BID
-        oom_symbol_options = symbol_option_chain[symbol_option_chain.Volume > 0]
-        oom_symbol_options = oom_symbol_options[oom_symbol_options.Bid > MINIMUM_BID]
-        oom_symbol_options = oom_symbol_options[oom_symbol_options.Expiration > zip_date + datetime.timedelta(days=1)]
-        oom_symbol_options = oom_symbol_options[oom_symbol_options.Expiration <= zip_date + datetime.timedelta(days=7)]
-        calls = oom_symbol_options[oom_symbol_options.Type == 'call']
-        puts = oom_symbol_options[oom_symbol_options.Type == 'put']
-        calls = calls[calls.Strike + calls.Bid > calls.UnderlyingPrice]
-        puts = puts[puts.Strike - puts.Bid < puts.UnderlyingPrice]
-        if calls.shape[0] == 0 or puts.shape[0] == 0:
-            #log.info(f'No tradable options for symbol {trade_symbol}')
-            pass
-        else:
-            #       Start from strike. If stock price increases by K then the option breaks even.
-            #       Example: stock = 100$, at minimal expiration, call_100=8$, call_105=4$, call_108=3$, call_110=1$
-            #                At 10% increase call_100 loses 2$, call_105 loses 1$, call_108,110 earn 1$.
-            #                Call 108 will be selected because it's the first that breaks even.
-            #       For calls: first option (by strike) where Strike + OptionPrice > StockPrice * (1 + K)
-            #       For Puts: first option (by strike) where Strike - OptionPrice < StockPrice * (1 - K)
-            #       For pricing take bid
-            max_trades_per_ratio = MAX_TRADE_BATCH * DAILY_TRADE_OPTIONS
-            at_least_one_ratio_left_to_trade = False
-            batch_index = int(daily_trades_num[curr_stock_ratio] / DAILY_TRADE_OPTIONS)
-            for curr_stock_ratio in ratio_params:
-                symbol_already_used = False
-                if curr_stock_ratio in open_positions and BID_RATIO[0] in open_positions[curr_stock_ratio] and \
-                    batch_index in open_positions[curr_stock_ratio][BID_RATIO[0]]:
-                    curr_positions = open_positions[curr_stock_ratio][BID_RATIO[0]][batch_index]
-                    if daily_trades_num[curr_stock_ratio] < max_trades_per_ratio:
-                        for expiration_index in range(7):
-                            curr_expiration = zip_date + datetime.timedelta(days=expiration_index + 1)
-                            if curr_expiration in curr_positions:
-                                expiration_positions = curr_positions[curr_expiration]
-                                for position in expiration_positions:
-                                    if position['underlying_symbol'] == trade_symbol:
-                                        symbol_already_used = True
-                                        log.info(f'{curr_stock_ratio} Not trading in {trade_symbol} on {zip_date} because it already exists on {position}')
-                                        break
-                                if symbol_already_used:
-                                    break
-
-                if not symbol_already_used:
-                    at_least_one_ratio_left_to_trade = True
-                    ratio_calls = calls[calls.Strike + 0.5 * calls.Bid + 0.5 * calls.Ask >
-                                        calls.UnderlyingPrice * (1 + curr_stock_ratio)].copy()
-                    ratio_puts = puts[puts.Strike - 0.5 * puts.Bid - 0.5 * puts.Ask <
-                                    puts.UnderlyingPrice * (1 - curr_stock_ratio)].copy()
-                    ratio_calls.sort_values(by='Strike', inplace=True, ascending=True)
-                    ratio_puts.sort_values(by='Strike', inplace=True, ascending=False)
-                    if ratio_calls.shape[0] > 0 and ratio_puts.shape[0] > 0:
-                        daily_trades_num[curr_stock_ratio] += 1
-                        trade_options_per_ratio[curr_stock_ratio].append({'calls': ratio_calls, 'puts': ratio_puts})
-            #if not at_least_one_ratio_left_to_trade:
-            #    break
-
-    if min(daily_trades_num.values()) == -1: # TODO change back to 0
-        log.info(f'Not trading on {day}/{month}/{year}, trades per ratio are {daily_trades_num}')
-    else:
-        for curr_stock_ratio in ratio_params:
+        if trade_symbol not in call_choices or trade_symbol not in put_choices:
+            # No tradable calls or puts for the symbol
+            continue
+
+        # The batch index is taken from the last ratio for all of the ratios
+        batch_index = int(daily_trades_num[ratio_params[-1]] / DAILY_TRADE_OPTIONS)
+        for ratio_index, curr_stock_ratio in enumerate(ratio_params):
+            if daily_trades_num[curr_stock_ratio] < max_trades_per_ratio and \
+                    is_symbol_in_open_positions(open_positions, curr_stock_ratio, reference_bid_ratio, batch_index,
+                                                trade_symbol, zip_date):
+                continue
+            call_row = call_choices[trade_symbol][ratio_index]
+            put_row = put_choices[trade_symbol][ratio_index]
+            if call_row >= 0 and put_row >= 0:
+                daily_trades_num[curr_stock_ratio] += 1
+                trade_options_per_ratio[curr_stock_ratio].append({'call': call_row, 'put': put_row})
+
+    return daily_trades_num, trade_options_per_ratio
+
+
+def get_break_even_options(chain, zip_date, ratio_params):
+    #       Start from strike. If stock price increases by K then the option breaks even.
+    #       Example: stock = 100$, at minimal expiration, call_100=8$, call_105=4$, call_108=3$, call_110=1$
+    #                At 10% increase call_100 loses 2$, call_105 loses 1$, call_108,110 earn 1$.
+    #                Call 108 will be selected because it's the first that breaks even.
+    #       For calls: first option (by strike) where Strike + OptionPrice > StockPrice * (1 + K)
+    #       For Puts: first option (by strike) where Strike - OptionPrice < StockPrice * (1 - K)
+    #       For pricing take bid
+    # All of the symbols and ratios are evaluated at once, the result maps every symbol to the selected chain row per
+    # ratio (-1 when there is no break even option for the ratio)
+    strike = chain['Strike'].astype(float)
+    bid = chain['Bid'].astype(float)
+    ask = chain['Ask'].astype(float)
+    underlying_price = chain['UnderlyingPrice'].astype(float)
+    ratios = np.array(ratio_params, dtype=float)
+
+    # Filtering only out of market options that are actually traded and cost more then MINIMUN_BID
+    tradable = (chain['Volume'] > 0) & (bid > MINIMUM_BID) & \
+               (chain['Expiration'] > np.datetime64(zip_date + datetime.timedelta(days=1))) & \
+               (chain['Expiration'] <= np.datetime64(zip_date + datetime.timedelta(days=7)))
+    call_rows = np.flatnonzero(tradable & (chain['Type'] == 'call') & (strike + bid > underlying_price))
+    put_rows = np.flatnonzero(tradable & (chain['Type'] == 'put') & (strike - bid < underlying_price))
+
+    call_break_even = (strike[call_rows] + 0.5 * bid[call_rows] + 0.5 * ask[call_rows])[:, None] > \
+        underlying_price[call_rows][:, None] * (1 + ratios)
+    put_break_even = (strike[put_rows] - 0.5 * bid[put_rows] - 0.5 * ask[put_rows])[:, None] < \
+        underlying_price[put_rows][:, None] * (1 - ratios)
+
+    # Calls are preferred by the lowest strike and puts by the highest strike
+    call_choices = get_first_option_per_symbol(chain['UnderlyingSymbol'], call_rows, strike[call_rows],
+                                               call_break_even)
+    put_choices = get_first_option_per_symbol(chain['UnderlyingSymbol'], put_rows, -strike[put_rows], put_break_even)
+    return call_choices, put_choices
+
+
+def get_first_option_per_symbol(symbols, rows, sort_key, matches):
+    result = dict()
+    if len(rows) == 0:
+        return result
+    symbol_codes, symbol_names = pd.factorize(symbols[rows])
+
+    # Order by symbol, then by preference, keeping the chain order between equal strikes
+    order = np.lexsort((rows, sort_key, symbol_codes))
+    symbol_codes = symbol_codes[order]
+    rows = rows[order]
+    matches = matches[order]
+    group_starts = np.flatnonzero(np.r_[True, symbol_codes[1:] != symbol_codes[:-1]])
+    no_match = len(rows)
+    match_positions = np.where(matches, np.arange(len(rows))[:, None], no_match)
+    first_matches = np.minimum.reduceat(match_positions, group_starts, axis=0)
+    selected_rows = np.where(first_matches < no_match, rows[np.minimum(first_matches, no_match - 1)], -1)
+    for group_index, group_start in enumerate(group_starts):
+        result[symbol_names[symbol_codes[group_start]]] = selected_rows[group_index]
+    return result
+
+
+def is_symbol_in_open_positions(open_positions, curr_stock_ratio, bid_ratio, batch_index, trade_symbol, zip_date):
+    if curr_stock_ratio not in open_positions or bid_ratio not in open_positions[curr_stock_ratio] or \
+            batch_index not in open_positions[curr_stock_ratio][bid_ratio]:
+        return False
+    curr_positions = open_positions[curr_stock_ratio][bid_ratio][batch_index]
+    # Any of the next seven expirations
+    curr_expiration = curr_positions.get_underlying_expiration(trade_symbol, zip_date + datetime.timedelta(days=1),
+                                                               zip_date + datetime.timedelta(days=7))
+    if curr_expiration is not None:
+        log.debug('%s Not trading in %s on %s because it already exists on %s', curr_stock_ratio, trade_symbol,
+                  zip_date, curr_expiration)
+        return True
+    return False
+
+
+def make_option_trade(chain, row, option_type, bid_ratio, zip_key):
+    return {'symbol': chain['OptionSymbol'][row],
+            'price': bid_ratio * chain['Bid'][row] + (1 - bid_ratio) * chain['Ask'][row],
+            'type': option_type,
+            'expiration': pd.Timestamp(chain['Expiration'][row]),
+            'underlying_symbol': chain['UnderlyingSymbol'][row],
+            'strike': chain['Strike'][row],
+            'write_date': zip_key,
+            'underlying_price': chain['UnderlyingPrice'][row]}
+
+
+class TradingDay:
+    # The options of one day as every strategy sees them. The parsed chain, the tradable options of a window, their
+    # IV ranking and the settlement index are built once, on the first strategy asking for them
+    def __init__(self, options_data, year, month, day, snp_symbols, stock_quote_store=None, timer=None,
+                 ranking=None):
+        self.options_data = options_data
+        # IV ranking of iv_ranking.RANKING_WINDOW precomputed by FilterCSVs
+        self.ranking = ranking
+        self.year = year
+        self.month = month
+        self.day = day
+        self.snp_symbols = snp_symbols
+        self.stock_quote_store = stock_quote_store
+        self.zip_date = datetime.datetime(year=year, month=month, day=day)
+        self.zip_key = f'{day:02}/{month:02}/{year}'
+        # The key of the day in the results, formatted only when they are written
+        self.day_number = get_day_number(year, month, day)
+        self.snp_options = None
+        self.windows = dict()
+        self.settlement_index = None
+        self.timer = metrics.PhaseTimer() if timer is None else timer
+
+    def get_window(self, min_days, max_days, maximum_iv):
+        window_key = (min_days, max_days, maximum_iv)
+        if window_key not in self.windows:
+            with self.timer.phase('filter'):
+                if self.snp_options is None:
+                    # Nothing is left to filter or parse when the options come from the chain cache
+                    self.snp_options = chain_cache.parse_options(self.options_data, self.snp_symbols)
+                tradable_options = filter_tradable_options(self.snp_options, self.zip_date, min_days, max_days,
+                                                           maximum_iv)
+                chain = get_chain_columns(tradable_options)
+            self.timer.count('tradable_options', len(tradable_options))
+            with self.timer.phase('iv_ranking'):
+                if self.ranking is not None and window_key == iv_ranking.RANKING_WINDOW:
+                    ranked_options = self.ranking
+                else:
+                    ranked_options = get_options_by_iv(tradable_options)
+            self.windows[window_key] = {'ranked_options': ranked_options, 'chain': chain}
+        return self.windows[window_key]
+
+    def get_settlement_index(self):
+        if self.settlement_index is None:
+            self.settlement_index = chain_index.index_chain(self.options_data)
+        return self.settlement_index
+
+    def get_stock_close(self, underlying_symbol):
+        if self.stock_quote_store is None:
+            self.stock_quote_store = stock_quotes.StockQuoteStore(STOCK_FILES_DIR)
+        return self.stock_quote_store.close(underlying_symbol, self.zip_date)
+
+
+class Strategy:
+    # The parameters and the daily loop every strategy shares. A strategy gets the day through its hooks: select picks
+    # the options to write, size turns them into trades, settle pays the expiring positions. The results of every
+    # hook have a dict per (stock ratio, bid ratio) of the get_trade_batches() batches
+    def __init__(self, name, ratio_params, bid_ratios, trade_batches=None, min_days=1, max_days=8, maximum_iv=4):
+        self.name = name
+        self.ratio_params = list(ratio_params)
+        self.bid_ratios = list(bid_ratios)
+        self.trade_batches = trade_batches
+        self.min_days = min_days
+        self.max_days = max_days
+        self.maximum_iv = maximum_iv
+
+    def get_trade_batches(self):
+        return MAX_TRADE_BATCH if self.trade_batches is None else self.trade_batches
+
+    def get_reference_bid_ratio(self):
+        # The positions of this bid ratio tell which symbols are held, the bid ratios only change the prices
+        return self.bid_ratios[0]
+
+    def select(self, trading_day, open_positions):
+        raise NotImplementedError()
+
+    def size(self, trading_day, selection):
+        # Returns (today_income, all_today_trade)
+        raise NotImplementedError()
+
+    def settle(self, trading_day, current_options, missing_options, split_symbols):
+        # Returns today_expenses
+        raise NotImplementedError()
+
+    def process_day(self, trading_day, current_options, missing_options, split_symbols, open_positions):
+        log.info(f'Handling options for {trading_day.zip_key} in {self.name}')
+        # The window of the day is built on first use, so it's timed by its own phases and not as part of selection
+        trading_day.get_window(self.min_days, self.max_days, self.maximum_iv)
+        with trading_day.timer.phase('selection'):
+            selection = self.select(trading_day, open_positions)
+        with trading_day.timer.phase('sizing'):
+            (today_income, all_today_trade) = self.size(trading_day, selection)
+        with trading_day.timer.phase('settlement'):
+            today_expenses = self.settle(trading_day, current_options, missing_options, split_symbols)
+
+        log.info(f'Summary for {trading_day.zip_key}:')
+        for curr_stock_ratio in self.ratio_params:
+            for curr_bid_ratio in self.bid_ratios:
+                for batch_index in range(self.get_trade_batches()):
+                    income = today_income[curr_stock_ratio][curr_bid_ratio][batch_index]
+                    expenses = today_expenses[curr_stock_ratio][curr_bid_ratio][batch_index]
+                log.info('%s,%s,%s: income: %s, expenses %s, daily total: %s', curr_stock_ratio, curr_bid_ratio,
+                         batch_index, income, expenses, income - expenses)
+
+        return today_income, today_expenses, all_today_trade
+
+
+class BreakEvenStrategy(Strategy):
+    # Writes a call and a put on the highest IV symbols, at the first strikes that break even if the stock moves by
+    # the expected change ratio, for every expected change ratio and bid ratio
+    def select(self, trading_day, open_positions):
+        # Only options that expire a week from today
+        window = trading_day.get_window(self.min_days, self.max_days, self.maximum_iv)
+        (daily_trades_num, trade_options_per_ratio) = select_daily_trades(
+            window['chain'], window['ranked_options'], trading_day.zip_date, self.ratio_params, open_positions,
+            self.get_trade_batches(), self.get_reference_bid_ratio())
+        return {'chain': window['chain'], 'daily_trades_num': daily_trades_num,
+                'trade_options_per_ratio': trade_options_per_ratio}
+
+    def size(self, trading_day, selection):
+        chain = selection['chain']
+        daily_trades_num = selection['daily_trades_num']
+        trade_options_per_ratio = selection['trade_options_per_ratio']
+        all_today_trade = dict()
+        today_income = dict()
+        for curr_stock_ratio in self.ratio_params:
+            today_income[curr_stock_ratio] = dict()
+            all_today_trade[curr_stock_ratio] = dict()
+            for curr_bid_ratio in self.bid_ratios:
+                today_income[curr_stock_ratio][curr_bid_ratio] = dict()
+                all_today_trade[curr_stock_ratio][curr_bid_ratio] = dict()
+                for batch_index in range(self.get_trade_batches()):
+                    today_income[curr_stock_ratio][curr_bid_ratio][batch_index] = 0
+                    all_today_trade[curr_stock_ratio][curr_bid_ratio][batch_index] = dict()
+
+        if min(daily_trades_num.values()) == -1: # TODO change back to 0
+            log.info(f'Not trading on {trading_day.zip_key}, trades per ratio are {daily_trades_num}')
+            return today_income, all_today_trade
+
+        for curr_stock_ratio in self.ratio_params:
             if daily_trades_num[curr_stock_ratio] == 0:
-                log.info(f'{day}/{month}/{year} Not trading in ratio={curr_stock_ratio}')
-            else:
-                trade_index = -1
-                batches_in_ratio = int(daily_trades_num[curr_stock_ratio] / DAILY_TRADE_OPTIONS)
-                if daily_trades_num[curr_stock_ratio] % DAILY_TRADE_OPTIONS > 0:
-                    batches_in_ratio += 1
-                log.info(f'Trading in {batches_in_ratio} batches for ratio {curr_stock_ratio}, total '
-                         f'{daily_trades_num[curr_stock_ratio]} symbols {len(trade_options_per_ratio[curr_stock_ratio])}')
-                for curr_trade in trade_options_per_ratio[curr_stock_ratio]:
-                    trade_index += 1
-                    trade_batch_index = int(trade_index / (DAILY_TRADE_OPTIONS *2))
-                    if trade_batch_index + 1 < batches_in_ratio:
+                log.info(f'{trading_day.zip_key} Not trading in ratio={curr_stock_ratio}')
+                continue
+            trade_index = -1
+            batches_in_ratio = int(daily_trades_num[curr_stock_ratio] / DAILY_TRADE_OPTIONS)
+            if daily_trades_num[curr_stock_ratio] % DAILY_TRADE_OPTIONS > 0:
+                batches_in_ratio += 1
+            log.info(f'Trading in {batches_in_ratio} batches for ratio {curr_stock_ratio}, total '
+                     f'{daily_trades_num[curr_stock_ratio]} symbols {len(trade_options_per_ratio[curr_stock_ratio])}')
+            for curr_trade in trade_options_per_ratio[curr_stock_ratio]:
+                trade_index += 1
+                trade_batch_index = int(trade_index / (DAILY_TRADE_OPTIONS *2))
+                if trade_batch_index + 1 < batches_in_ratio:
+                    batch_symbols = DAILY_TRADE_OPTIONS
+                else:
+                    batch_symbols = daily_trades_num[curr_stock_ratio] % DAILY_TRADE_OPTIONS
+                    if batch_symbols == 0:
                         batch_symbols = DAILY_TRADE_OPTIONS
-                    else:
-                        batch_symbols = daily_trades_num[curr_stock_ratio] % DAILY_TRADE_OPTIONS
-                        if batch_symbols == 0:
-                            batch_symbols = DAILY_TRADE_OPTIONS
-                    symbol_trade_in_ratio = TRADE_PER_SYMBOL / batch_symbols
-                    log.info(f'{day}/{month}/{year} {trade_index} trading in ratio={curr_stock_ratio} in '
-                             f'{batch_symbols} symbols in batch {trade_batch_index + 1}, '
-                             f'{symbol_trade_in_ratio} USD per symbol')
-                    if trade_batch_index >= MAX_TRADE_BATCH:
-                        break
-                    ratio_trade_indexes[curr_stock_ratio] += 1
-                    calls = curr_trade['calls']
-                    puts = curr_trade['puts']
-                    for curr_bid_ratio in bid_ratios:
-                        option_trade_symbols = [{'symbol': calls['OptionSymbol'].iloc[0],
-                                                 'price': curr_bid_ratio * calls['Bid'].iloc[0] +
-                                                          (1 - curr_bid_ratio) * calls['Ask'].iloc[0],
-                                                 'type': 'call',
-                                                 'expiration': calls['Expiration'].iloc[0],
-                                                 'underlying_symbol': calls['UnderlyingSymbol'].iloc[0],
-                                                 'strike': calls['Strike'].iloc[0],
-                                                 'write_date': zip_key,
-                                                 'underlying_price': calls['UnderlyingPrice'].iloc[0]},
-                                                {'symbol': puts['OptionSymbol'].iloc[0],
-                                                 'price': curr_bid_ratio * puts['Bid'].iloc[0] + (
-                                                         1 - curr_bid_ratio) * puts['Ask'].iloc[0],
-                                                 'type': 'put',
-                                                 'expiration': puts['Expiration'].iloc[0],
-                                                 'underlying_symbol': puts['UnderlyingSymbol'].iloc[0],
-                                                 'strike': puts['Strike'].iloc[0],
-                                                 'write_date': zip_key,
-                                                 'underlying_price': puts['UnderlyingPrice'].iloc[0]}]
-                        for curr_option_trade_symbol in option_trade_symbols:
-                            trade_size = int(math.floor((symbol_trade_in_ratio / len(option_trade_symbols)) /
-                                                        curr_option_trade_symbol['price']))
-                            curr_option_trade_symbol['size'] = trade_size
-                            log.info(f'{curr_stock_ratio},{curr_bid_ratio},{trade_batch_index}: Writing '
-                                     f'{trade_size} * {curr_option_trade_symbol["symbol"]} for '
-                                     f'{curr_option_trade_symbol["price"]}')
-                            #log.info(f'{curr_stock_ratio} {curr_bid_ratio} {trade_batch_index} {trade_index} {today_income}')
-                            today_income[curr_stock_ratio][curr_bid_ratio][trade_batch_index] += \
-                                curr_option_trade_symbol['price'] * trade_size - WRITE_OPTIONS_FEE
-                            if curr_option_trade_symbol['expiration'] not in \
-                                    all_today_trade[curr_stock_ratio][curr_bid_ratio][trade_batch_index]:
-                                all_today_trade[curr_stock_ratio][curr_bid_ratio][trade_batch_index][
-                                    curr_option_trade_symbol['expiration']] = []
+                symbol_trade_in_ratio = TRADE_PER_SYMBOL / batch_symbols
+                log.debug('%s %s trading in ratio=%s in %s symbols in batch %s, %s USD per symbol',
+                          trading_day.zip_key, trade_index, curr_stock_ratio, batch_symbols, trade_batch_index + 1,
+                          symbol_trade_in_ratio)
+                if trade_batch_index >= self.get_trade_batches():
+                    break
+                for curr_bid_ratio in self.bid_ratios:
+                    option_trade_symbols = [make_option_trade(chain, curr_trade['call'], 'call', curr_bid_ratio,
+                                                              trading_day.zip_key),
+                                            make_option_trade(chain, curr_trade['put'], 'put', curr_bid_ratio,
+                                                              trading_day.zip_key)]
+                    for curr_option_trade_symbol in option_trade_symbols:
+                        trade_size = int(math.floor((symbol_trade_in_ratio / len(option_trade_symbols)) /
+                                                    curr_option_trade_symbol['price']))
+                        curr_option_trade_symbol['size'] = trade_size
+                        trading_day.timer.count('written_options')
+                        log.debug('%s,%s,%s: Writing %s * %s for %s', curr_stock_ratio, curr_bid_ratio,
+                                  trade_batch_index, trade_size, curr_option_trade_symbol['symbol'],
+                                  curr_option_trade_symbol['price'])
+                        today_income[curr_stock_ratio][curr_bid_ratio][trade_batch_index] += \
+                            curr_option_trade_symbol['price'] * trade_size - WRITE_OPTIONS_FEE
+                        if curr_option_trade_symbol['expiration'] not in \
+                                all_today_trade[curr_stock_ratio][curr_bid_ratio][trade_batch_index]:
                             all_today_trade[curr_stock_ratio][curr_bid_ratio][trade_batch_index][
-                                curr_option_trade_symbol['expiration']].append(
-                                curr_option_trade_symbol)
-
-    # When option expires pay the difference Strike and StockPrice
-    today_expenses = dict()
-    for curr_stock_ratio in ratio_params:
-        today_expenses[curr_stock_ratio] = dict()
-        for curr_bid_ratio in bid_ratios:
-            today_expenses[curr_stock_ratio][curr_bid_ratio] = dict()
-            for batch_index in current_options[curr_stock_ratio][curr_bid_ratio]:
-                today_expenses[curr_stock_ratio][curr_bid_ratio][batch_index] = 0
-                if zip_date in current_options[curr_stock_ratio][curr_bid_ratio][batch_index]:
+                                curr_option_trade_symbol['expiration']] = []
+                        all_today_trade[curr_stock_ratio][curr_bid_ratio][trade_batch_index][
+                            curr_option_trade_symbol['expiration']].append(
+                            curr_option_trade_symbol)
+        return today_income, all_today_trade
+
+    def settle(self, trading_day, current_options, missing_options, split_symbols):
+        # When option expires pay the difference Strike and StockPrice
+        zip_date = trading_day.zip_date
+        day_number = trading_day.day_number
+        today_expenses = dict()
+        for curr_stock_ratio in self.ratio_params:
+            today_expenses[curr_stock_ratio] = dict()
+            for curr_bid_ratio in self.bid_ratios:
+                today_expenses[curr_stock_ratio][curr_bid_ratio] = dict()
+                for batch_index in current_options[curr_stock_ratio][curr_bid_ratio]:
+                    today_expenses[curr_stock_ratio][curr_bid_ratio][batch_index] = 0
+                    if zip_date not in current_options[curr_stock_ratio][curr_bid_ratio][batch_index]:
+                        continue
+                    settlement_index = trading_day.get_settlement_index()
                     missing_symbols = []
-                    for curr_traded_symbol in current_options[curr_stock_ratio][curr_bid_ratio][batch_index][zip_date]:
+                    for curr_traded_symbol in current_options[curr_stock_ratio][curr_bid_ratio][batch_index].options(
+                            zip_date):
+                        trading_day.timer.count('settled_options')
                         underlying_price = None
                         pay_per_option = 0
-                        symbol_data = options_data[options_data.OptionSymbol ==
-                                                   curr_traded_symbol['symbol']]
+                        option_row = settlement_index['option_rows'].get(curr_traded_symbol['symbol'])
                         price_available = True
-                        if symbol_data.shape[0] == 0:
-                            log.info(f'{zip_date},{curr_stock_ratio}{curr_bid_ratio}'
-                                  f' Missing symbol: {curr_traded_symbol["symbol"]}')
+                        if option_row is None:
+                            log.info('%s,%s%s Missing symbol: %s', zip_date, curr_stock_ratio, curr_bid_ratio,
+                                     curr_traded_symbol['symbol'])
                             pay_per_option = curr_traded_symbol['price'] # Keeping the original price payed for the option so
                                                                          # it can be used if the underlying price is unavailable
-                            store_missing(missing_options, curr_stock_ratio, curr_bid_ratio, batch_index, zip_key,
+                            store_missing(missing_options, curr_stock_ratio, curr_bid_ratio, batch_index, day_number,
                                           curr_traded_symbol)
-                            symbol_data = options_data[options_data.UnderlyingSymbol ==
-                                                       curr_traded_symbol['underlying_symbol']]
-                            if symbol_data.shape[0] == 0:
-                                stocks_filename = f'stockquotes_{year}{month:02}{day:02}.csv'
-                                log.info(f'Missing price in options file, checking in {stocks_filename} for {curr_traded_symbol["underlying_symbol"]}')
-                                stocks = pd.read_csv(os.path.join(STOCK_FILES_DIR, stocks_filename))
-                                curr_quote = stocks[stocks.symbol == curr_traded_symbol['underlying_symbol']]
-                                if curr_quote.shape[0] != 0:
-                                    underlying_price = curr_quote['close'].iloc[0]
+                            chain_underlying_price = settlement_index['underlying_prices'].get(
+                                curr_traded_symbol['underlying_symbol'])
+                            if chain_underlying_price is None:
+                                stocks_filename = f'stockquotes_{trading_day.year}{trading_day.month:02}' \
+                                                  f'{trading_day.day:02}.csv'
+                                log.info('Missing price in options file, checking in %s for %s', stocks_filename,
+                                         curr_traded_symbol['underlying_symbol'])
+                                stock_close = trading_day.get_stock_close(curr_traded_symbol['underlying_symbol'])
+                                if stock_close is not None:
+                                    underlying_price = stock_close
                                 else:
                                     price_available = False
-                                    log.info(f'Missing price in stocks file {stocks_filename} for {curr_traded_symbol["underlying_symbol"]}')
+                                    log.info('Missing price in stocks file %s for %s', stocks_filename,
+                                             curr_traded_symbol['underlying_symbol'])
 
-                            if symbol_data.shape[0] == 0 or symbol_data['UnderlyingPrice'].iloc[0] / \
+                            if chain_underlying_price is None or chain_underlying_price / \
                                     curr_traded_symbol['underlying_price'] < ASSUME_SPLIT_RATIO:
                                 price_available = False
-                                log.info(f'{zip_date},{curr_stock_ratio}{curr_bid_ratio}'
-                                         f' Assuming split on symbol: {curr_traded_symbol["underlying_symbol"]}')
-                                store_missing(split_symbols, curr_stock_ratio, curr_bid_ratio, batch_index, zip_key,
+                                log.info('%s,%s%s Assuming split on symbol: %s', zip_date, curr_stock_ratio,
+                                         curr_bid_ratio, curr_traded_symbol['underlying_symbol'])
+                                store_missing(split_symbols, curr_stock_ratio, curr_bid_ratio, batch_index, day_number,
                                               curr_traded_symbol)
                                 #missing_symbols.append(curr_traded_symbol['symbol'])
                                 underlying_price = 'UNKOWN'
+                        else:
+                            chain_underlying_price = settlement_index['underlying_price_column'][option_row]
                         add_fee = 0
                         if not price_available:
                             # Reducing the fee from the expenses so it's "refunded" when we roll back the options
@@ -519,7 +1005,7 @@ def process_options_file(options_data, year, month, day, snp_symbols, current_op
                         else:
                             pay_per_option = 0
                             if not underlying_price:
-                                underlying_price = symbol_data['UnderlyingPrice'].iloc[0]
+                                underlying_price = chain_underlying_price
                             strike_price = curr_traded_symbol['strike']
                             if curr_traded_symbol['type'] == 'call' and underlying_price > strike_price:
                                 pay_per_option = underlying_price - strike_price
@@ -527,31 +1013,23 @@ def process_options_file(options_data, year, month, day, snp_symbols, current_op
                                 pay_per_option = strike_price - underlying_price
                         symbol_expenses = pay_per_option * curr_traded_symbol['size'] - add_fee
                         today_expenses[curr_stock_ratio][curr_bid_ratio][batch_index] += symbol_expenses
-                        log.info(f'{curr_stock_ratio},{curr_bid_ratio},{batch_index}: For '
-                                 f'{curr_traded_symbol["symbol"]} the underlying price is {underlying_price}, paying '
-                                 f'{pay_per_option} for {curr_traded_symbol["size"]} options, total to pay is '
-                                 f'{symbol_expenses}')
+                        log.debug('%s,%s,%s: For %s the underlying price is %s, paying %s for %s options, total to '
+                                  'pay is %s', curr_stock_ratio, curr_bid_ratio, batch_index,
+                                  curr_traded_symbol['symbol'], underlying_price, pay_per_option,
+                                  curr_traded_symbol['size'], symbol_expenses)
                     if len(missing_symbols) == 0:
-                        del current_options[curr_stock_ratio][curr_bid_ratio][batch_index][zip_date]
+                        current_options[curr_stock_ratio][curr_bid_ratio][batch_index].remove(zip_date)
                     else:
-                        current_options[curr_stock_ratio][curr_bid_ratio][batch_index][zip_date][:] = \
-                            [curr_traded_symbol for curr_traded_symbol in
-                             current_options[curr_stock_ratio][curr_bid_ratio][batch_index][zip_date] if not
-                             curr_traded_symbol['symbol'] in missing_symbols]
-                        if len(current_options[curr_stock_ratio][curr_bid_ratio][batch_index][zip_date]) == 0:
-                            del current_options[curr_stock_ratio][curr_bid_ratio][batch_index][zip_date]
-
-    log.info(f'Summary for {day}/{month}/{year}:')
-    for curr_stock_ratio in ratio_params:
-        for curr_bid_ratio in bid_ratios:
-            for batch_index in range(trade_batches):
-                income = today_income[curr_stock_ratio][curr_bid_ratio][batch_index]
-                expenses = today_expenses[curr_stock_ratio][curr_bid_ratio][batch_index]
-            log.info(f'{curr_stock_ratio},{curr_bid_ratio},{batch_index}: income: {income},'
-                  f' expenses {expenses}, '
-                  f'daily total: {income - expenses}')
+                        current_options[curr_stock_ratio][curr_bid_ratio][batch_index].remove(zip_date,
+                                                                                              missing_symbols)
+        return today_expenses
+
 
-    return today_income, today_expenses, all_today_trade
+def process_options_file(options_data, year, month, day, snp_symbols, current_options, ratio_params, bid_ratios,
+                         trade_batches, missing_options, split_symbols, open_positions, stock_quote_store=None):
+    trading_day = TradingDay(options_data, year, month, day, snp_symbols, stock_quote_store)
+    strategy = BreakEvenStrategy('default', ratio_params, bid_ratios, trade_batches)
+    return strategy.process_day(trading_day, current_options, missing_options, split_symbols, open_positions)
 
 
 def filter_snp_symbols(data, symbols):
@@ -562,69 +1040,27 @@ def filter_equity_snp_symbols(data, symbols):
     return data[data.symbol.isin(symbols)].copy()
 
 
-def plot_results(daily_results, ratio_params, bid_ratios, max_batch, start_time, results_dir):
-    dates = sorted(daily_results.keys(), key=str_to_date)
-    for curr_date in range(len(dates)):
-        dates[curr_date] =  datetime.datetime.strptime(dates[curr_date], "%d/%m/%Y")
-    status_by_bid = dict()
-    for curr_bid in bid_ratios:
-        status_by_bid[curr_bid] = dict()
-    for curr_stock_ratio in ratio_params:
-        for curr_bid in bid_ratios:
-            status_by_bid[curr_bid][curr_stock_ratio] = dict()
-            for batch_index in range(max_batch):
-                plot_y = []
-                for curr_date in dates:
-                    plot_y.append(daily_results[f'{curr_date.day:02}/{curr_date.month:02}/{curr_date.year}'][curr_stock_ratio][curr_bid][batch_index])
-                status_by_bid[curr_bid][curr_stock_ratio][batch_index] = plot_y
-    chart_index = 0
-    for curr_bid in status_by_bid:
-        for batch_index in range(max_batch):
-            chart_index += 2
-            ratio_index = 0
-            for curr_stock_ratio in ratio_params:
-                ratio_index += 1
-                if ratio_index % 2 == 1:
-                    plt.figure(chart_index)
-                else:
-                    plt.figure(chart_index - 1)
-                plt.plot(dates, status_by_bid[curr_bid][curr_stock_ratio][batch_index],
-                         label=f'Stock Ratio={curr_stock_ratio}')
-            for curr_chart in [chart_index - 1, chart_index]:
-                plt.figure(curr_chart)
-                plt.legend(loc='upper left')
-                plt.xlabel('Date')
-                plt.ylabel('Profit / Loss (USD)')
-                plt.title(f'Bid Ratio = {curr_bid}, Batch = {batch_index + 1}')
-                if curr_chart % 2 == 0:
-                    even = '_even'
-                else:
-                    even = '_odd'
-                figure_path = os.path.join(results_dir, f'Bid_{curr_bid}_Batch_{batch_index + 1}{even}.png')
-                plt.savefig(figure_path)
-                log.info(f'Saved {figure_path}')
-
+def plot_results(daily_status, ratio_params, bid_ratios, trade_batches, results_dir, workers=1, results_format='png'):
+    for chart_path in results_plot.plot_results(daily_status, ratio_params, bid_ratios, trade_batches, results_dir,
+                                                workers, results_format):
+        log.info(f'Saved {chart_path}')
 
-def str_to_date(curr_date):
-    trade_date = datetime.datetime.strptime(curr_date, "%d/%m/%Y")
-    return trade_date
 
-
-def store_missing(missing_dict, stock_ratio, bid_ratio, batch_index, zip_key, traded_symbol):
+def store_missing(missing_dict, stock_ratio, bid_ratio, batch_index, day_number, traded_symbol):
     if stock_ratio not in missing_dict:
         missing_dict[stock_ratio] = dict()
     if bid_ratio not in missing_dict[stock_ratio]:
         missing_dict[stock_ratio][bid_ratio] = dict()
     if batch_index not in missing_dict[stock_ratio][bid_ratio]:
         missing_dict[stock_ratio][bid_ratio][batch_index] = dict()
-    if zip_key not in missing_dict[stock_ratio][bid_ratio][batch_index]:
-        missing_dict[stock_ratio][bid_ratio][batch_index][zip_key] = dict()
+    if day_number not in missing_dict[stock_ratio][bid_ratio][batch_index]:
+        missing_dict[stock_ratio][bid_ratio][batch_index][day_number] = dict()
     underlying_symbol = traded_symbol['underlying_symbol']
     if underlying_symbol not in missing_dict[stock_ratio][bid_ratio][batch_index][
-        zip_key]:
-        missing_dict[stock_ratio][bid_ratio][batch_index][zip_key][
+        day_number]:
+        missing_dict[stock_ratio][bid_ratio][batch_index][day_number][
             underlying_symbol] = []
-        missing_dict[stock_ratio][bid_ratio][batch_index][zip_key][
+        missing_dict[stock_ratio][bid_ratio][batch_index][day_number][
         underlying_symbol].append(
             traded_symbol)
 
@@ -641,8 +1077,17 @@ if __name__ == '__main__':
     run_time = datetime.datetime.now()
     time_text = f'{run_time.year}_{run_time.month:02}_{run_time.day:02}_{run_time.hour:02}_{run_time.minute:02}_' \
                 f'{run_time.second}'
-    results_dir = f'Results_{time_text}'
-    os.makedirs(results_dir)
+
+    # read command line arguments, --options may come anywhere
+    arguments = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    options = [argument for argument in sys.argv[1:] if argument.startswith('--')]
+    resume = '--resume' in options
+    if resume:
+        # Continue in the results folder of the latest checkpoint
+        results_dir = get_latest_checkpoint_dir('.')
+    else:
+        results_dir = f'Results_{time_text}'
+        os.makedirs(results_dir)
 
     # set logger
     formatter = logging.Formatter('%(asctime)s %(levelname)s %(filename)s(%(lineno)d) %(funcName)s %(threadName)s'
@@ -650,7 +1095,8 @@ if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s %(levelname)s %(filename)s(%(lineno)d) %(funcName)s %(threadName)s'
                                ' %(thread)d %(message)s')
     log = logging.getLogger('SimulateTrade')
-    log.setLevel(logging.DEBUG)
+    # Every written and settled option is logged only with --verbose
+    log.setLevel(logging.DEBUG if '--verbose' in options else logging.INFO)
     fh = logging.FileHandler(os.path.join(results_dir, f'Simulate_{time_text}.log'))
     fh.setFormatter(formatter)
     fh.setLevel(logging.DEBUG)
@@ -663,20 +1109,32 @@ if __name__ == '__main__':
     start_date = date(1950, 1, 1) 
     end_date = date.today()
     is_compressed = False
+    workers = 1
 
-    # read command line arguments
-    if len(sys.argv) > 1:
-        start_date =  parse_date(sys.argv[1])
+    if resume:
+        log.info(f'Resuming the simulation in {results_dir}')
+    if len(arguments) > 0:
+        start_date =  parse_date(arguments[0])
         log.info(f'Set simulation start date to: {start_date}')
-    if len(sys.argv) > 2:
-        end_date = parse_date(sys.argv[2])
+    if len(arguments) > 1:
+        end_date = parse_date(arguments[1])
         log.info(f'Set simulation end date to: {end_date}')
-    if len(sys.argv) > 3:
-        is_compressed = bool(sys.argv[3].lower())
+    if len(arguments) > 2:
+        is_compressed = bool(arguments[2].lower())
+    if len(arguments) > 3:
+        workers = int(arguments[3])
+        log.info(f'Running the parameters sweep with {workers} workers')
+    # The checkpoints of a run are saved only with its daily results streamed
+    stream_results = '--stream' in options or resume
+    if stream_results:
+        log.info(f'Streaming the daily results to {results_dir}')
+    # One interactive page instead of the chart images
+    results_format = 'html' if '--html' in options else 'png'
 
     src_dir = ".\\FilteredCSVs_zipped" if is_compressed else ".\\FilteredCSVs"
 
-    process_source_dir(src_dir, snp_500_symbols, is_compressed, results_dir, start_date, end_date)
+    process_source_dir(src_dir, snp_500_symbols, is_compressed, results_dir, start_date, end_date, workers,
+                       stream_results, resume, results_format=results_format)
 
     end_time = time.time()
     log.info("Processing took %s seconds", str(end_time - start_time))
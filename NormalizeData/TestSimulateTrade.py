@@ -1,7 +1,20 @@
 import SimulateTrade
+import pytest
+import chain_cache
+import stock_quotes
+import position_book
+import metrics
+import iv_ranking
+import manifest
+import schema
+import utils
 import pandas as pd
 import datetime
 import zipfile
+import math
+import os
+import json
+import pickle
 
 today = datetime.datetime.today()
 test_data = {'UnderlyingSymbol': ['FB', 'AA', 'AMZN', 'GOOG'], 'UnderlyingPrice': [100, 200, 2.3, 1],
@@ -9,6 +22,51 @@ test_data = {'UnderlyingSymbol': ['FB', 'AA', 'AMZN', 'GOOG'], 'UnderlyingPrice'
                             today + datetime.timedelta(days=5)],
              'Bid': [0, 0.1, 0.7, 1.2]}
 
+# A synthetic full day chain for 10 underlyings with two weekly expirations
+fixture_date = datetime.datetime(year=2013, month=11, day=4)
+fixture_underlyings = [('AAPL', 520.0, 0.31), ('AMZN', 355.0, 0.42), ('BAC', 15.2, 0.37), ('FB', 48.0, 0.55),
+                       ('GOOG', 1020.0, 0.24), ('IBM', 180.0, 0.19), ('MSFT', 35.5, 0.28), ('NFLX', 330.0, 0.63),
+                       ('XOM', 93.0, 0.16), ('TSLA', 140.0, 0.71)]
+
+
+def make_fixture_chain(trade_date=fixture_date, price_change=0):
+    rows = []
+    expirations = [trade_date + datetime.timedelta(days=4), trade_date + datetime.timedelta(days=11)]
+    for symbol, price, iv in fixture_underlyings:
+        price = round(price * (1 + price_change), 2)
+        step = max(round(price * 0.02, 0), 0.5)
+        for expiration_index, expiration in enumerate(expirations):
+            days = (expiration - trade_date).days
+            for strike_index in range(-7, 8):
+                strike = price + strike_index * step
+                for option_type in ['call', 'put']:
+                    intrinsic = max(price - strike, 0) if option_type == 'call' else max(strike - price, 0)
+                    time_value = price * iv * math.sqrt(days / 365) * 0.4 * math.exp(-abs(strike_index) / 3)
+                    bid = round(intrinsic + time_value, 2)
+                    ask = round(bid * 1.04 + 0.05, 2)
+                    option_symbol = f'{symbol}{expiration.year % 100:02}{expiration.month:02}{expiration.day:02}' \
+                                    f'{option_type[0].upper()}{int(strike * 1000):08}'
+                    rows.append({'UnderlyingSymbol': symbol, 'UnderlyingPrice': price, 'Exchange': '*',
+                                 'OptionSymbol': option_symbol, 'Type': option_type,
+                                 'Expiration': f'{expiration.month:02}/{expiration.day:02}/{expiration.year}',
+                                 'DataDate': f'{trade_date.month:02}/{trade_date.day:02}/{trade_date.year}',
+                                 'Strike': strike, 'Last': round((bid + ask) / 2, 2), 'Bid': bid, 'Ask': ask,
+                                 'Volume': 0 if (strike_index + expiration_index) % 6 == 0 else 10 + abs(strike_index),
+                                 'OpenInterest': 100 + strike_index * strike_index,
+                                 'IV': round(iv * (1 + 0.03 * abs(strike_index)) + 0.01 * expiration_index, 4)})
+    rows.append(dict(rows[0], UnderlyingSymbol='ZZZZ', OptionSymbol='ZZZZ131108C00100000', IV=3.5))
+    return pd.DataFrame(rows)
+
+
+def write_fixture_days(source_dir):
+    # The fixture day, the next day and the expiration day of the fixture day weekly options
+    for (day_offset, price_change) in [(0, 0), (1, 0.01), (4, -0.03)]:
+        trade_date = fixture_date + datetime.timedelta(days=day_offset)
+        make_fixture_chain(trade_date, price_change).to_csv(
+            os.path.join(source_dir, f'options_{trade_date.year}{trade_date.month:02}{trade_date.day:02}.csv'),
+            index=False)
+
+
 def test_filter_snp_500():
     df = pd.DataFrame.from_dict(test_data)
     filter_symbols = ['FB', 'AMZN', 'GOOG']
@@ -46,6 +104,868 @@ def test_get_options_by_iv(test_files):
                 tradeable_symbols[trade_date_str].append({trade_group[0]: curr_iv})
     print(tradeable_symbols)
 
+
+def make_fixture_open_positions(ratio_params, bid_ratios):
+    open_positions = dict()
+    nflx_expiration = fixture_date + datetime.timedelta(days=4)
+    for curr_stock_ratio in ratio_params:
+        open_positions[curr_stock_ratio] = dict()
+        for curr_bid_ratio in bid_ratios:
+            expiring_positions = [
+                {'symbol': 'AAPL131104C00500000', 'price': 3.0, 'type': 'call', 'expiration': fixture_date,
+                 'underlying_symbol': 'AAPL', 'strike': 500.0, 'write_date': '28/10/2013', 'underlying_price': 510.0,
+                 'size': 10},
+                {'symbol': 'MSFT131108P00036500', 'price': 1.2, 'type': 'put', 'expiration': fixture_date,
+                 'underlying_symbol': 'MSFT', 'strike': 36.5, 'write_date': '28/10/2013', 'underlying_price': 36.0,
+                 'size': 40},
+                {'symbol': 'FB131104C00050000', 'price': 2.0, 'type': 'call', 'expiration': fixture_date,
+                 'underlying_symbol': 'FB', 'strike': 50.0, 'write_date': '28/10/2013', 'underlying_price': 100.0,
+                 'size': 7}]
+            open_positions[curr_stock_ratio][curr_bid_ratio] = {0: position_book.PositionBook()}
+            open_positions[curr_stock_ratio][curr_bid_ratio][0].add(fixture_date, expiring_positions)
+            if curr_stock_ratio in [0, 0.02]:
+                open_positions[curr_stock_ratio][curr_bid_ratio][0].add(nflx_expiration, [
+                    {'symbol': 'NFLX131108C00350000', 'price': 4.0, 'type': 'call', 'expiration': nflx_expiration,
+                     'underlying_symbol': 'NFLX', 'strike': 350.0, 'write_date': '01/11/2013',
+                     'underlying_price': 330.0, 'size': 5}])
+    return open_positions
+
+
+# Results of the row by row implementation of process_options_file on the fixture day
+expected_fixture_trades = {
+    (0, 1): (6792.26, [('TSLA131108C00119000', 23), ('TSLA131108P00161000', 23), ('FB131108C00041000', 70),
+                       ('FB131108P00055000', 70), ('AMZN131108C00306000', 10), ('AMZN131108P00404000', 10),
+                       ('BAC131108C00011700', 142), ('BAC131108P00018700', 142), ('AAPL131108C00450000', 7),
+                       ('AAPL131108P00590000', 7), ('MSFT131108C00028500', 71), ('MSFT131108P00042500', 71),
+                       ('GOOG131108C00880000', 3), ('GOOG131108P01160000', 3)]),
+    (0, 0.5): (6568.25, [('TSLA131108C00119000', 22), ('TSLA131108P00161000', 22), ('FB131108C00041000', 68),
+                         ('FB131108P00055000', 68), ('AMZN131108C00306000', 9), ('AMZN131108P00404000', 9),
+                         ('BAC131108C00011700', 138), ('BAC131108P00018700', 138), ('AAPL131108C00450000', 6),
+                         ('AAPL131108P00590000', 6), ('MSFT131108C00028500', 69), ('MSFT131108P00042500', 69),
+                         ('GOOG131108C00880000', 3), ('GOOG131108P01160000', 3)]),
+    (0.02, 1): (4968.76, [('TSLA131108C00137000', 83), ('TSLA131108P00143000', 83), ('FB131108C00049000', 632),
+                          ('FB131108P00047000', 632), ('AMZN131108C00362000', 111), ('AMZN131108P00348000', 111),
+                          ('AAPL131108C00530000', 103), ('AAPL131108P00510000', 103), ('GOOG131108C01040000', 68),
+                          ('GOOG131108P01000000', 68)]),
+    (0.02, 0.5): (4964.32, [('TSLA131108C00137000', 81), ('TSLA131108P00143000', 81), ('FB131108C00049000', 602),
+                            ('FB131108P00047000', 602), ('AMZN131108C00362000', 109), ('AMZN131108P00348000', 109),
+                            ('AAPL131108C00530000', 100), ('AAPL131108P00510000', 100), ('GOOG131108C01040000', 66),
+                            ('GOOG131108P01000000', 66)]),
+    (0.1, 1): (4980.72, [('TSLA131108C00155000', 632), ('TSLA131108P00125000', 632), ('NFLX131108C00365000', 304),
+                         ('NFLX131108P00295000', 304), ('AMZN131108C00390000', 423), ('AMZN131108P00320000', 423),
+                         ('AAPL131108C00590000', 769), ('AAPL131108P00450000', 769), ('GOOG131108C01120000', 257),
+                         ('GOOG131108P00920000', 257)]),
+    (0.1, 0.5): (4985.19, [('TSLA131108C00155000', 602), ('TSLA131108P00125000', 602), ('NFLX131108C00365000', 294),
+                           ('NFLX131108P00295000', 294), ('AMZN131108C00390000', 406), ('AMZN131108P00320000', 406),
+                           ('AAPL131108C00590000', 724), ('AAPL131108P00450000', 724), ('GOOG131108C01120000', 249),
+                           ('GOOG131108P00920000', 249)])}
+
+
+def run_fixture_day(ratio_params=(0, 0.02, 0.1), bid_ratios=(1, 0.5)):
+    ratio_params = list(ratio_params)
+    bid_ratios = list(bid_ratios)
+    open_positions = make_fixture_open_positions(ratio_params, bid_ratios)
+    snp_symbols = set(symbol for (symbol, _, _) in fixture_underlyings)
+    (today_income, today_expenses, all_today_trade) = SimulateTrade.process_options_file(
+        make_fixture_chain(), fixture_date.year, fixture_date.month, fixture_date.day, snp_symbols, open_positions,
+        ratio_params, bid_ratios, 1, dict(), dict(), open_positions)
+    return today_income, today_expenses, all_today_trade, open_positions
+
+
+def test_process_options_file_parity():
+    (today_income, today_expenses, all_today_trade, open_positions) = run_fixture_day()
+    for (curr_stock_ratio, curr_bid_ratio) in expected_fixture_trades:
+        (expected_income, expected_trades) = expected_fixture_trades[(curr_stock_ratio, curr_bid_ratio)]
+        trades = []
+        for expiration in all_today_trade[curr_stock_ratio][curr_bid_ratio][0]:
+            assert expiration == fixture_date + datetime.timedelta(days=4)
+            for option in all_today_trade[curr_stock_ratio][curr_bid_ratio][0][expiration]:
+                assert option['write_date'] == '04/11/2013'
+                trades.append((option['symbol'], option['size']))
+        assert trades == expected_trades
+        assert round(today_income[curr_stock_ratio][curr_bid_ratio][0], 2) == expected_income
+        assert round(today_expenses[curr_stock_ratio][curr_bid_ratio][0], 2) == 252.99
+        assert fixture_date not in open_positions[curr_stock_ratio][curr_bid_ratio][0]
+
+
+def test_position_book():
+    open_positions = make_fixture_open_positions([0], [1])
+    book = open_positions[0][1][0]
+    nflx_expiration = fixture_date + datetime.timedelta(days=4)
+    assert fixture_date in book and nflx_expiration in book
+    assert book.cost() == 3.0 * 10 + 1.2 * 40 + 2.0 * 7 + 4.0 * 5
+    week_end = fixture_date + datetime.timedelta(days=7)
+    assert book.get_underlying_expiration('MSFT', fixture_date, week_end) == fixture_date
+    assert book.get_underlying_expiration('NFLX', fixture_date, week_end) == nflx_expiration
+    assert book.get_underlying_expiration('NFLX', fixture_date, nflx_expiration - datetime.timedelta(days=1)) is None
+    options = book.options(fixture_date)
+    assert [option['symbol'] for option in options] == ['AAPL131104C00500000', 'MSFT131108P00036500',
+                                                        'FB131104C00050000']
+    assert options[1] == {'symbol': 'MSFT131108P00036500', 'price': 1.2, 'type': 'put', 'expiration': fixture_date,
+                          'underlying_symbol': 'MSFT', 'strike': 36.5, 'write_date': '28/10/2013',
+                          'underlying_price': 36.0, 'size': 40}
+    book.remove(fixture_date, ['MSFT131108P00036500'])
+    assert [option['symbol'] for option in book.options(fixture_date)] == ['AAPL131104C00500000', 'FB131104C00050000']
+    assert book.get_underlying_expiration('MSFT', fixture_date, week_end) is None
+    book.remove(fixture_date)
+    assert fixture_date not in book
+    assert book.cost() == 4.0 * 5
+    assert book.get_underlying_expiration('AAPL', fixture_date, week_end) is None
+
+    # Values longer than their fields are not cut
+    long_option = dict(options[0], underlying_symbol='LONGSYMBOL')
+    with pytest.raises(Exception):
+        book.add(fixture_date, [long_option])
+    assert fixture_date not in book
+
+
+def test_chain_index():
+    import chain_index
+    expiration_date = fixture_date + datetime.timedelta(days=4)
+    chain = make_fixture_chain(expiration_date, 0.04)
+    chain = pd.concat([chain, chain.head(1)], ignore_index=True)
+    settlement_index = chain_index.index_chain(chain)
+    # The first row of a symbol wins
+    assert settlement_index['option_rows'][chain['OptionSymbol'][0]] == 0
+    assert settlement_index['option_rows'][chain['OptionSymbol'][17]] == 17
+    assert settlement_index['underlying_prices']['AAPL'] == round(520.0 * 1.04, 2)
+    assert 'SPY' not in settlement_index['underlying_prices']
+    assert settlement_index['underlying_price_column'][17] == chain['UnderlyingPrice'][17]
+
+
+def test_results_plot(tmp_path):
+    import results_plot
+    daily_status = {utils.get_day_number(2013, 11, 5): {0: {1: {0: 10.0}}, 0.02: {1: {0: 20.0}}},
+                    utils.get_day_number(2013, 11, 4): {0: {1: {0: 0.0}}, 0.02: {1: {0: -5.0}}}}
+    written = results_plot.plot_results(daily_status, [0, 0.02], [1], 1, str(tmp_path), workers=2)
+    assert sorted(os.path.basename(path) for path in written) == ['Bid_1_Batch_1_even.png', 'Bid_1_Batch_1_odd.png']
+    assert all(os.path.getsize(path) > 0 for path in written)
+    [html_path] = results_plot.plot_results(daily_status, [0, 0.02], [1], 1, str(tmp_path), results_format='html')
+    with open(html_path) as html_file:
+        html = html_file.read()
+    # The dates are sorted and every stock ratio is a series of its chart
+    assert '"dates": ["04/11/2013", "05/11/2013"]' in html
+    assert '{"label": "Stock Ratio=0.02", "values": [-5.0, 20.0]}' in html
+
+
+def test_parameter_sweep(tmp_path):
+    # The bid ratios are simulated by their own workers, the merged results are the results of one run
+    write_fixture_days(str(tmp_path))
+    snp_symbols = set(symbol for (symbol, _, _) in fixture_underlyings)
+    input_files = SimulateTrade.get_input_files(str(tmp_path), False, datetime.date(2013, 11, 1),
+                                                datetime.date(2013, 11, 30))
+    assert len(input_files) == 3
+    results = SimulateTrade.run_parameter_sweep(str(tmp_path), input_files, snp_symbols, False, [0.02, 0.1], [1, 0.5],
+                                                2, str(tmp_path / 'cache'))
+    expected_results = SimulateTrade.simulate(str(tmp_path), input_files, snp_symbols, False, [0.02, 0.1], [1, 0.5],
+                                              None)
+    assert repr(results) == repr(expected_results)
+    assert [utils.format_day_number(day_number) for day_number in results[1]] == \
+        ['04/11/2013', '05/11/2013', '08/11/2013']
+
+    # The streamed daily statuses of the workers are read back together
+    stream_dir = str(tmp_path / 'stream')
+    os.makedirs(stream_dir)
+    SimulateTrade.run_parameter_sweep(str(tmp_path), input_files, snp_symbols, False, [0.02, 0.1], [1, 0.5], 2,
+                                      str(tmp_path / 'cache'), stream_dir)
+    assert SimulateTrade.read_daily_statuses(stream_dir) == expected_results[1]
+
+
+def test_strategies_share_days(tmp_path, monkeypatch):
+    write_fixture_days(str(tmp_path))
+    snp_symbols = set(symbol for (symbol, _, _) in fixture_underlyings)
+    input_files = SimulateTrade.get_input_files(str(tmp_path), False, datetime.date(2013, 11, 1),
+                                                datetime.date(2013, 11, 30))
+    expected = dict()
+    for (name, ratio_params, bid_ratios) in [('low', [0, 0.02], [1]), ('high', [0.1], [1, 0.5])]:
+        expected[name] = repr(SimulateTrade.simulate(str(tmp_path), input_files, snp_symbols, False, ratio_params,
+                                                     bid_ratios, None))
+
+    read_days = []
+    read_options = SimulateTrade.chain_cache.read_options
+    monkeypatch.setattr(SimulateTrade.chain_cache, 'read_options',
+                        lambda *args, **kwargs: read_days.append(args[0]) or read_options(*args, **kwargs))
+    strategies = [SimulateTrade.BreakEvenStrategy('low', [0, 0.02], [1]),
+                  SimulateTrade.BreakEvenStrategy('high', [0.1], [1, 0.5])]
+    results = SimulateTrade.simulate_strategies(str(tmp_path), input_files, snp_symbols, False, strategies, None)
+    assert len(read_days) == len(input_files)
+    for name in expected:
+        assert repr(results[name]) == expected[name]
+
+
+def test_strategy_parameters(tmp_path):
+    write_fixture_days(str(tmp_path))
+    snp_symbols = set(symbol for (symbol, _, _) in fixture_underlyings)
+    input_files = SimulateTrade.get_input_files(str(tmp_path), False, datetime.date(2013, 11, 1),
+                                                datetime.date(2013, 11, 30))
+    strategies = [SimulateTrade.BreakEvenStrategy('both', [0.02], [1, 0.5]),
+                  SimulateTrade.BreakEvenStrategy('half', [0.02], [0.5]),
+                  SimulateTrade.BreakEvenStrategy('batches', [0.02], [1], trade_batches=2)]
+    results = SimulateTrade.simulate_strategies(str(tmp_path), input_files, snp_symbols, False, strategies, None)
+    # The held symbols are looked up in the strategy's own bid ratio, without bid ratio 1 the same trades are written
+    for (curr_date, day_trades) in results['half'][2].items():
+        assert day_trades[0.02][0.5] == results['both'][2][curr_date][0.02][0.5]
+    assert results['half'][0][0.02][0.5] == results['both'][0][0.02][0.5]
+
+    # Every batch of the strategy is tracked and plotted
+    daily_status = results['batches'][1]
+    assert all(sorted(day_status[0.02][1]) == [0, 1] for day_status in daily_status.values())
+    SimulateTrade.write_results(str(tmp_path), results['batches'], [0.02], [1], datetime.datetime.now(),
+                                trade_batches=2)
+    assert os.path.exists(os.path.join(str(tmp_path), 'Bid_1_Batch_2_even.png'))
+
+
+class HoldStrategy(SimulateTrade.Strategy):
+    # Writes nothing, a strategy of its own hooks without BreakEvenStrategy
+    def get_batches(self, make_value):
+        return {curr_stock_ratio: {curr_bid_ratio: {batch_index: make_value()
+                                                    for batch_index in range(self.get_trade_batches())}
+                                   for curr_bid_ratio in self.bid_ratios} for curr_stock_ratio in self.ratio_params}
+
+    def select(self, trading_day, open_positions):
+        return None
+
+    def size(self, trading_day, selection):
+        return self.get_batches(int), self.get_batches(dict)
+
+    def settle(self, trading_day, current_options, missing_options, split_symbols):
+        return self.get_batches(int)
+
+
+def test_custom_strategy(tmp_path):
+    write_fixture_days(str(tmp_path))
+    snp_symbols = set(symbol for (symbol, _, _) in fixture_underlyings)
+    input_files = SimulateTrade.get_input_files(str(tmp_path), False, datetime.date(2013, 11, 1),
+                                                datetime.date(2013, 11, 30))
+    results = SimulateTrade.simulate_strategies(str(tmp_path), input_files, snp_symbols, False,
+                                                [HoldStrategy('hold', [0.02], [0.5], trade_batches=3)], None)
+    assert results['hold'][0] == {0.02: {0.5: {0: 0, 1: 0, 2: 0}}}
+
+
+def test_phase_metrics(tmp_path):
+    write_fixture_days(str(tmp_path))
+    snp_symbols = set(symbol for (symbol, _, _) in fixture_underlyings)
+    input_files = SimulateTrade.get_input_files(str(tmp_path), False, datetime.date(2013, 11, 1),
+                                                datetime.date(2013, 11, 30))
+    metrics_path = metrics.get_metrics_path(str(tmp_path))
+    SimulateTrade.simulate(str(tmp_path), input_files, snp_symbols, False, [0.02, 0.1], [1, 0.5], None,
+                           metrics_path=metrics_path)
+    records = metrics.read_metrics(str(tmp_path))
+    assert [record['date'] for record in records] == ['04/11/2013', '05/11/2013', '08/11/2013']
+    for record in records:
+        assert set(record['phases']) >= {'load', 'filter', 'iv_ranking', 'selection', 'sizing', 'bookkeeping'}
+        # The non S&P row is dropped while reading
+        assert record['counters']['options'] == len(make_fixture_chain()) - 1
+    summary = metrics.summarize(records)
+    assert summary.splitlines()[0].split() == ['phase', 'total', '[s]', 'per', 'day', '[ms]', 'share']
+    assert 'settlement' in summary and 'written_options' in summary
+
+
+def test_iv_ranking(tmp_path, monkeypatch):
+    snp_symbols = set(symbol for (symbol, _, _) in fixture_underlyings)
+    tradable_options = SimulateTrade.filter_tradable_options(
+        chain_cache.parse_options(make_fixture_chain(), snp_symbols), fixture_date, *iv_ranking.RANKING_WINDOW)
+
+    # The row by row ranking
+    expected = tradable_options.copy()
+    expected['OptionPriceDifference'] = expected.apply(lambda row: abs(row['UnderlyingPrice'] - row['Strike']),
+                                                       axis=1)
+    closest = expected[expected.groupby('UnderlyingSymbol', observed=True)['OptionPriceDifference'].transform(min) >=
+                       expected['OptionPriceDifference']]
+    expected = closest.groupby(['UnderlyingSymbol', 'Expiration'], observed=True)['IV'].mean()
+    expected.sort_values(inplace=True, ascending=False)
+    ranking = iv_ranking.rank_options_by_iv(tradable_options)
+    assert list(ranking.items()) == list(expected.items())
+
+    # The simulation reads the ranking files written next to the filtered days
+    write_fixture_days(str(tmp_path))
+    input_files = SimulateTrade.get_input_files(str(tmp_path), False, datetime.date(2013, 11, 1),
+                                                datetime.date(2013, 11, 30))
+    expected_results = repr(SimulateTrade.simulate(str(tmp_path), input_files, snp_symbols, False, [0.02, 0.1],
+                                                   [1, 0.5], None))
+    for input_file in input_files:
+        _, year, month, day = SimulateTrade.parse_filename(input_file)
+        options_data = chain_cache.parse_options(pd.read_csv(os.path.join(str(tmp_path), input_file)), snp_symbols)
+        trade_date = datetime.datetime(year=year, month=month, day=day)
+        ranking = iv_ranking.rank_options_by_iv(
+            SimulateTrade.filter_tradable_options(options_data, trade_date, *iv_ranking.RANKING_WINDOW))
+        iv_ranking.write_ranking(ranking, iv_ranking.get_ranking_path(str(tmp_path), year, month, day))
+        assert list(iv_ranking.read_ranking(iv_ranking.get_ranking_path(str(tmp_path), year, month, day),
+                                            snp_symbols).index) == list(ranking.index)
+    assert SimulateTrade.get_input_files(str(tmp_path), False, datetime.date(2013, 11, 1),
+                                         datetime.date(2013, 11, 30)) == input_files
+    monkeypatch.setattr(SimulateTrade, 'get_options_by_iv', None)
+    assert repr(SimulateTrade.simulate(str(tmp_path), input_files, snp_symbols, False, [0.02, 0.1], [1, 0.5],
+                                       None)) == expected_results
+
+
+def write_fixture_archive(source_dir, expiration_format):
+    # A vendor archive with the stock quotes and the options of two days
+    with zipfile.ZipFile(os.path.join(source_dir, '2013_November.zip'), 'w') as archive_file:
+        for day_offset in [0, 1]:
+            trade_date = fixture_date + datetime.timedelta(days=day_offset)
+            date_text = f'{trade_date.year}{trade_date.month:02}{trade_date.day:02}'
+            options_data = make_fixture_chain(trade_date, 0.01 * day_offset)
+            options_data['Expiration'] = pd.to_datetime(options_data['Expiration']).dt.strftime(expiration_format)
+            stocks_data = pd.DataFrame([{'symbol': symbol, 'open': price, 'high': price + 1, 'low': price - 1,
+                                         'close': price + day_offset, 'volume': 1000}
+                                        for (symbol, price, _) in fixture_underlyings + [('ZZZZ', 1.0, 0)]])
+            archive_file.writestr(f'stockquotes_{date_text}.csv', stocks_data.to_csv(index=False))
+            archive_file.writestr(f'options_{date_text}.csv', options_data.to_csv(index=False))
+
+
+def read_output_tree(dest_dir):
+    output = dict()
+    for root, dirs, files in os.walk(dest_dir):
+        for filename in files:
+            file_path = os.path.join(root, filename)
+            if filename.endswith('.zip'):
+                with zipfile.ZipFile(file_path) as zip_file_obj:
+                    for name in zip_file_obj.namelist():
+                        output[(os.path.relpath(file_path, dest_dir), name)] = zip_file_obj.read(name)
+            elif not filename.startswith('IngestManifest'):
+                with open(file_path, 'rb') as output_file:
+                    output[(os.path.relpath(file_path, dest_dir), '')] = output_file.read()
+    return output
+
+
+def test_read_data_stocks(tmp_path):
+    import ReadData
+    stocks_data = pd.DataFrame({'symbol': ['AAPL', 'ZZZZ', 'MSFT', 'AAPL'], 'open': [520.5, 1, 35.25, 521],
+                                'high': [525, 1, 36, 526], 'low': [515, 1, 35, 516], 'close': [522.75, 1, 35.5, 523],
+                                'volume': [1000, 5, 2000, 1100]})
+    ReadData.process_stocks_file(stocks_data, 2013, 11, 4, str(tmp_path), {'AAPL', 'MSFT', 'FB'})
+    output = read_output_tree(str(tmp_path))
+    assert output == {
+        (os.path.join('equity', 'usa', 'minute', 'aapl', '20131104_trade.zip'), '20131104_aapl_minute_trade.csv'):
+            b'57480000,5210000.0,5260000,5160000,5230000.0,1100',
+        (os.path.join('equity', 'usa', 'minute', 'msft', '20131104_trade.zip'), '20131104_msft_minute_trade.csv'):
+            b'57480000,352500.0,360000,350000,355000.0,2000'}
+
+
+def test_read_data_options(tmp_path):
+    import ReadData
+    options_data = pd.DataFrame({'UnderlyingSymbol': ['AAPL', 'ZZZZ', 'MSFT', 'AAPL'],
+                                 'Type': ['call', 'call', 'put', 'put'], 'Expiration': ['11/08/2013'] * 4,
+                                 'Strike': [520, 1, 35.5, 515], 'Last': [3.5, 1, 0.25, 2],
+                                 'Bid': [3.4, 1, 0.2, 1.9], 'Ask': [3.6, 1, 0.3, 2.1], 'Volume': [11, 1, 4, 0],
+                                 'OpenInterest': [120, 1, 40, 7], 'IV': [0.25, 1, 0.3, 0.2]})
+    ReadData.process_options_file(options_data, 2013, 11, 4, str(tmp_path), {'AAPL', 'MSFT', 'FB'})
+    output = read_output_tree(str(tmp_path))
+    aapl_dir = os.path.join('option', 'usa', 'minute', 'aapl')
+    msft_dir = os.path.join('option', 'usa', 'minute', 'msft')
+    # Both AAPL rows end up in the same zips although they are not adjacent in the chain
+    assert output == {
+        (os.path.join(aapl_dir, '20131104_openinterest_american.zip'),
+         '20131104_aapl_minute_openinterest_american_call_5200000_20131108.csv'): b'57480000,120',
+        (os.path.join(aapl_dir, '20131104_openinterest_american.zip'),
+         '20131104_aapl_minute_openinterest_american_put_5150000_20131108.csv'): b'57480000,7',
+        (os.path.join(aapl_dir, '20131104_quote_american.zip'),
+         '20131104_aapl_minute_quote_american_call_5200000_20131108.csv'):
+            b'57480000,34000.0,34000.0,34000.0,34000.0,5,36000.0,36000.0,36000.0,36000.0,5,0.25',
+        (os.path.join(aapl_dir, '20131104_quote_american.zip'),
+         '20131104_aapl_minute_quote_american_put_5150000_20131108.csv'):
+            b'57480000,19000.0,19000.0,19000.0,19000.0,0,21000.0,21000.0,21000.0,21000.0,0,0.2',
+        (os.path.join(aapl_dir, '20131104_trade_american.zip'),
+         '20131104_aapl_minute_trade_american_call_5200000_20131108.csv'):
+            b'57480000,35000.0,35000.0,35000.0,35000.0,11',
+        (os.path.join(aapl_dir, '20131104_trade_american.zip'),
+         '20131104_aapl_minute_trade_american_put_5150000_20131108.csv'):
+            b'57480000,20000.0,20000.0,20000.0,20000.0,0',
+        (os.path.join(msft_dir, '20131104_openinterest_american.zip'),
+         '20131104_msft_minute_openinterest_american_put_355000_20131108.csv'): b'57480000,40',
+        (os.path.join(msft_dir, '20131104_quote_american.zip'),
+         '20131104_msft_minute_quote_american_put_355000_20131108.csv'):
+            b'57480000,2000.0,2000.0,2000.0,2000.0,2,3000.0,3000.0,3000.0,3000.0,2,0.3',
+        (os.path.join(msft_dir, '20131104_trade_american.zip'),
+         '20131104_msft_minute_trade_american_put_355000_20131108.csv'): b'57480000,2500.0,2500.0,2500.0,2500.0,4'}
+
+
+def test_parallel_ingest(tmp_path):
+    import ReadData
+    import ReadDataDaily
+    snp_symbols = set(symbol for (symbol, _, _) in fixture_underlyings)
+    for (converter, expiration_format) in [(ReadData, '%m/%d/%Y'), (ReadDataDaily, '%Y-%m-%d')]:
+        source_dir = os.path.join(str(tmp_path), converter.__name__)
+        os.makedirs(source_dir)
+        write_fixture_archive(source_dir, expiration_format)
+        outputs = []
+        for workers in [1, 2]:
+            dest_dir = os.path.join(source_dir, f'dest_{workers}')
+            converter.process_source_dir(source_dir, dest_dir, snp_symbols, workers)
+            outputs.append(read_output_tree(dest_dir))
+            conversion_manifest = manifest.ConversionManifest(os.path.join(dest_dir, converter.MANIFEST_FILENAME))
+            assert sorted(conversion_manifest.units) == ['2013_November.zip:20131104', '2013_November.zip:20131105']
+            conversion_manifest.close()
+        assert len(outputs[0]) > 0
+        assert outputs[0] == outputs[1]
+
+        # Converted days are skipped by the next run
+        converter.process_source_dir(source_dir, dest_dir, snp_symbols, 2)
+        assert read_output_tree(dest_dir) == outputs[1]
+
+    # The daily rows are merged into the zips every flush_units days, a day is recorded once its rows are written
+    import ingest
+    import daily_archive
+    source_dir = os.path.join(str(tmp_path), ReadDataDaily.__name__)
+    dest_dir = os.path.join(source_dir, 'dest_flushed')
+    manifest_path = os.path.join(dest_dir, ReadDataDaily.MANIFEST_FILENAME)
+    symbol_archives = daily_archive.DailyArchive()
+    recorded_units = []
+
+    def flush_results():
+        conversion_manifest = manifest.ConversionManifest(manifest_path)
+        recorded_units.append(len(conversion_manifest.units))
+        conversion_manifest.close()
+        return symbol_archives.write()
+
+    ingest.run(source_dir, dest_dir, snp_symbols, ReadDataDaily.get_files_from_zip_by_date,
+               ReadDataDaily.convert_date, symbol_archives.add_rows, 1, manifest_path, flush_results=flush_results,
+               flush_units=1)
+    assert recorded_units == [0, 1]
+    assert read_output_tree(dest_dir) == read_output_tree(os.path.join(source_dir, 'dest_1'))
+
+
+def test_bar_synthesis():
+    import bar_synthesis
+    open_prices = [5200000.0, 355000.0, 152000.0]
+    high_prices = [5260000.0, 360000.0, 152000.0]
+    low_prices = [5150000.0, 351000.0, 152000.0]
+    close_prices = [5230000.0, 352000.0, 152000.0]
+    volumes = [1000, 7, 0]
+    for resolution in ['minute', 'hour']:
+        bar_count = len(bar_synthesis.get_bar_times(resolution))
+        bars = bar_synthesis.synthesize_bars(open_prices, high_prices, low_prices, close_prices, volumes, bar_count,
+                                             'interpolate')
+        # The bars add up to the daily bar
+        assert bars['open'][:, 0].tolist() == open_prices
+        assert bars['high'].max(axis=1).tolist() == high_prices
+        assert bars['low'].min(axis=1).tolist() == low_prices
+        assert bars['close'][:, -1].tolist() == close_prices
+        assert bars['volume'].sum(axis=1).tolist() == volumes
+        assert (bars['close'][:, :-1] == bars['open'][:, 1:]).all()
+
+        bars = bar_synthesis.synthesize_bars(open_prices, high_prices, low_prices, close_prices, volumes, bar_count,
+                                             'flat')
+        assert (bars['high'] == bars['low']).all()
+        assert bars['close'][:, 0].tolist() == close_prices
+        assert bars['volume'].sum(axis=1).tolist() == volumes
+    assert bar_synthesis.get_bar_times('minute').tolist()[-1] == 57540000
+    assert bar_synthesis.format_bar_time('20131104', 34200000) == '20131104 09:30'
+
+
+def test_read_data_bar_modes(tmp_path):
+    import ReadData
+    import ReadDataDaily
+    snp_symbols = set(symbol for (symbol, _, _) in fixture_underlyings)
+    daily_source_dir = os.path.join(str(tmp_path), 'daily')
+    os.makedirs(daily_source_dir)
+    write_fixture_archive(daily_source_dir, '%Y-%m-%d')
+    daily_dir = os.path.join(daily_source_dir, 'dest')
+    ReadDataDaily.process_source_dir(daily_source_dir, daily_dir, snp_symbols)
+    source_dir = os.path.join(str(tmp_path), 'minute')
+    os.makedirs(source_dir)
+    write_fixture_archive(source_dir, '%m/%d/%Y')
+    daily_output = read_output_tree(daily_dir)
+
+    for resolution in ['minute', 'hour']:
+        dest_dir = os.path.join(source_dir, f'dest_{resolution}')
+        ReadData.process_source_dir(source_dir, dest_dir, snp_symbols, 2, 'interpolate', resolution)
+        output = read_output_tree(dest_dir)
+        # The companion daily file holds the same rows as the daily conversion
+        equity_daily_dir = os.path.join('equity', 'usa', 'daily')
+        assert {key: value for (key, value) in output.items() if key[0].startswith(equity_daily_dir)} == \
+            {key: value for (key, value) in daily_output.items() if key[0].startswith(equity_daily_dir)}
+        if resolution == 'minute':
+            minute_bars = output[(os.path.join('equity', 'usa', 'minute', 'aapl', '20131105_trade.zip'),
+                                  '20131105_aapl_minute_trade.csv')].decode().splitlines()
+            assert len(minute_bars) == 390
+            assert minute_bars[0].startswith('34200000,5200000.0,')
+            assert minute_bars[-1].endswith(',5210000.0,2')
+        else:
+            hour_bars = output[(os.path.join('equity', 'usa', 'hour', 'aapl.zip'), 'aapl.csv')].decode().splitlines()
+            assert len(hour_bars) == 14
+            assert hour_bars[7].startswith('20131105 09:30,5200000.0,')
+        # The options are converted as in the single bar mode
+        assert (os.path.join('option', 'usa', 'minute', 'aapl', '20131104_quote_american.zip'),
+                '20131104_aapl_minute_quote_american_call_5200000_20131108.csv') in output
+
+
+def test_incremental_manifest(tmp_path):
+    import ReadData
+    import ReadDataDaily
+    snp_symbols = set(symbol for (symbol, _, _) in fixture_underlyings)
+    for (converter, expiration_format) in [(ReadData, '%m/%d/%Y'), (ReadDataDaily, '%Y-%m-%d')]:
+        source_dir = os.path.join(str(tmp_path), converter.__name__)
+        os.makedirs(source_dir)
+        write_fixture_archive(source_dir, expiration_format)
+        dest_dir = os.path.join(source_dir, 'dest')
+        converter.process_source_dir(source_dir, dest_dir, snp_symbols)
+        output = read_output_tree(dest_dir)
+
+        # The stock quotes of the second day are corrected in the source archive
+        zip_path = os.path.join(source_dir, '2013_November.zip')
+        with zipfile.ZipFile(zip_path) as zip_file_obj:
+            members = {name: zip_file_obj.read(name) for name in zip_file_obj.namelist()}
+        members['stockquotes_20131105.csv'] = members['stockquotes_20131105.csv'].replace(b',1000', b',1200')
+        with zipfile.ZipFile(zip_path, 'w') as zip_file_obj:
+            for (name, data) in members.items():
+                zip_file_obj.writestr(name, data)
+        # An output of the first day is removed
+        if converter is ReadData:
+            first_day_zip = (os.path.join('equity', 'usa', 'minute', 'aapl', '20131104_trade.zip'),
+                             '20131104_aapl_minute_trade.csv')
+        else:
+            first_day_zip = (os.path.join('equity', 'usa', 'daily', 'aapl.zip'), 'aapl.csv')
+        os.remove(os.path.join(dest_dir, first_day_zip[0]))
+        converter.process_source_dir(source_dir, dest_dir, snp_symbols)
+        rerun_output = read_output_tree(dest_dir)
+
+        conversion_manifest = manifest.ConversionManifest(os.path.join(dest_dir, converter.MANIFEST_FILENAME))
+        if converter is ReadData:
+            # The changed day and the day of the removed output are converted again
+            second_day_zip = os.path.join('equity', 'usa', 'minute', 'aapl', '20131105_trade.zip')
+            assert rerun_output[(second_day_zip, '20131105_aapl_minute_trade.csv')].endswith(b',1200')
+            assert rerun_output[first_day_zip] == output[first_day_zip]
+            assert os.path.join(dest_dir, second_day_zip) in \
+                conversion_manifest.get_outputs('2013_November.zip:20131105')
+        else:
+            # The rows of the changed day replace its rows in the symbol zip, the removed zip gets the rows of the first
+            # day back
+            daily_zip = (os.path.join('equity', 'usa', 'daily', 'aapl.zip'), 'aapl.csv')
+            daily_rows = rerun_output[daily_zip].decode().splitlines()
+            assert daily_rows[0] == output[daily_zip].decode().splitlines()[0]
+            assert len(daily_rows) == 2 and daily_rows[1].startswith('20131105 ') and daily_rows[1].endswith(',1200')
+            option_dir = os.path.join('option', 'usa', 'daily')
+            assert {key: value for (key, value) in rerun_output.items() if key[0].startswith(option_dir)} == \
+                {key: value for (key, value) in output.items() if key[0].startswith(option_dir)}
+            assert f'{os.path.join(dest_dir, daily_zip[0])}:aapl.csv' in \
+                conversion_manifest.get_outputs('2013_November.zip:20131105')
+        conversion_manifest.close()
+
+
+def test_daily_archive(tmp_path):
+    import daily_archive
+    equity_dir = os.path.join(str(tmp_path), 'equity', 'usa', 'daily')
+    option_dir = os.path.join(str(tmp_path), 'option', 'usa', 'daily', 'aapl_quote_american')
+    symbol_archives = daily_archive.DailyArchive()
+    symbol_archives.add_rows({os.path.join(equity_dir, 'aapl.csv'): ['20131105 00:00,2\n', '20131106 00:00,3\n'],
+                              os.path.join(option_dir, 'aapl_quote_american_call_1.csv'): ['20131105 00:00,4\n']})
+    zip_paths = symbol_archives.write(2)
+    assert zip_paths == [os.path.join(equity_dir, 'aapl.zip'), f'{option_dir}.zip']
+
+    # A later run adds an earlier day and corrects a day, every symbol keeps a single zip member in time order
+    symbol_archives.add_rows({os.path.join(equity_dir, 'aapl.csv'): ['20131106 00:00,5\n', '20131104 00:00,1\n']})
+    assert symbol_archives.write() == [os.path.join(equity_dir, 'aapl.zip')]
+    with zipfile.ZipFile(os.path.join(equity_dir, 'aapl.zip')) as zip_file_obj:
+        assert zip_file_obj.namelist() == ['aapl.csv']
+        assert zip_file_obj.read('aapl.csv') == b'20131104 00:00,1\n20131105 00:00,2\n20131106 00:00,5\n'
+    with zipfile.ZipFile(f'{option_dir}.zip') as zip_file_obj:
+        assert zip_file_obj.read('aapl_quote_american_call_1.csv') == b'20131105 00:00,4\n'
+
+
+def test_filter_csvs(tmp_path, monkeypatch):
+    import FilterCSVs
+    monkeypatch.chdir(str(tmp_path))
+    snp_symbols = set(symbol for (symbol, _, _) in fixture_underlyings)
+    source_dir = os.path.join(str(tmp_path), 'source')
+    os.makedirs(source_dir)
+    write_fixture_archive(source_dir, '%m/%d/%Y')
+    outputs = []
+    for archive_results in [False, True]:
+        dest_dir = os.path.join(str(tmp_path), f'filtered_{archive_results}')
+        FilterCSVs.filter_source_dir(source_dir, dest_dir, snp_symbols, archive_results)
+        outputs.append({name if name else os.path.basename(path): data
+                        for ((path, name), data) in read_output_tree(dest_dir).items() if 'Manifest' not in path})
+    assert sorted(outputs[0]) == ['ivranking_20131104.csv', 'ivranking_20131105.csv', 'options_20131104.csv',
+                                  'options_20131105.csv', 'stockquotes_20131104.csv', 'stockquotes_20131105.csv']
+    # The days are written straight into the archive with the same content
+    assert outputs[0] == outputs[1]
+    assert not os.path.exists(chain_cache.CHAIN_CACHE_DIR)
+    assert len(pd.read_csv(os.path.join(str(tmp_path), 'filtered_False', 'stockquotes_20131104.csv'))) == \
+        len(fixture_underlyings)
+
+    # Filtered days are not filtered again while their outputs are there, a removed output is written again
+    csv_dir = os.path.join(str(tmp_path), 'filtered_False')
+    modified_times = {filename: os.path.getmtime(os.path.join(csv_dir, filename)) for filename in outputs[0]}
+    os.remove(os.path.join(csv_dir, 'options_20131104.csv'))
+    FilterCSVs.filter_source_dir(source_dir, csv_dir, snp_symbols)
+    with open(os.path.join(csv_dir, 'options_20131104.csv'), 'rb') as options_file:
+        assert options_file.read() == outputs[0]['options_20131104.csv']
+    assert all(os.path.getmtime(os.path.join(csv_dir, filename)) == modified_times[filename]
+               for filename in outputs[0] if '20131105' in filename)
+    # The days filtered again into an archive replace their members
+    archive_dir = os.path.join(str(tmp_path), 'filtered_True')
+    os.remove(os.path.join(archive_dir, FilterCSVs.MANIFEST_FILENAME))
+    FilterCSVs.filter_source_dir(source_dir, archive_dir, snp_symbols, True)
+    for zip_filename in os.listdir(archive_dir):
+        if zip_filename.endswith('.zip'):
+            with zipfile.ZipFile(os.path.join(archive_dir, zip_filename)) as zip_file_obj:
+                assert sorted(zip_file_obj.namelist()) == sorted(set(zip_file_obj.namelist()))
+    assert {name: data for ((path, name), data) in read_output_tree(archive_dir).items()
+            if 'Manifest' not in path} == outputs[1]
+    # The days filtered to csv files are filtered again to Arrow files
+    FilterCSVs.filter_source_dir(source_dir, csv_dir, snp_symbols, day_format='arrow')
+    assert sorted(filename for filename in os.listdir(csv_dir) if filename.endswith('.arrow')) == \
+        sorted(filename.replace('.csv', '.arrow') for filename in outputs[0])
+
+
+def test_day_files(tmp_path, monkeypatch):
+    import FilterCSVs
+    import day_files
+    monkeypatch.chdir(str(tmp_path))
+    snp_symbols = set(symbol for (symbol, _, _) in fixture_underlyings)
+    source_dir = os.path.join(str(tmp_path), 'source')
+    os.makedirs(source_dir)
+    write_fixture_archive(source_dir, '%m/%d/%Y')
+    arrow_dir = os.path.join(str(tmp_path), 'filtered_arrow')
+    FilterCSVs.filter_source_dir(source_dir, arrow_dir, snp_symbols, day_format='arrow')
+    assert sorted(filename for filename in os.listdir(arrow_dir) if 'Manifest' not in filename) == \
+        ['ivranking_20131104.arrow', 'ivranking_20131105.arrow', 'options_20131104.arrow', 'options_20131105.arrow',
+         'stockquotes_20131104.arrow', 'stockquotes_20131105.arrow']
+    # The Arrow day keeps the types of the filtered chain
+    options_data = day_files.read_frame(os.path.join(arrow_dir, 'options_20131104.arrow'))
+    assert pd.api.types.is_datetime64_any_dtype(options_data['Expiration'])
+    assert str(options_data['UnderlyingSymbol'].dtype) == 'category'
+    with pytest.raises(Exception):
+        FilterCSVs.filter_source_dir(source_dir, os.path.join(str(tmp_path), 'archived'), snp_symbols, True,
+                                     day_format='arrow')
+
+    # The simulation of the Arrow days is the simulation of the csv days, a day in both formats is read once
+    csv_dir = os.path.join(str(tmp_path), 'csv')
+    mixed_dir = os.path.join(str(tmp_path), 'mixed')
+    for days_dir in [csv_dir, mixed_dir]:
+        os.makedirs(days_dir)
+        write_fixture_days(days_dir)
+    input_files = SimulateTrade.get_input_files(csv_dir, False, datetime.date(2013, 11, 1),
+                                                datetime.date(2013, 11, 30))
+    for input_file in input_files:
+        options_data = chain_cache.read_options(os.path.join(csv_dir, input_file), snp_symbols, cache_dir=None)
+        day_files.write_frame(options_data, os.path.join(mixed_dir, input_file.replace('.csv', '.arrow')))
+    arrow_files = SimulateTrade.get_input_files(mixed_dir, False, datetime.date(2013, 11, 1),
+                                                datetime.date(2013, 11, 30))
+    assert arrow_files == [input_file.replace('.csv', '.arrow') for input_file in input_files]
+    assert repr(SimulateTrade.simulate(mixed_dir, arrow_files, snp_symbols, False, [0.02, 0.1], [1, 0.5], None)) == \
+        repr(SimulateTrade.simulate(csv_dir, input_files, snp_symbols, False, [0.02, 0.1], [1, 0.5], None))
+
+
+def test_archive_writer(tmp_path):
+    import utils
+    stocks_data = pd.DataFrame({'symbol': ['AAPL', 'MSFT'], 'close': [522.75, 35.5]})
+    for compression in utils.COMPRESSION_METHODS:
+        zip_path = os.path.join(str(tmp_path), f'{compression}.zip')
+        with utils.ArchiveWriter(zip_path, compression=compression,
+                                 compresslevel=1 if compression in ['deflate', 'bzip2'] else None) as archive_writer:
+            archive_writer.write_frame('stockquotes_20131104.csv', stocks_data)
+            archive_writer.write_text('note.txt', 'written')
+        # Members are appended to an existing archive
+        with utils.ArchiveWriter(zip_path, 'a', compression) as archive_writer:
+            archive_writer.write_frame('stockquotes_20131105.csv', stocks_data)
+        with zipfile.ZipFile(zip_path) as zip_file_obj:
+            assert zip_file_obj.namelist() == ['stockquotes_20131104.csv', 'note.txt', 'stockquotes_20131105.csv']
+            assert zip_file_obj.getinfo('note.txt').compress_type == utils.COMPRESSION_METHODS[compression]
+            assert zip_file_obj.read('note.txt') == b'written'
+            for member_name in ['stockquotes_20131104.csv', 'stockquotes_20131105.csv']:
+                assert pd.read_csv(zip_file_obj.open(member_name)).equals(stocks_data)
+
+
+def test_schema(tmp_path):
+    csv_path = os.path.join(str(tmp_path), 'options_20131104.csv')
+    vendor_chain = make_fixture_chain()
+    vendor_chain['Delta'] = 0.5
+    vendor_chain['AKA'] = vendor_chain['OptionSymbol']
+    vendor_chain.to_csv(csv_path, index=False)
+    options_data = schema.read_options(csv_path)
+    # Only the used columns are parsed, with the pinned types
+    assert sorted(options_data.columns) == sorted(schema.OPTION_DTYPES)
+    assert options_data.dtypes.astype(str).to_dict() == schema.OPTION_DTYPES
+    assert options_data['Bid'].tolist() == vendor_chain['Bid'].tolist()
+    assert options_data['UnderlyingSymbol'].astype(str).tolist() == vendor_chain['UnderlyingSymbol'].tolist()
+
+    stocks_path = os.path.join(str(tmp_path), 'stockquotes_20131104.csv')
+    pd.DataFrame({'symbol': ['AAPL', 'MSFT'], 'open': [520.5, 35.25], 'high': [525, 36], 'low': [515, 35],
+                  'close': [522.75, 35.5], 'volume': [1000, 2000], 'adjustedclose': [522.75, 35.5]}).to_csv(
+        stocks_path, index=False)
+    assert schema.read_stock_quotes(stocks_path, ['symbol', 'close']).columns.tolist() == ['symbol', 'close']
+    assert schema.read_stock_quotes(stocks_path)['volume'].tolist() == [1000, 2000]
+
+
+def test_symbols_prefilter(tmp_path, monkeypatch):
+    csv_path = os.path.join(str(tmp_path), 'options_20131104.csv')
+    make_fixture_chain().to_csv(csv_path, index=False)
+    symbols = {'AAPL', 'MSFT', 'SPY'}
+    options_data = schema.read_options(csv_path)
+    expected = options_data[options_data['UnderlyingSymbol'].isin(symbols)].reset_index(drop=True)
+    # Small chunks, the rows of a symbol span several of them
+    monkeypatch.setattr(schema, 'READ_CHUNK_ROWS', 7)
+    for engine in ['c', 'pyarrow']:
+        filtered_data = schema.read_options(csv_path, engine, symbols)
+        filtered_data = filtered_data[list(expected.columns)].reset_index(drop=True)
+        assert filtered_data.astype(str).equals(expected.astype(str))
+        assert filtered_data.dtypes.astype(str).to_dict() == schema.OPTION_DTYPES
+        assert sorted(filtered_data['UnderlyingSymbol'].unique()) == ['AAPL', 'MSFT']
+
+    # No rows are left, or there are none to read
+    header_path = os.path.join(str(tmp_path), 'options_20131105.csv')
+    make_fixture_chain().head(0).to_csv(header_path, index=False)
+    empty_path = os.path.join(str(tmp_path), 'options_20131106.csv')
+    open(empty_path, 'w').close()
+    empty_frames = [schema.read_options(source_path, engine, {'SPY'}) for source_path in [csv_path, header_path]
+                    for engine in ['c', 'pyarrow']]
+    empty_frames += [schema.read_options(empty_path, 'c', {'SPY'}), schema.read_options(empty_path)]
+    for empty_data in empty_frames:
+        assert len(empty_data) == 0
+        assert empty_data.dtypes.astype(str).to_dict() == schema.OPTION_DTYPES
+
+
+def test_chain_cache(tmp_path):
+    csv_path = os.path.join(str(tmp_path), 'options_20131104.csv')
+    cache_dir = os.path.join(str(tmp_path), 'cache')
+    make_fixture_chain().to_csv(csv_path, index=False)
+    snp_symbols = set(symbol for (symbol, _, _) in fixture_underlyings)
+    parsed_options = chain_cache.read_options(csv_path, snp_symbols, cache_dir=None)
+    assert 'ZZZZ' not in set(parsed_options.UnderlyingSymbol)
+    assert str(parsed_options['UnderlyingSymbol'].dtype) == 'category'
+    assert pd.api.types.is_datetime64_any_dtype(parsed_options['Expiration'])
+
+    cached_options = chain_cache.read_options(csv_path, snp_symbols, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+    assert chain_cache.read_options(csv_path, snp_symbols, cache_dir=cache_dir).equals(cached_options)
+    assert cached_options.equals(parsed_options)
+
+    # A changed source replaces the cached entry of the day
+    make_fixture_chain(price_change=0.01).to_csv(csv_path, index=False)
+    changed_options = chain_cache.read_options(csv_path, snp_symbols, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+    assert not changed_options.equals(cached_options)
+
+    # The same day in another folder and in a zip are cached next to it
+    other_dir = os.path.join(str(tmp_path), 'other')
+    os.makedirs(other_dir)
+    make_fixture_chain().to_csv(os.path.join(other_dir, 'options_20131104.csv'), index=False)
+    zip_path = os.path.join(str(tmp_path), 'options.zip')
+    with zipfile.ZipFile(zip_path, 'w') as zip_file_obj:
+        zip_file_obj.write(os.path.join(other_dir, 'options_20131104.csv'), 'options_20131104.csv')
+    assert chain_cache.read_options(os.path.join(other_dir, 'options_20131104.csv'), snp_symbols,
+                                    cache_dir=cache_dir).equals(cached_options)
+    with zipfile.ZipFile(zip_path) as zip_file_obj:
+        assert chain_cache.read_options('options_20131104.csv', snp_symbols, zip_file_obj,
+                                        cache_dir=cache_dir).equals(cached_options)
+    assert len(os.listdir(cache_dir)) == 3
+    assert chain_cache.read_options(csv_path, snp_symbols, cache_dir=cache_dir).equals(changed_options)
+    assert len(os.listdir(cache_dir)) == 3
+
+
+def test_stock_quote_store(tmp_path, monkeypatch):
+    stocks_dir = str(tmp_path)
+    binary_dir = os.path.join(stocks_dir, 'binary')
+    for day_offset in range(3):
+        trade_date = fixture_date + datetime.timedelta(days=day_offset)
+        stocks = pd.DataFrame({'symbol': ['AAPL', 'MSFT', 'AAPL'], 'open': [1, 2, 3], 'high': [1, 2, 3],
+                               'low': [1, 2, 3], 'close': [520.5 + day_offset, 35.25, 1.0], 'volume': [10, 20, 30]})
+        stocks.to_csv(os.path.join(stocks_dir, f'stockquotes_{trade_date.year}{trade_date.month:02}'
+                                               f'{trade_date.day:02}.csv'), index=False)
+
+    store = stock_quotes.StockQuoteStore(stocks_dir, max_days=2, binary_dir=binary_dir)
+    for day_offset in range(3):
+        assert store.close('AAPL', fixture_date + datetime.timedelta(days=day_offset)) == 520.5 + day_offset
+    assert store.close('MSFT', fixture_date) == 35.25
+    assert store.close('FB', fixture_date) is None
+    assert len(store.days) == 2
+    assert len(os.listdir(binary_dir)) == 3
+
+    # Later loads are memory-mapped from the binary files
+    monkeypatch.setattr(stock_quotes.schema, 'read_stock_quotes', None)
+    binary_store = stock_quotes.StockQuoteStore(stocks_dir, binary_dir=binary_dir)
+    assert binary_store.close('AAPL', fixture_date) == 520.5
+    assert binary_store.close('MSFT', fixture_date + datetime.timedelta(days=2)) == 35.25
+    monkeypatch.undo()
+
+    # A changed csv is converted again and replaces the binary file of the day
+    stocks_path = os.path.join(stocks_dir, f'stockquotes_{fixture_date.year}{fixture_date.month:02}'
+                                           f'{fixture_date.day:02}.csv')
+    pd.DataFrame({'symbol': ['AAPL'], 'close': [530.25]}).to_csv(stocks_path, index=False)
+    os.utime(stocks_path, ns=(0, 0))
+    changed_store = stock_quotes.StockQuoteStore(stocks_dir, binary_dir=binary_dir)
+    assert changed_store.close('AAPL', fixture_date) == 530.25
+    assert len(os.listdir(binary_dir)) == 3
+
+
+def test_stream_results(tmp_path, monkeypatch):
+    monkeypatch.setattr(SimulateTrade, 'EXPECTED_STOCK_CHANGE_RATIO', [0.02, 0.1])
+    monkeypatch.chdir(str(tmp_path))
+    source_dir = os.path.join(str(tmp_path), 'source')
+    os.makedirs(source_dir)
+    write_fixture_days(source_dir)
+    snp_symbols = set(symbol for (symbol, _, _) in fixture_underlyings)
+    results = dict()
+    for stream_results in [False, True]:
+        results_dir = os.path.join(str(tmp_path), f'results_{stream_results}')
+        os.makedirs(results_dir)
+        SimulateTrade.process_source_dir(source_dir, snp_symbols, False, results_dir, datetime.date(2013, 11, 1),
+                                         datetime.date(2013, 11, 30), stream_results=stream_results)
+        with open(os.path.join(results_dir, 'TotalProfit.json')) as total_profit_file:
+            results[stream_results] = json.load(total_profit_file)
+    assert results[True] == results[False]
+
+    stream_dir = os.path.join(str(tmp_path), 'results_True')
+    with open(os.path.join(str(tmp_path), 'results_False', 'Trades.json')) as trades_file:
+        expected_trades = json.load(trades_file)
+    with open(os.path.join(stream_dir, 'Daily.jsonl')) as stream_file:
+        records = [json.loads(line) for line in stream_file]
+    assert [record['date'] for record in records] == ['04/11/2013', '05/11/2013', '08/11/2013']
+    for record in records:
+        for curr_stock_ratio in record['trades']:
+            for curr_bid_ratio in record['trades'][curr_stock_ratio]:
+                assert record['trades'][curr_stock_ratio][curr_bid_ratio] == \
+                    expected_trades[curr_stock_ratio][curr_bid_ratio][record['date']]
+
+    input_files = SimulateTrade.get_input_files(source_dir, False, datetime.date(2013, 11, 1),
+                                                datetime.date(2013, 11, 30))
+    (_, daily_status, _, _, _) = SimulateTrade.simulate(source_dir, input_files, snp_symbols, False, [0.02, 0.1],
+                                                        [1, 0.5], None)
+    assert SimulateTrade.read_daily_statuses(stream_dir) == daily_status
+
+
+def test_resume_from_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr(SimulateTrade, 'CHECKPOINT_INTERVAL_DAYS', 1)
+    monkeypatch.chdir(str(tmp_path))
+    source_dir = os.path.join(str(tmp_path), 'source')
+    os.makedirs(source_dir)
+    write_fixture_days(source_dir)
+    snp_symbols = set(symbol for (symbol, _, _) in fixture_underlyings)
+    input_files = SimulateTrade.get_input_files(source_dir, False, datetime.date(2013, 11, 1),
+                                                datetime.date(2013, 11, 30))
+    results = dict()
+    streams = dict()
+    for resumed in [False, True]:
+        results_dir = os.path.join(str(tmp_path), f'results_{resumed}')
+        os.makedirs(results_dir)
+        stream_path = SimulateTrade.get_stream_path(results_dir)
+        checkpoint_path = SimulateTrade.get_checkpoint_path(results_dir)
+        if resumed:
+            # Stopped after the second day
+            SimulateTrade.simulate(source_dir, input_files[:2], snp_symbols, False, [0.02, 0.1], [1, 0.5], None,
+                                   stream_path, checkpoint_path)
+        results[resumed] = repr(SimulateTrade.simulate(source_dir, input_files, snp_symbols, False, [0.02, 0.1],
+                                                       [1, 0.5], None, stream_path, checkpoint_path, resumed))
+        with open(stream_path) as stream_file:
+            streams[resumed] = stream_file.read()
+    assert results[True] == results[False]
+    assert streams[True] == streams[False]
+    # Only the state carried over to the next days is saved, the daily results are in the stream
+    with open(SimulateTrade.get_checkpoint_path(os.path.join(str(tmp_path), 'results_True')), 'rb') as checkpoint_file:
+        checkpoint = pickle.load(checkpoint_file)
+    assert list(checkpoint['states']['default']) == SimulateTrade.CHECKPOINT_STATE_KEYS
+    with pytest.raises(Exception):
+        SimulateTrade.simulate(source_dir, input_files, snp_symbols, False, [0.02, 0.1], [1, 0.5], None, None,
+                               os.path.join(str(tmp_path), 'Checkpoint.pkl'))
+
+    with pytest.raises(Exception):
+        SimulateTrade.simulate(source_dir, input_files, snp_symbols, False, [0.02], [1, 0.5], None, None,
+                               SimulateTrade.get_checkpoint_path(os.path.join(str(tmp_path), 'results_True')), True)
+
+
 if __name__ == '__main__':
     """result = test_filter_snp_500()
     if result:
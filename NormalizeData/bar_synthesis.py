@@ -0,0 +1,53 @@
+import numpy as np
+
+# Regular session in milliseconds since midnight, the time format of the minute files
+SESSION_OPEN_MS = 34200000
+SESSION_CLOSE_MS = 57600000
+BAR_MILLISECONDS = {'minute': 60000, 'hour': 3600000}
+# single writes the one bar at the fixed timestamp as before, flat and interpolate write a bar for every minute (or
+# hour) of the session
+BAR_MODES = ['single', 'flat', 'interpolate']
+
+
+def get_bar_times(resolution):
+    # The start time of every bar of the session
+    return np.arange(SESSION_OPEN_MS, SESSION_CLOSE_MS, BAR_MILLISECONDS[resolution])
+
+
+def format_bar_time(file_prefix, bar_time):
+    # The 'YYYYMMDD HH:MM' time of the hour and daily files
+    return f'{file_prefix} {bar_time // 3600000:02}:{bar_time % 3600000 // 60000:02}'
+
+
+def synthesize_bars(open_prices, high_prices, low_prices, close_prices, volumes, bar_count, bar_mode):
+    # The (symbols x bar_count) open, high, low, close and volume of the intraday bars of every symbol. flat keeps
+    # every bar at the close. interpolate walks in straight lines open -> low -> high -> close on an up day and
+    # open -> high -> low -> close otherwise, so the bars add up to the daily bar. The volume of the day is split
+    # evenly, the first bars take the remainder
+    open_prices = np.asarray(open_prices, dtype=float)
+    close_prices = np.asarray(close_prices, dtype=float)
+    if bar_mode == 'flat':
+        bar_prices = np.repeat(close_prices[:, np.newaxis], bar_count, axis=1)
+        bars = {'open': bar_prices, 'high': bar_prices, 'low': bar_prices, 'close': bar_prices}
+    elif bar_mode == 'interpolate':
+        high_prices = np.asarray(high_prices, dtype=float)
+        low_prices = np.asarray(low_prices, dtype=float)
+        up_day = close_prices >= open_prices
+        anchors = np.column_stack([open_prices, np.where(up_day, low_prices, high_prices),
+                                   np.where(up_day, high_prices, low_prices), close_prices])
+        # The anchors sit on bar boundaries, every boundary price is a weighted sum of the two anchors around it
+        anchor_boundaries = [0, round(bar_count / 3), round(2 * bar_count / 3), bar_count]
+        boundaries = np.arange(bar_count + 1)
+        weights = np.array([np.interp(boundaries, anchor_boundaries, anchor_weights)
+                            for anchor_weights in np.eye(len(anchor_boundaries))])
+        path = np.rint(anchors @ weights)
+        path[:, anchor_boundaries] = anchors
+        bars = {'open': path[:, :-1], 'high': np.maximum(path[:, :-1], path[:, 1:]),
+                'low': np.minimum(path[:, :-1], path[:, 1:]), 'close': path[:, 1:]}
+    else:
+        raise ValueError(f'Unknown bar mode {bar_mode}')
+
+    volumes = np.asarray(volumes).astype(np.int64)
+    bars['volume'] = (volumes // bar_count)[:, np.newaxis] + \
+        (np.arange(bar_count) < (volumes % bar_count)[:, np.newaxis])
+    return bars
@@ -0,0 +1,108 @@
+import os
+import re
+import hashlib
+import numpy as np
+import pandas as pd
+import schema
+import day_files
+
+CHAIN_CACHE_DIR = ".\\ChainCache"
+CACHE_FORMAT_VERSION = 2
+CATEGORICAL_COLUMNS = ['UnderlyingSymbol', 'Type']
+
+
+def read_options(csv_path, snp_symbols, zip_file_obj=None, cache_dir=CHAIN_CACHE_DIR):
+    # csv_path is a file path, or a member name of zip_file_obj. The parsed S&P chain is stored per day under a key
+    # of the source content and the symbols, so a changed source CSV or symbols list is parsed again. The Arrow day
+    # files of FilterCSVs are already parsed, they are memory mapped instead of cached
+    if zip_file_obj is None and day_files.is_arrow_file(csv_path):
+        return parse_options(day_files.read_frame(csv_path), snp_symbols, copy=False)
+    if cache_dir is None:
+        return parse_options(read_source(csv_path, zip_file_obj, snp_symbols), snp_symbols)
+
+    cache_key = get_cache_key(csv_path, snp_symbols, zip_file_obj)
+    cache_prefix = get_cache_prefix(csv_path, zip_file_obj)
+    cache_path = os.path.join(cache_dir, f'{cache_prefix}_{cache_key}.feather')
+    if os.path.exists(cache_path):
+        return pd.read_feather(cache_path)
+
+    options_data = parse_options(read_source(csv_path, zip_file_obj, snp_symbols), snp_symbols)
+    store(options_data, cache_dir, cache_prefix, cache_path)
+    return options_data
+
+
+def read_source(csv_path, zip_file_obj=None, snp_symbols=None):
+    # Only the rows of snp_symbols are kept while reading, when given
+    if zip_file_obj is not None:
+        return schema.read_options(zip_file_obj.open(csv_path), symbols=snp_symbols)
+    return schema.read_options(csv_path, symbols=snp_symbols)
+
+
+def parse_options(options_data, snp_symbols, copy=True):
+    # With copy=False options_data is a frame of the caller's own and the columns are parsed in place
+    symbols_mask = options_data.UnderlyingSymbol.isin(snp_symbols)
+    if not symbols_mask.all():
+        options_data = options_data[symbols_mask].copy()
+    elif copy:
+        # The filtered days hold only S&P rows, taking all of their rows would copy the chain twice
+        options_data = options_data.copy()
+    if not pd.api.types.is_datetime64_any_dtype(options_data['Expiration']):
+        try:
+            options_data['Expiration'] = pd.to_datetime(options_data['Expiration'], format=schema.EXPIRATION_FORMAT)
+        except Exception as e:
+            options_data['Expiration'] = pd.to_datetime(options_data['Expiration'], format='%Y/%m/%d')
+    for column in CATEGORICAL_COLUMNS:
+        # The symbols filtered out are dropped from the categories read
+        options_data[column] = remove_unused_categories(options_data[column].astype('category'))
+    # reset_index would copy the chain again
+    options_data.index = pd.RangeIndex(len(options_data))
+    return options_data
+
+
+def remove_unused_categories(column_data):
+    # cat.remove_unused_categories rebuilds the column even when all of the categories are used
+    codes = column_data.cat.codes.values
+    if np.bincount(codes[codes >= 0], minlength=len(column_data.cat.categories)).all():
+        return column_data
+    return column_data.cat.remove_unused_categories()
+
+
+def get_cache_prefix(csv_path, zip_file_obj=None):
+    # The day and the source it is read from, the same day of another zip or folder is a different entry
+    if zip_file_obj is not None:
+        source_path = f'{os.path.abspath(zip_file_obj.filename or "")}:{csv_path}'
+    else:
+        source_path = os.path.abspath(csv_path)
+    source_hash = hashlib.sha1(os.path.normcase(source_path).encode()).hexdigest()[:12]
+    return f'{os.path.splitext(os.path.basename(csv_path))[0]}_{source_hash}'
+
+
+def get_cache_key(csv_path, snp_symbols, zip_file_obj=None):
+    key_hash = hashlib.sha1(f'{CACHE_FORMAT_VERSION}:{",".join(sorted(snp_symbols))}'.encode())
+    if zip_file_obj is not None:
+        # The zip entry already holds the CRC of the member content
+        zip_info = zip_file_obj.getinfo(csv_path)
+        key_hash.update(f'{zip_info.CRC}:{zip_info.file_size}'.encode())
+    else:
+        with open(csv_path, 'rb') as csv_file:
+            for chunk in iter(lambda: csv_file.read(1024 * 1024), b''):
+                key_hash.update(chunk)
+    return key_hash.hexdigest()
+
+
+def store(options_data, cache_dir, cache_prefix, cache_path):
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # Older entries of the same day and source belong to a source that changed since
+    for filename in os.listdir(cache_dir):
+        if re.fullmatch(f'{re.escape(cache_prefix)}_[0-9a-f]+\\.feather', filename):
+            try:
+                os.remove(os.path.join(cache_dir, filename))
+            except OSError:
+                pass
+
+    # Written under a temporary name first, parallel sweep workers may cache the same day at the same time
+    temp_path = f'{cache_path}.{os.getpid()}.tmp'
+    options_data.to_feather(temp_path)
+    os.replace(temp_path, cache_path)
@@ -0,0 +1,16 @@
+import numpy as np
+import pandas as pd
+
+
+def index_chain(options_data):
+    # The settlement index of a day: its option symbols map to their first row and its underlying symbols to their
+    # first underlying price, so the expiring options are found without scanning the chain
+    option_symbols = pd.Index(np.asarray(options_data['OptionSymbol']))
+    underlying_symbols = pd.Index(np.asarray(options_data['UnderlyingSymbol']))
+    underlying_prices = np.asarray(options_data['UnderlyingPrice'])
+    first_option_rows = np.flatnonzero(~option_symbols.duplicated())
+    first_underlying_rows = np.flatnonzero(~underlying_symbols.duplicated())
+    return {'option_rows': dict(zip(option_symbols[first_option_rows], first_option_rows)),
+            'underlying_prices': dict(zip(underlying_symbols[first_underlying_rows],
+                                          underlying_prices[first_underlying_rows])),
+            'underlying_price_column': underlying_prices}
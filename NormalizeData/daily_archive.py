@@ -0,0 +1,76 @@
+import os
+import zipfile
+import concurrent.futures
+from utils import ArchiveWriter
+
+# The csv files straight in these folders are archived one per zip (<symbol>.zip), the csv files of the folders
+# under them one zip per folder (<symbol>_<type>_american.zip)
+RESOLUTION_DIRS = ['daily', 'hour']
+
+
+class DailyArchive:
+    # The rows of the daily (and hour) files of every symbol, collected from the converted days and merged into the
+    # Lean zips every ingest.UNITS_PER_FLUSH days and when the conversion ends. A row is keyed by its time, the first field, so a day converted
+    # again replaces its rows and the rows of every file are written in time order
+    def __init__(self, compression='deflate', compresslevel=None):
+        self.compression = compression
+        self.compresslevel = compresslevel
+        self.rows = dict()
+
+    def add_rows(self, rows):
+        # The write_result of ingest.run, rows maps every output csv to its lines. Returns the <zip>:<member> outputs
+        # the rows are merged into
+        outputs = []
+        for (csv_path, csv_rows) in rows.items():
+            file_rows = self.rows.setdefault(csv_path, dict())
+            for row in csv_rows:
+                file_rows[get_row_time(row)] = row
+            (zip_path, member_name) = get_archive_member(csv_path)
+            outputs.append(f'{zip_path}:{member_name}')
+        return outputs
+
+    def write(self, workers=1):
+        # Every zip with new rows is written again with the rows it had, by up to workers threads. Returns the zips
+        archive_members = dict()
+        for (csv_path, file_rows) in self.rows.items():
+            (zip_path, member_name) = get_archive_member(csv_path)
+            archive_members.setdefault(zip_path, dict())[member_name] = file_rows
+        zip_paths = sorted(archive_members)
+        print(f'Merging the rows of {len(self.rows)} files into {len(zip_paths)} archives')
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            list(executor.map(lambda zip_path: merge_archive(zip_path, archive_members[zip_path], self.compression,
+                                                             self.compresslevel), zip_paths))
+        self.rows = dict()
+        return zip_paths
+
+
+def get_row_time(row):
+    return row.split(',', 1)[0]
+
+
+def get_archive_member(csv_path):
+    csv_dir = os.path.dirname(csv_path)
+    if os.path.basename(csv_dir) in RESOLUTION_DIRS:
+        return f'{os.path.splitext(csv_path)[0]}.zip', os.path.basename(csv_path)
+    return f'{csv_dir}.zip', os.path.basename(csv_path)
+
+
+def merge_archive(zip_path, members, compression='deflate', compresslevel=None):
+    # The zip is written next to the old one and replaces it, the members are written in name order
+    merged = dict()
+    if os.path.exists(zip_path):
+        with zipfile.ZipFile(zip_path) as zip_file_obj:
+            for member_name in zip_file_obj.namelist():
+                merged[member_name] = {get_row_time(row): row for row in
+                                       zip_file_obj.read(member_name).decode().splitlines(keepends=True)}
+    for (member_name, member_rows) in members.items():
+        merged.setdefault(member_name, dict()).update(member_rows)
+
+    # The threads of write may create the same folder
+    os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+    temp_path = f'{zip_path}.tmp'
+    with ArchiveWriter(temp_path, 'w', compression, compresslevel) as archive_writer:
+        for member_name in sorted(merged):
+            member_rows = merged[member_name]
+            archive_writer.write_text(member_name, ''.join(member_rows[row_time] for row_time in sorted(member_rows)))
+    os.replace(temp_path, zip_path)
@@ -0,0 +1,34 @@
+import os
+
+# FilterCSVs writes the filtered days as csv files or as Arrow IPC files. An Arrow day keeps the column types of the
+# parsed chain and is memory mapped when it is read, nothing is parsed again
+DAY_FORMATS = ['csv', 'arrow']
+DAY_FORMAT_EXTENSIONS = {'csv': '.csv', 'arrow': '.arrow'}
+ARROW_EXTENSION = DAY_FORMAT_EXTENSIONS['arrow']
+
+
+def is_arrow_file(path):
+    return isinstance(path, str) and path.endswith(ARROW_EXTENSION)
+
+
+def write_frame(data, path):
+    # The file is not compressed so the columns are read straight from the mapping. Written under a temporary name
+    # first, a simulation may read the folder while it is filtered
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(temp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp_path, path)
+
+
+def read_frame(path):
+    # The numeric and date columns are views of the mapped file and the categories come back as categories. The
+    # string columns stay Arrow strings, making a python string of every option symbol costs more than the rest
+    import pyarrow as pa
+    import pandas as pd
+
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table.to_pandas(split_blocks=True, types_mapper={pa.string(): pd.StringDtype('pyarrow')}.get)
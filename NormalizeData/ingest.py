@@ -0,0 +1,149 @@
+import os
+import zipfile
+import collections
+import contextlib
+import concurrent.futures
+import multiprocessing
+import manifest
+
+MAX_CONCURRENT_WRITES = 2
+PENDING_UNITS_PER_WORKER = 2
+# The rows collected for flush_results are written every this many units, so they are never all held in memory
+UNITS_PER_FLUSH = 50
+
+# Set in every worker process, bounds the number of workers writing output files at the same time
+write_semaphore = None
+
+
+def run(source_dir, dest_dir, snp_symbols, get_files_from_zip_by_date, convert_date, write_result=None, workers=1,
+        manifest_path=None, max_writes=MAX_CONCURRENT_WRITES, flush_results=None, flush_units=UNITS_PER_FLUSH):
+    # Every (zip, date) of the source folder is a work unit, converted by
+    # convert_date(zip_path, date_info, dest_dir, snp_symbols) in a pool of worker processes. convert_date returns a
+    # dict with the 'outputs' it wrote and optionally the 'rows' to pass to write_result in the main process in date
+    # order, write_result returns the outputs the rows go to. The units converted are kept in the manifest at
+    # manifest_path, a second run only converts the new units, the units whose source files changed and the units
+    # with an output that is gone.
+    # flush_results is for a write_result that only collects the rows, it is called after every flush_units units and
+    # after the last unit, the units are recorded in the manifest once the flush that wrote their rows returned
+    conversion_manifest = manifest.ConversionManifest(manifest_path)
+    work_units = []
+    archive_members = dict()
+    for work_unit in get_work_units(source_dir, get_files_from_zip_by_date):
+        state = conversion_manifest.get_state(work_unit['key'], work_unit['sources'])
+        if state == manifest.CURRENT and not manifest.are_outputs_written(
+                conversion_manifest.get_outputs(work_unit['key']), archive_members):
+            print(f'{work_unit["key"]} is converted again, some of its outputs are gone')
+            state = manifest.CHANGED
+        if state != manifest.CURRENT:
+            work_units.append(work_unit)
+    print(f'Converting {len(work_units)} days, {len(conversion_manifest.units)} days were converted before')
+    deferred_records = None if flush_results is None else []
+    try:
+        if workers <= 1:
+            for work_unit in work_units:
+                result = convert_date(work_unit['zip'], work_unit['date_info'], dest_dir, snp_symbols)
+                complete_unit(work_unit, result, write_result, conversion_manifest, deferred_records, flush_results,
+                              flush_units)
+            flush_deferred(flush_results, deferred_records, conversion_manifest)
+            return
+
+        semaphore = multiprocessing.Semaphore(max_writes)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                                    initargs=(semaphore,)) as executor:
+            # Only a few units per worker are submitted ahead, the results wait here until the units before them are
+            # done
+            pending = collections.deque()
+            unit_index = 0
+            while unit_index < len(work_units) or len(pending) > 0:
+                while unit_index < len(work_units) and len(pending) < workers * PENDING_UNITS_PER_WORKER:
+                    work_unit = work_units[unit_index]
+                    pending.append((work_unit, executor.submit(convert_date, work_unit['zip'],
+                                                               work_unit['date_info'], dest_dir, snp_symbols)))
+                    unit_index += 1
+                (work_unit, future) = pending.popleft()
+                complete_unit(work_unit, future.result(), write_result, conversion_manifest, deferred_records,
+                              flush_results, flush_units)
+        flush_deferred(flush_results, deferred_records, conversion_manifest)
+    finally:
+        conversion_manifest.close()
+
+
+def init_worker(semaphore):
+    global write_semaphore
+    write_semaphore = semaphore
+
+
+@contextlib.contextmanager
+def output_writes():
+    # Wraps a write of finished output to disk, the work that builds it runs in all of the workers at once
+    if write_semaphore is None:
+        yield
+        return
+    with write_semaphore:
+        yield
+
+
+def get_work_units(source_dir, get_files_from_zip_by_date):
+    work_units = []
+    for filename in os.listdir(source_dir):
+        if not filename.endswith('.zip'):
+            continue
+        zip_path = os.path.join(source_dir, filename)
+        files_by_date = get_files_from_zip_by_date(zip_path)
+        with zipfile.ZipFile(zip_path) as zip_file_obj:
+            for date_key in files_by_date:
+                date_info = files_by_date[date_key]
+                member_names = [date_info[file_type] for file_type in date_info
+                                if file_type not in ['year', 'month', 'day']]
+                work_units.append({'key': manifest.get_unit_key(zip_path, date_info['year'], date_info['month'],
+                                                                date_info['day']),
+                                   'zip': zip_path, 'date_info': date_info,
+                                   'sources': manifest.get_member_hashes(zip_file_obj, member_names)})
+    return sorted(work_units, key=lambda work_unit: (work_unit['date_info']['year'], work_unit['date_info']['month'],
+                                                     work_unit['date_info']['day'], work_unit['key']))
+
+
+def complete_unit(work_unit, result, write_result, conversion_manifest, deferred_records=None, flush_results=None,
+                  flush_units=UNITS_PER_FLUSH):
+    outputs = list(result.get('outputs', []))
+    if write_result is not None:
+        outputs.extend(write_result(result['rows']))
+    if deferred_records is not None:
+        deferred_records.append((work_unit['key'], work_unit['sources'], outputs))
+        if len(deferred_records) >= flush_units:
+            flush_deferred(flush_results, deferred_records, conversion_manifest)
+    else:
+        conversion_manifest.record(work_unit['key'], work_unit['sources'], outputs)
+    print(f'Converted {work_unit["key"]}')
+
+
+def flush_deferred(flush_results, deferred_records, conversion_manifest):
+    if flush_results is None or len(deferred_records) == 0:
+        return
+    flush_results()
+    for (unit_key, sources, outputs) in deferred_records:
+        conversion_manifest.record(unit_key, sources, outputs)
+    deferred_records.clear()
+
+
+if __name__ == '__main__':
+    # ingest.py <minute|daily> [source_dir] [workers]
+    import sys
+    import time
+    import ReadData
+    import ReadDataDaily
+
+    converters = {'minute': ReadData, 'daily': ReadDataDaily}
+    converter = converters[sys.argv[1] if len(sys.argv) > 1 else 'minute']
+    src_dir = converter.SOURCE_DIR
+    workers = os.cpu_count()
+    if len(sys.argv) > 2:
+        src_dir = sys.argv[2]
+    if len(sys.argv) > 3:
+        workers = int(sys.argv[3])
+
+    start_time = time.time()
+    snp_500_symbols = converter.get_snp_symbols(converter.SNP_SYMBOLS_FILE_PATH)
+    converter.process_source_dir(src_dir, converter.DEST_DIR, snp_500_symbols, workers)
+    end_time = time.time()
+    print("Processing took", end_time - start_time, "seconds")
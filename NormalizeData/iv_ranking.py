@@ -0,0 +1,42 @@
+import os
+import pandas as pd
+import day_files
+
+# The tradable options window (min_days, max_days, maximum_iv) the simulator ranks by default, FilterCSVs writes the
+# ranking of this window next to every filtered day
+RANKING_WINDOW = (1, 8, 4)
+
+
+def rank_options_by_iv(options_data):
+    # Average IV of the closest to strike options of every (underlying, expiration), highest first
+    closest_to_strike_options = get_closest_to_strike_options(options_data)
+    ranking = closest_to_strike_options.groupby(['UnderlyingSymbol', 'Expiration'], observed=True)['IV'].mean()
+    ranking.sort_values(inplace=True, ascending=False)
+    return ranking
+
+
+def get_closest_to_strike_options(options_data):
+    # The options with the strike closest to the stock price, the distance is the minimum over all of the
+    # expirations of the underlying
+    price_difference = (options_data['UnderlyingPrice'] - options_data['Strike']).abs()
+    min_price_difference = price_difference.groupby(options_data['UnderlyingSymbol'], observed=True).transform('min')
+    return options_data[min_price_difference >= price_difference]
+
+
+def get_ranking_path(dir_path, year, month, day, extension='.csv'):
+    # extension is the one of the options file of the day, see day_files.DAY_FORMAT_EXTENSIONS
+    return os.path.join(dir_path, f'ivranking_{year}{month:02}{day:02}{extension}')
+
+
+def write_ranking(ranking, ranking_path):
+    ranking.reset_index().to_csv(ranking_path, index=False)
+
+
+def read_ranking(ranking_source, snp_symbols):
+    # ranking_source is a path or an open file, the order of the file is the ranking order
+    if day_files.is_arrow_file(ranking_source):
+        ranking = day_files.read_frame(ranking_source)
+    else:
+        ranking = pd.read_csv(ranking_source, parse_dates=['Expiration'])
+    ranking = ranking[ranking.UnderlyingSymbol.isin(snp_symbols)]
+    return ranking.set_index(['UnderlyingSymbol', 'Expiration'])['IV']
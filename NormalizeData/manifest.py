@@ -0,0 +1,95 @@
+import os
+import json
+import zipfile
+import sqlite3
+import datetime
+
+CURRENT = 'current'
+CHANGED = 'changed'
+NEW = 'new'
+
+
+class ConversionManifest:
+    # The units converted into a destination (a date of a source zip): the CRC and size of the source members a unit
+    # was converted from, the files written for it and when. A unit stays current while its source members are
+    # unchanged. The manifest is a sqlite file so recording a unit does not rewrite the others, a None manifest_path
+    # keeps the units in memory only
+    def __init__(self, manifest_path):
+        self.connection = None
+        self.units = dict()
+        if manifest_path is None:
+            return
+        manifest_dir = os.path.dirname(manifest_path)
+        if manifest_dir and not os.path.exists(manifest_dir):
+            os.makedirs(manifest_dir, exist_ok=True)
+        self.connection = sqlite3.connect(manifest_path)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS units '
+                                    '(unit TEXT PRIMARY KEY, sources TEXT, converted_at TEXT)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS outputs (unit TEXT, path TEXT)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS outputs_unit ON outputs (unit)')
+        for (unit, sources) in self.connection.execute('SELECT unit, sources FROM units'):
+            self.units[unit] = json.loads(sources)
+
+    def get_state(self, unit, sources):
+        if unit not in self.units:
+            return NEW
+        return CURRENT if self.units[unit] == sources else CHANGED
+
+    def record(self, unit, sources, outputs):
+        self.units[unit] = sources
+        if self.connection is None:
+            return
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO units VALUES (?, ?, ?)',
+                                    (unit, json.dumps(sources, sort_keys=True),
+                                     datetime.datetime.now().isoformat(timespec='seconds')))
+            self.connection.execute('DELETE FROM outputs WHERE unit = ?', (unit,))
+            self.connection.executemany('INSERT INTO outputs VALUES (?, ?)',
+                                        [(unit, output_path) for output_path in sorted(set(outputs))])
+
+    def get_outputs(self, unit):
+        if self.connection is None:
+            return []
+        return [output_path for (output_path,) in
+                self.connection.execute('SELECT path FROM outputs WHERE unit = ? ORDER BY path', (unit,))]
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def get_member_hashes(zip_file_obj, member_names):
+    # The CRC and size the zip keeps for every member, read without decompressing them
+    member_hashes = dict()
+    for member_name in member_names:
+        member_info = zip_file_obj.getinfo(member_name)
+        member_hashes[member_name] = f'{member_info.CRC:08x}:{member_info.file_size}'
+    return member_hashes
+
+
+def are_outputs_written(outputs, archive_members=None):
+    # An output is a file, or <zip>:<member> for rows written into an archive. archive_members keeps the members of
+    # the zips read, for the checks of many units against the same zips
+    if archive_members is None:
+        archive_members = dict()
+    for output_path in outputs:
+        if '.zip:' not in output_path:
+            if not os.path.exists(output_path):
+                return False
+            continue
+        (zip_path, member_name) = output_path.split('.zip:', 1)
+        zip_path = f'{zip_path}.zip'
+        if zip_path not in archive_members:
+            archive_members[zip_path] = set()
+            if os.path.exists(zip_path):
+                with zipfile.ZipFile(zip_path) as zip_file_obj:
+                    archive_members[zip_path] = set(zip_file_obj.namelist())
+        if member_name not in archive_members[zip_path]:
+            return False
+    return True
+
+
+def get_unit_key(zip_path, year, month, day):
+    return f'{os.path.basename(zip_path)}:{year}{month:02}{day:02}'
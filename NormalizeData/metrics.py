@@ -0,0 +1,83 @@
+import os
+import re
+import json
+import time
+import contextlib
+
+PHASES = ['load', 'filter', 'iv_ranking', 'selection', 'sizing', 'settlement', 'bookkeeping']
+
+
+class PhaseTimer:
+    # Wall time and counters of the simulation phases for the current day. end_day appends them as one json line to
+    # metrics_path (when given) and starts the next day from zero
+    def __init__(self, metrics_path=None):
+        self.metrics_path = metrics_path
+        self.phases = dict()
+        self.counters = dict()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - phase_start
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def end_day(self, day_key):
+        record = {'date': day_key, 'phases': self.phases, 'counters': self.counters}
+        if self.metrics_path is not None:
+            with open(self.metrics_path, 'a') as metrics_file:
+                metrics_file.write(json.dumps(record))
+                metrics_file.write('\n')
+        self.phases = dict()
+        self.counters = dict()
+        return record
+
+
+def get_metrics_path(metrics_dir, bid_ratio=None):
+    if metrics_dir is None:
+        return None
+    if bid_ratio is None:
+        return os.path.join(metrics_dir, 'Metrics.jsonl')
+    return os.path.join(metrics_dir, f'Metrics_bid_{bid_ratio}.jsonl')
+
+
+def read_metrics(metrics_dir):
+    records = []
+    for filename in sorted(os.listdir(metrics_dir)):
+        if re.fullmatch('Metrics(_.+)?\\.jsonl', filename):
+            with open(os.path.join(metrics_dir, filename)) as metrics_file:
+                for line in metrics_file:
+                    records.append(json.loads(line))
+    return records
+
+
+def summarize(records):
+    # One row per phase with the total seconds, the average per day and the share of the measured time, followed
+    # by the totals of the counters
+    phase_totals = dict()
+    counter_totals = dict()
+    days = set()
+    for record in records:
+        days.add(record['date'])
+        for (name, seconds) in record['phases'].items():
+            phase_totals[name] = phase_totals.get(name, 0) + seconds
+        for (name, value) in record['counters'].items():
+            counter_totals[name] = counter_totals.get(name, 0) + value
+
+    total_seconds = sum(phase_totals.values())
+    names = [name for name in PHASES if name in phase_totals] + \
+            sorted(name for name in phase_totals if name not in PHASES)
+    lines = [f'{"phase":<18}{"total [s]":>12}{"per day [ms]":>14}{"share":>8}']
+    for name in names:
+        share = phase_totals[name] / total_seconds if total_seconds > 0 else 0
+        lines.append(f'{name:<18}{phase_totals[name]:>12.3f}{1000 * phase_totals[name] / max(len(days), 1):>14.2f}'
+                     f'{share:>8.1%}')
+    lines.append(f'{"total":<18}{total_seconds:>12.3f}{1000 * total_seconds / max(len(days), 1):>14.2f}'
+                 f'{1 if total_seconds > 0 else 0:>8.1%}')
+    for name in sorted(counter_totals):
+        lines.append(f'{name:<18}{counter_totals[name]:>12}')
+    return '\n'.join(lines)
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+# One written option, the expiration is the key of the array holding it
+POSITION_DTYPE = np.dtype([('symbol', 'S32'), ('price', '<f8'), ('type', 'S4'), ('underlying_symbol', 'S8'),
+                           ('strike', '<f8'), ('write_date', 'S10'), ('underlying_price', '<f8'), ('size', '<i8')])
+# numpy cuts longer values of the byte string fields to their length, such trades are refused instead
+STRING_FIELDS = [(name, POSITION_DTYPE[name].itemsize) for name in POSITION_DTYPE.names
+                 if POSITION_DTYPE[name].kind == 'S']
+
+
+class PositionBook:
+    # The open positions of one parameters combination, every expiration holds a structured array of its written
+    # options in the order they were written. The written options come in as the trade dicts of process_options_file
+    # and are turned back to dicts only when they are settled. The expirations of every underlying are indexed as
+    # well, for the checks of an underlying over a range of expirations
+    def __init__(self):
+        self.expirations = dict()
+        self.underlying_expirations = dict()
+
+    def __contains__(self, expiration):
+        return expiration in self.expirations
+
+    def add(self, expiration, trades):
+        records = to_records(trades)
+        if expiration in self.expirations:
+            records = np.concatenate([self.expirations[expiration], records])
+        self.expirations[expiration] = records
+        for underlying_symbol in set(records['underlying_symbol'].tolist()):
+            self.underlying_expirations.setdefault(underlying_symbol.decode(), set()).add(expiration)
+
+    def options(self, expiration):
+        return [to_trade(record, expiration) for record in self.expirations.get(expiration, [])]
+
+    def remove(self, expiration, symbols=None):
+        # Without symbols all of the options of the expiration are removed
+        if symbols is not None:
+            records = self.expirations[expiration]
+            records = records[~np.isin(records['symbol'], [symbol.encode() for symbol in symbols])]
+            if len(records) > 0:
+                self.expirations[expiration] = records
+                self.index_underlyings()
+                return
+        del self.expirations[expiration]
+        self.index_underlyings()
+
+    def get_underlying_expiration(self, underlying_symbol, first_expiration, last_expiration):
+        # The first expiration between first_expiration and last_expiration holding options of the underlying
+        expirations = [expiration for expiration in self.underlying_expirations.get(underlying_symbol, ())
+                       if first_expiration <= expiration <= last_expiration]
+        return min(expirations) if len(expirations) > 0 else None
+
+    def index_underlyings(self):
+        self.underlying_expirations = dict()
+        for (expiration, records) in self.expirations.items():
+            for underlying_symbol in set(records['underlying_symbol'].tolist()):
+                self.underlying_expirations.setdefault(underlying_symbol.decode(), set()).add(expiration)
+
+    def cost(self):
+        # Summed one position after the other like the dict based book did, so the totals stay the same to the cent
+        if len(self.expirations) == 0:
+            return 0
+        costs = np.concatenate([records['price'] * records['size'] for records in self.expirations.values()])
+        if len(costs) == 0:
+            return 0
+        return np.cumsum(costs)[-1].item()
+
+
+def to_records(trades):
+    records = np.empty(len(trades), dtype=POSITION_DTYPE)
+    for index, trade in enumerate(trades):
+        for (name, length) in STRING_FIELDS:
+            if len(trade[name].encode()) > length:
+                raise Exception(f'The {name} {trade[name]} of a position is longer than {length} characters.')
+        records[index] = (trade['symbol'].encode(), trade['price'], trade['type'].encode(),
+                          trade['underlying_symbol'].encode(), trade['strike'], trade['write_date'].encode(),
+                          trade['underlying_price'], trade['size'])
+    return records
+
+
+def to_trade(record, expiration):
+    return {'symbol': record['symbol'].decode(),
+            'price': record['price'].item(),
+            'type': record['type'].decode(),
+            'expiration': pd.Timestamp(expiration),
+            'underlying_symbol': record['underlying_symbol'].decode(),
+            'strike': record['strike'].item(),
+            'write_date': record['write_date'].decode(),
+            'underlying_price': record['underlying_price'].item(),
+            'size': record['size'].item()}
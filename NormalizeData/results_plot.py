@@ -0,0 +1,173 @@
+import os
+import json
+import concurrent.futures
+import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+RESULTS_FORMATS = ['png', 'html']
+HTML_FILENAME = 'Results.html'
+
+
+def plot_results(daily_status, ratio_params, bid_ratios, max_batch, results_dir, workers=1, results_format='png'):
+    # Charts of the daily profit of every (bid ratio, batch), one line per stock ratio. png renders two images per
+    # chart in worker processes, html writes all of the charts to one interactive page. Returns the written files
+    status_frame = get_status_frame(daily_status)
+    if results_format == 'html':
+        html_path = os.path.join(results_dir, HTML_FILENAME)
+        write_html(status_frame, ratio_params, bid_ratios, max_batch, html_path)
+        return [html_path]
+
+    chart_specs = get_chart_specs(status_frame, ratio_params, bid_ratios, max_batch, results_dir)
+    if workers <= 1 or len(chart_specs) <= 1:
+        return [render_chart(chart_spec) for chart_spec in chart_specs]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(chart_specs))) as executor:
+        return list(executor.map(render_chart, chart_specs))
+
+
+def get_status_frame(daily_status):
+    # One row per (date, stock ratio, bid ratio, batch), the day numbers of daily_status are datetime64[D] values
+    rows = [(day_number, stock_ratio, bid_ratio, batch_index, profit)
+            for (day_number, day_status) in daily_status.items()
+            for (stock_ratio, ratio_status) in day_status.items()
+            for (bid_ratio, bid_status) in ratio_status.items()
+            for (batch_index, profit) in bid_status.items()]
+    status_frame = pd.DataFrame(rows, columns=['date', 'stock_ratio', 'bid_ratio', 'batch', 'profit'])
+    status_frame['date'] = status_frame['date'].values.astype('datetime64[D]').astype('datetime64[ns]')
+    return status_frame.sort_values('date', kind='stable')
+
+
+def get_chart_profits(status_frame, bid_ratio, batch_index, ratio_params):
+    # The dates x stock ratios profits of a chart
+    chart_frame = status_frame[(status_frame['bid_ratio'] == bid_ratio) & (status_frame['batch'] == batch_index)]
+    return chart_frame.pivot(index='date', columns='stock_ratio', values='profit').reindex(columns=ratio_params)
+
+
+def get_chart_specs(status_frame, ratio_params, bid_ratios, max_batch, results_dir):
+    # Every chart is split in two images, the first, third, ... stock ratios are drawn on the _even image and the
+    # others on the _odd image
+    chart_specs = []
+    for bid_ratio in bid_ratios:
+        for batch_index in range(max_batch):
+            profits = get_chart_profits(status_frame, bid_ratio, batch_index, ratio_params)
+            dates = profits.index.to_pydatetime()
+            for (even, first_ratio) in [('_odd', 1), ('_even', 0)]:
+                chart_specs.append({
+                    'path': os.path.join(results_dir, f'Bid_{bid_ratio}_Batch_{batch_index + 1}{even}.png'),
+                    'title': f'Bid Ratio = {bid_ratio}, Batch = {batch_index + 1}',
+                    'dates': dates,
+                    'series': [(f'Stock Ratio={stock_ratio}', profits[stock_ratio].values)
+                               for stock_ratio in ratio_params[first_ratio::2]]})
+    return chart_specs
+
+
+def render_chart(chart_spec):
+    # A figure of its own on the Agg canvas, nothing is left in pyplot between the charts
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot(1, 1, 1)
+    for (label, values) in chart_spec['series']:
+        axes.plot(chart_spec['dates'], values, label=label)
+    axes.legend(loc='upper left')
+    axes.set_xlabel('Date')
+    axes.set_ylabel('Profit / Loss (USD)')
+    axes.set_title(chart_spec['title'])
+    figure.savefig(chart_spec['path'])
+    return chart_spec['path']
+
+
+def write_html(status_frame, ratio_params, bid_ratios, max_batch, html_path):
+    dates = sorted(status_frame['date'].unique())
+    charts = []
+    for bid_ratio in bid_ratios:
+        for batch_index in range(max_batch):
+            profits = get_chart_profits(status_frame, bid_ratio, batch_index, ratio_params).reindex(dates)
+            charts.append({'title': f'Bid Ratio = {bid_ratio}, Batch = {batch_index + 1}',
+                           'series': [{'label': f'Stock Ratio={stock_ratio}',
+                                       'values': [None if pd.isna(profit) else profit
+                                                  for profit in profits[stock_ratio].tolist()]}
+                                      for stock_ratio in ratio_params]})
+    data = {'dates': pd.DatetimeIndex(dates).strftime('%d/%m/%Y').tolist(), 'charts': charts}
+    with open(html_path, 'w') as html_file:
+        html_file.write(HTML_TEMPLATE.replace('{{data}}', json.dumps(data)))
+
+
+# A single page without dependencies: pick a chart, toggle its stock ratios and hover for the profits of a date
+HTML_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Simulation results</title>
+<style>
+body { font-family: sans-serif; }
+#legend label { margin-right: 12px; }
+#plot { border: 1px solid #ccc; }
+</style>
+</head>
+<body>
+<select id="chart"></select>
+<div id="legend"></div>
+<svg id="plot" width="1000" height="500"></svg>
+<pre id="values"></pre>
+<script>
+const data = {{data}};
+const colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22',
+                '#17becf', '#000000'];
+const width = 1000, height = 500, margin = 50;
+const select = document.getElementById('chart');
+const legend = document.getElementById('legend');
+const plot = document.getElementById('plot');
+const values = document.getElementById('values');
+let hidden = new Set();
+
+data.charts.forEach((chart, index) => select.add(new Option(chart.title, index)));
+select.onchange = () => { hidden = new Set(); draw(); };
+
+function draw() {
+  const chart = data.charts[select.value];
+  legend.innerHTML = '';
+  chart.series.forEach((series, index) => {
+    const label = document.createElement('label');
+    label.style.color = colors[index % colors.length];
+    label.innerHTML = '<input type="checkbox"' + (hidden.has(index) ? '' : ' checked') + '> ' + series.label;
+    label.firstChild.onchange = () => { hidden.has(index) ? hidden.delete(index) : hidden.add(index); draw(); };
+    legend.appendChild(label);
+  });
+  const shown = chart.series.filter((series, index) => !hidden.has(index));
+  const all = [].concat(...shown.map(series => series.values)).filter(value => value !== null);
+  const low = Math.min(0, ...all), high = Math.max(0, ...all);
+  const x = index => margin + index * (width - 2 * margin) / Math.max(data.dates.length - 1, 1);
+  const y = value => height - margin - (value - low) * (height - 2 * margin) / Math.max(high - low, 1e-9);
+  let svg = '<line x1="' + margin + '" x2="' + (width - margin) + '" y1="' + y(0) + '" y2="' + y(0) +
+            '" stroke="#999"/>';
+  svg += '<text x="5" y="' + y(high) + '">' + high.toFixed(0) + '</text>';
+  svg += '<text x="5" y="' + y(low) + '">' + low.toFixed(0) + '</text>';
+  svg += '<text x="' + margin + '" y="' + (height - 10) + '">' + data.dates[0] + '</text>';
+  svg += '<text x="' + (width - margin - 80) + '" y="' + (height - 10) + '">' + data.dates[data.dates.length - 1] +
+         '</text>';
+  chart.series.forEach((series, index) => {
+    if (hidden.has(index)) return;
+    const points = series.values.map((value, date) => value === null ? null : x(date) + ',' + y(value))
+                                .filter(point => point !== null);
+    svg += '<polyline fill="none" stroke="' + colors[index % colors.length] + '" points="' + points.join(' ') + '"/>';
+  });
+  svg += '<line id="cursor" y1="' + margin + '" y2="' + (height - margin) + '" stroke="#bbb"/>';
+  plot.innerHTML = svg;
+}
+
+plot.onmousemove = event => {
+  const chart = data.charts[select.value];
+  const step = (width - 2 * margin) / Math.max(data.dates.length - 1, 1);
+  const date = Math.min(Math.max(Math.round((event.offsetX - margin) / step), 0), data.dates.length - 1);
+  const cursor = document.getElementById('cursor');
+  cursor.setAttribute('x1', margin + date * step);
+  cursor.setAttribute('x2', margin + date * step);
+  values.textContent = data.dates[date] + '\\n' + chart.series.filter((series, index) => !hidden.has(index))
+    .map(series => series.label + ': ' + series.values[date]).join('\\n');
+};
+
+draw();
+</script>
+</body>
+</html>
+'''
@@ -0,0 +1,64 @@
+import pandas as pd
+
+# The columns of the vendor files the scripts use, the other columns are not parsed. Prices stay float64, the
+# converters write them scaled to the output files and float32 would change the written values
+OPTION_DTYPES = {'UnderlyingSymbol': 'category', 'UnderlyingPrice': 'float64', 'OptionSymbol': 'object',
+                 'Type': 'category', 'Expiration': 'object', 'Strike': 'float64', 'Last': 'float64',
+                 'Bid': 'float64', 'Ask': 'float64', 'Volume': 'int64', 'OpenInterest': 'int64', 'IV': 'float64'}
+STOCK_DTYPES = {'symbol': 'category', 'open': 'float64', 'high': 'float64', 'low': 'float64', 'close': 'float64',
+                'volume': 'int64'}
+# The Expiration format of the minute vendor files, the daily vendor files use ISO dates
+EXPIRATION_FORMAT = '%m/%d/%Y'
+DAILY_EXPIRATION_FORMAT = '%Y-%m-%d'
+# 'pyarrow' parses with multiple threads (pandas 1.4 and later)
+CSV_ENGINE = 'c'
+# Rows parsed at a time when only the rows of a symbols universe are kept
+READ_CHUNK_ROWS = 50000
+ARROW_TYPES = {'category': 'string', 'object': 'string', 'float64': 'float64', 'int64': 'int64'}
+
+
+def read_options(source, engine=None, symbols=None):
+    # source is a path or an open file. When symbols is given only the rows of these underlyings are kept
+    return read_columns(source, OPTION_DTYPES, engine, 'UnderlyingSymbol', symbols)
+
+
+def read_stock_quotes(source, columns=None, engine=None, symbols=None):
+    dtypes = STOCK_DTYPES if columns is None else {column: STOCK_DTYPES[column] for column in columns}
+    return read_columns(source, dtypes, engine, 'symbol', symbols)
+
+
+def read_columns(source, dtypes, engine=None, symbol_column=None, symbols=None):
+    engine = engine if engine is not None else CSV_ENGINE
+    if engine == 'pyarrow' and symbols is not None:
+        return read_arrow_batches(source, dtypes, symbol_column, symbols)
+    try:
+        if symbols is None:
+            return pd.read_csv(source, usecols=list(dtypes), dtype=dtypes, engine=engine)
+
+        # The rows of other symbols are dropped chunk by chunk, at most a chunk of the whole market is held in memory
+        chunks = [chunk[chunk[symbol_column].isin(symbols)]
+                  for chunk in pd.read_csv(source, usecols=list(dtypes), dtype=dtypes, chunksize=READ_CHUNK_ROWS)]
+    except pd.errors.EmptyDataError:
+        return get_empty_frame(dtypes)
+    if len(chunks) == 0:
+        return get_empty_frame(dtypes)
+    # The categories of the chunks differ, they are set again on the rows kept
+    return pd.concat(chunks).astype(dtypes)
+
+
+def get_empty_frame(dtypes):
+    return pd.DataFrame({column: pd.Series(dtype=dtype) for (column, dtype) in dtypes.items()})
+
+
+def read_arrow_batches(source, dtypes, symbol_column, symbols):
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.compute as pa_compute
+
+    column_types = {column: getattr(pa, ARROW_TYPES[dtype])() for (column, dtype) in dtypes.items()}
+    reader = pa_csv.open_csv(source, convert_options=pa_csv.ConvertOptions(include_columns=list(dtypes),
+                                                                           column_types=column_types))
+    symbols_set = pa.array(sorted(symbols), type=pa.string())
+    batches = [batch.filter(pa_compute.is_in(batch.column(symbol_column), value_set=symbols_set))
+               for batch in reader]
+    return pa.Table.from_batches(batches, schema=reader.schema).to_pandas().astype(dtypes)
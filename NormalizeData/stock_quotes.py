@@ -0,0 +1,109 @@
+import os
+import re
+import hashlib
+import collections
+import numpy as np
+import schema
+import day_files
+
+MAX_RESIDENT_DAYS = 8
+
+
+class StockQuoteStore:
+    # Close prices of the stockquotes_YYYYMMDD.csv (or .arrow, see day_files) files in stocks_dir. Every day is read once and kept as a
+    # symbol -> row index over its closes, at most max_days days are kept in memory (least recently used are dropped).
+    # When binary_dir is given, the closes of a csv day are converted once to a .npy file there and memory-mapped on
+    # later loads instead of parsing the csv again. Like chain_cache, the .npy file is named by the csv path, size
+    # and modification time, so a changed csv is converted again
+    def __init__(self, stocks_dir, max_days=MAX_RESIDENT_DAYS, binary_dir=None):
+        self.stocks_dir = stocks_dir
+        self.max_days = max_days
+        self.binary_dir = binary_dir
+        self.days = collections.OrderedDict()
+
+    def close(self, symbol, curr_date):
+        (symbol_rows, closes) = self.get_day(curr_date)
+        row = symbol_rows.get(symbol)
+        if row is None:
+            return None
+        return closes[row]
+
+    def get_day(self, curr_date):
+        day_key = get_day_key(curr_date)
+        if day_key in self.days:
+            self.days.move_to_end(day_key)
+            return self.days[day_key]
+
+        day_quotes = self.load_day(day_key)
+        self.days[day_key] = day_quotes
+        if len(self.days) > self.max_days:
+            self.days.popitem(last=False)
+        return day_quotes
+
+    def load_day(self, day_key):
+        arrow_path = os.path.join(self.stocks_dir, f'stockquotes_{day_key}{day_files.ARROW_EXTENSION}')
+        if os.path.exists(arrow_path):
+            stocks = day_files.read_frame(arrow_path)
+            return index_symbols(stocks['symbol'].astype(str).values), stocks['close'].values.astype(float)
+
+        csv_path = os.path.join(self.stocks_dir, f'stockquotes_{day_key}.csv')
+        binary_path = None
+        if self.binary_dir is not None:
+            binary_prefix = get_binary_prefix(csv_path, day_key)
+            binary_path = os.path.join(self.binary_dir, f'{binary_prefix}_{get_binary_key(csv_path)}.npy')
+            if os.path.exists(binary_path):
+                quotes = np.load(binary_path, mmap_mode='r')
+                return index_symbols(quotes['symbol']), quotes['close']
+
+        stocks = schema.read_stock_quotes(csv_path, ['symbol', 'close'])
+        symbols = stocks['symbol'].astype(str).values
+        closes = stocks['close'].values.astype(float)
+        if binary_path is not None:
+            write_binary(binary_path, binary_prefix, symbols, closes)
+        return index_symbols(symbols), closes
+
+
+def get_day_key(curr_date):
+    return f'{curr_date.year}{curr_date.month:02}{curr_date.day:02}'
+
+
+def get_binary_prefix(csv_path, day_key):
+    # The day and the folder it is read from
+    source_hash = hashlib.sha1(os.path.normcase(os.path.abspath(csv_path)).encode()).hexdigest()[:12]
+    return f'stockquotes_{day_key}_{source_hash}'
+
+
+def get_binary_key(csv_path):
+    csv_stat = os.stat(csv_path)
+    return f'{csv_stat.st_size}_{csv_stat.st_mtime_ns}'
+
+
+def index_symbols(symbols):
+    # The first row of a symbol wins, as when filtering the stocks file by symbol
+    symbol_rows = dict()
+    for row, symbol in enumerate(symbols.tolist()):
+        if symbol not in symbol_rows:
+            symbol_rows[symbol] = row
+    return symbol_rows
+
+
+def write_binary(binary_path, binary_prefix, symbols, closes):
+    binary_dir = os.path.dirname(binary_path)
+    if binary_dir and not os.path.exists(binary_dir):
+        os.makedirs(binary_dir, exist_ok=True)
+
+    # Older files of the same day and folder were converted from a csv that changed since
+    for filename in os.listdir(binary_dir or '.'):
+        if re.fullmatch(f'{re.escape(binary_prefix)}_[0-9]+_[0-9]+\\.npy', filename):
+            try:
+                os.remove(os.path.join(binary_dir, filename))
+            except OSError:
+                pass
+
+    symbol_width = max([len(symbol) for symbol in symbols] + [1])
+    quotes = np.empty(len(symbols), dtype=[('symbol', f'U{symbol_width}'), ('close', '<f8')])
+    quotes['symbol'] = symbols
+    quotes['close'] = closes
+    temp_path = f'{binary_path}.{os.getpid()}.tmp.npy'
+    np.save(temp_path, quotes)
+    os.replace(temp_path, binary_path)
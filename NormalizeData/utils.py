@@ -2,37 +2,40 @@ import os
 import zipfile
 from datetime import date
 
+# The compressions an ArchiveWriter can write, Lean reads stored and deflate members
+COMPRESSION_METHODS = {'stored': zipfile.ZIP_STORED, 'deflate': zipfile.ZIP_DEFLATED, 'bzip2': zipfile.ZIP_BZIP2,
+                       'lzma': zipfile.ZIP_LZMA}
+# Day numbers count the days since 1970-01-01, the unit of numpy datetime64[D]
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
 def ensure_dir_exist(dir_path):
      if not os.path.exists(dir_path):
         os.makedirs(dir_path)
 
-def archive_dir_files(path):
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            archive(os.path.join(root, file))
 
-def archive_dir_folders(path):
-    for root, dirs, files in os.walk(path):
-        for dr in dirs:
-            archive(os.path.join(root, dr))
+class ArchiveWriter:
+    # Writes members straight into a zip (a path or a binary file object), pandas writes the csv rows into the member
+    # without a file on disk.
+    # compresslevel is the zlib (or bzip2) level of the members, None keeps the default of the compression
+    def __init__(self, zip_path, mode='w', compression='deflate', compresslevel=None):
+        self.zip_file_handle = zipfile.ZipFile(zip_path, mode, COMPRESSION_METHODS[compression],
+                                               compresslevel=compresslevel)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
+    def write_frame(self, member_name, data, index=False):
+        with self.zip_file_handle.open(member_name, 'w') as member_file:
+            data.to_csv(member_file, index=index)
 
-def archive(path):
-    zip_file_name=f'{os.path.splitext(path)[0]}.zip'
-    zip_file_handle = zipfile.ZipFile(zip_file_name, 'a', zipfile.ZIP_DEFLATED)
+    def write_text(self, member_name, text):
+        self.zip_file_handle.writestr(member_name, text)
 
-    if os.path.isdir(path):
-        for root, dirs, files in os.walk(path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                zip_file_handle.write(file_path, arcname=os.path.basename(file))
-                os.remove(file_path)
-        os.rmdir(path)
-    else:
-        zip_file_handle.write(path, arcname=os.path.basename(path))
-        os.remove(path)
-        
-    zip_file_handle.close()
+    def close(self):
+        self.zip_file_handle.close()
 
 
 def parse_date(date_str):
@@ -44,3 +47,18 @@ def parse_date(date_str):
         raise Exception('Invalid date format (supported format is: \'d/m/Y\'.')
     
     return date(int(parts[2]), int(parts[1]), int(parts[0]))
+
+
+def get_day_number(year, month, day):
+    return date(year, month, day).toordinal() - EPOCH_ORDINAL
+
+
+def format_day_number(day_number):
+    # The 'dd/mm/YYYY' date of the results files
+    curr_date = date.fromordinal(day_number + EPOCH_ORDINAL)
+    return f'{curr_date.day:02}/{curr_date.month:02}/{curr_date.year}'
+
+
+def parse_day_key(day_key):
+    curr_date = parse_date(day_key)
+    return get_day_number(curr_date.year, curr_date.month, curr_date.day)